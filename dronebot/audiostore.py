@@ -0,0 +1,197 @@
+import csv
+import json
+import logging
+import mmap
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import unquote
+
+logger = logging.getLogger(__name__.upper())
+
+RATE = 16000
+SAMPLE_BYTES = 2
+SPLITS = ('train', 'dev', 'test')
+
+
+class AudioStoreError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return f"{type(self).__name__}: {self.message}"
+
+
+def decode(path, rate=RATE):
+    """Decodes any file ffmpeg can read to mono int16 PCM at `rate`."""
+    command = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-i', str(path),
+               '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', '1', '-ar', str(rate), '-']
+    try:
+        process = subprocess.run(command, capture_output=True)
+    except FileNotFoundError:
+        raise AudioStoreError("ffmpeg is needed to decode the recordings, e.g. sudo apt install ffmpeg")
+    if process.returncode:
+        raise AudioStoreError(f"Can't decode {path}: {process.stderr.decode(errors='replace').strip()}")
+    return process.stdout
+
+
+def read_csv(path):
+    """Rows of a DeepSpeech CSV as (audio path, file size, transcript), the paths resolved against the CSV."""
+    path = Path(path)
+    rows = list()
+    with open(path, newline='') as file:
+        for line in csv.reader(file):
+            if not line or line[0] == 'wav_filename':
+                continue
+            audio, size, transcript = line
+            rows.append((str(path.parent / unquote(audio)), int(size), transcript))
+    return rows
+
+
+def ingest(source='training/all.csv', store='training/store', workers=None, force=False, decoder=decode):
+    """
+    Decodes every clip of `source` once and writes them back to back into store/audio.pcm, with an index of
+    offset and length per CSV row and the train/dev/test splits of the CSVs next to `source`. Nothing is decoded
+    if the store already holds the same rows, unless `force`.
+    """
+    store = Path(store)
+    rows = read_csv(source)
+    clips = [{'row': row, 'path': path, 'size': size, 'transcript': transcript}
+             for row, (path, size, transcript) in enumerate(rows)]
+    if not force and (store / 'index.json').exists():
+        with open(store / 'index.json') as file:
+            index = json.load(file)
+        if [(clip['path'], clip['size']) for clip in index['clips']] == [(clip['path'], clip['size']) for clip in clips]:
+            logger.info(f"{store} is up to date with {source}")
+            return index
+
+    rows_by_path = dict((clip['path'], clip['row']) for clip in clips)
+    splits = dict()
+    for split in SPLITS:
+        split_csv = Path(source).with_name(f"{split}.csv")
+        if not split_csv.exists():
+            continue
+        try:
+            splits[split] = [rows_by_path[path] for path, _, _ in read_csv(split_csv)]
+        except KeyError as e:
+            raise AudioStoreError(f"{split_csv} has clip {e.args[0]} which is not in {source}")
+
+    started = time.perf_counter()
+    store.mkdir(parents=True, exist_ok=True)
+    offset = 0
+    # ffmpeg runs in its own process, so the decoders run in parallel while the clips are written in order
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool, \
+            open(store / 'audio.pcm.tmp', 'wb') as pcm:
+        for clip, data in zip(clips, pool.map(decoder, (clip['path'] for clip in clips))):
+            pcm.write(data)
+            clip['offset'] = offset
+            clip['length'] = len(data) // SAMPLE_BYTES
+            offset += clip['length']
+    index = {'rate': RATE, 'source': str(source), 'samples': offset, 'clips': clips, 'splits': splits}
+    with open(store / 'index.json.tmp', 'w') as file:
+        json.dump(index, file, indent=1)
+    os.replace(store / 'audio.pcm.tmp', store / 'audio.pcm')
+    os.replace(store / 'index.json.tmp', store / 'index.json')
+    logger.info(f"Decoded {len(clips)} clips, {offset / RATE:.0f}s of audio, "
+                f"into {store} in {time.perf_counter() - started:.1f}s")
+    return index
+
+
+class AudioStore:
+    """
+    Read-only view of an ingested store. The PCM file is memory mapped, so opening it is instant and clips are
+    zero-copy slices: `clip(row)` are int16 samples (np.frombuffer(store.clip(row), np.int16) for numpy),
+    `frames(row)` are 20ms blocks of bytes as VADAudio.vad_collector(frames=...) takes them.
+    """
+
+    def __init__(self, path='training/store'):
+        self.path = Path(path)
+        try:
+            with open(self.path / 'index.json') as file:
+                self.index = json.load(file)
+        except FileNotFoundError:
+            raise AudioStoreError(f"No audio store at {self.path}, run python3 -m dronebot.audiostore first")
+        self.rate = self.index['rate']
+        self.clips = self.index['clips']
+        self.splits = self.index['splits']
+        self.file = open(self.path / 'audio.pcm', 'rb')
+        if self.index['samples']:
+            self.mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.pcm = memoryview(self.mmap)
+        else:
+            self.mmap = None
+            self.pcm = memoryview(b'')
+        if len(self.pcm) != self.index['samples'] * SAMPLE_BYTES:
+            raise AudioStoreError(f"{self.path / 'audio.pcm'} does not match its index, ingest it again")
+        self.samples = self.pcm.cast('h')
+
+    def __len__(self):
+        return len(self.clips)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def rows(self, split=None):
+        if split is None:
+            return list(range(len(self.clips)))
+        if split not in self.splits:
+            raise AudioStoreError(f"No split {split}, the store has {', '.join(self.splits) or 'none'}")
+        return self.splits[split]
+
+    def transcript(self, row):
+        return self.clips[row]['transcript']
+
+    def clip(self, row):
+        clip = self.clips[row]
+        return self.samples[clip['offset']:clip['offset'] + clip['length']]
+
+    def frames(self, row, frame_ms=20):
+        size = self.rate * frame_ms // 1000 * SAMPLE_BYTES
+        clip = self.clips[row]
+        begin, end = clip['offset'] * SAMPLE_BYTES, (clip['offset'] + clip['length']) * SAMPLE_BYTES
+        for start in range(begin, end, size):
+            yield self.pcm[start:min(start + size, end)]
+
+    def items(self, split=None):
+        """(row, transcript, samples) of every clip in `split`, all of them if None."""
+        for row in self.rows(split):
+            yield row, self.transcript(row), self.clip(row)
+
+    def close(self):
+        # views must be released before the map can close
+        self.samples.release()
+        self.pcm.release()
+        if self.mmap is not None:
+            self.mmap.close()
+        self.file.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    from dronebot import config_logging
+
+    parser = argparse.ArgumentParser(description="Decode the labelled recordings once into a memory mapped PCM store")
+    parser.add_argument('source', nargs='?', default='training/all.csv',
+                        help="DeepSpeech CSV of all clips, train/dev/test.csv next to it define the splits. "
+                             "Default: training/all.csv")
+    parser.add_argument('-o', '--store', default='training/store',
+                        help="Directory of the store. Default: training/store")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="Parallel decoders. Default: number of CPUs")
+    parser.add_argument('-f', '--force', action='store_true',
+                        help="Decode again even if the store is up to date")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="Set logging level to DEBUG")
+    ARGS = parser.parse_args()
+    config_logging.config_logging_stdout(logging.DEBUG if ARGS.verbose else logging.INFO)
+    ingest(ARGS.source, ARGS.store, ARGS.jobs, ARGS.force)
+    opened = time.perf_counter()
+    with AudioStore(ARGS.store) as audio:
+        logger.info(f"Opened {len(audio)} clips in {(time.perf_counter() - opened) * 1000:.1f}ms, "
+                    + ", ".join(f"{split} {len(rows)}" for split, rows in audio.splits.items()))
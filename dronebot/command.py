@@ -1,23 +1,34 @@
 import asyncio
 import logging
-import math
 import time
 import traceback
 from abc import abstractmethod, ABCMeta
 
-import numpy as np
-import utm
 from mavsdk import System, action, mission
 
+from dronebot import geodesy, tracing
+from dronebot.geofence import GeofenceError
+from dronebot.missions import MissionManager, mission_item, with_altitude
+from dronebot.offboard import OffboardGuidance
 from dronebot.telem import Telemetry
 
 logger = logging.getLogger(__name__.upper())
 
 
 class BaseCommand(object, metaclass=ABCMeta):
+    category = 'action'
+    supersedes = False
+
     def __init__(self):
         super().__init__()
         self.time_stamp = time.time()
+        self.trace_id = tracing.current_trace.get()
+        self.on_ack = None
+
+    def ack(self):
+        """Signals that the vehicle accepted the command, called once its mavsdk request returned."""
+        if self.on_ack is not None:
+            self.on_ack()
 
     @abstractmethod
     async def __call__(self, drone: System, telem: Telemetry):
@@ -38,26 +49,33 @@ class BaseCommand(object, metaclass=ABCMeta):
 
 
 class MoveCommand(BaseCommand, metaclass=ABCMeta):
-    mission_plan = None
-    altitude = 5
+    category = 'move'
+    supersedes = True
 
     def __init__(self):
         super().__init__()
-        self.mission_plan = MoveCommand.mission_plan
-        self.altitude = MoveCommand.altitude
-
-    async def upload_and_start(self, drone, mission_plan):
-        MoveCommand.mission_plan = mission_plan
-        await drone.mission.clear_mission()
-        await drone.mission.upload_mission(mission_plan)
-        logger.debug("Mission:" + "".join(map(
-            lambda item: f"\n\t{item.latitude_deg}, {item.longitude_deg}, {item.relative_altitude_m}",
-            mission_plan.mission_items)))
-        async for mission_progress in drone.mission.mission_progress():
-            logger.debug(mission_progress)
-            break
-        await self.try_action(drone.mission.start_mission, mission.MissionError)
+
+    async def upload_and_start(self, drone, telem, mission_plan, **setpoint):
+        """
+        Flies `mission_plan` if it is inside the geofence. Commands that can be expressed as a guidance target pass
+        it as `setpoint`, which is streamed through offboard mode instead when that is enabled.
+        """
+        try:
+            telem.geofence.validate(mission_plan)
+        except GeofenceError as e:
+            logger.error(e)
+            return False
+        guidance = OffboardGuidance.of(drone, telem)
+        if setpoint and guidance.enabled and await guidance.steer(plan=mission_plan, **setpoint):
+            # the stored mission is not flown anymore, the next mission command uploads its own
+            MissionManager.of(drone).forget()
+            self.ack()
+            return True
+        await guidance.stop()
+        await MissionManager.of(drone).apply(mission_plan)
+        self.ack()
         await asyncio.sleep(0.1)
+        return True
 
     def __str__(self):
         return f"{self.__class__.__name__} Command"
@@ -70,26 +88,17 @@ class Altitude(MoveCommand):
 
     async def __call__(self, drone, telem):
         logger.info(f"Change target altitude to {self.altitude}m ASL")
-        MoveCommand.altitude = self.altitude
-        if self.mission_plan is not None:
-            items = list()
-            for item in self.mission_plan.mission_items:
-                items.append(mission.MissionItem(
-                    item.latitude_deg, item.longitude_deg, self.altitude,
-                    item.speed_m_s, item.is_fly_through, item.gimbal_pitch_deg, item.gimbal_yaw_deg,
-                    item.camera_action, item.loiter_time_s, item.camera_photo_interval_s
-                ))
-            mission_plan = mission.MissionPlan(items)
+        missions = MissionManager.of(drone)
+        missions.altitude = self.altitude
+        if missions.plan is not None:
+            # the rest of the mission is flown at the new altitude, offboard guidance would leave it
+            await missions.progress()
+            items = with_altitude(missions.remaining_items, self.altitude)
+            await self.upload_and_start(drone, telem, mission.MissionPlan(items))
         else:
             pos = telem.position
-            items = [mission.MissionItem(
-                pos.latitude_deg, pos.longitude_deg, self.altitude,
-                1.0, False, float('nan'), float('nan'),
-                mission.MissionItem.CameraAction.NONE,
-                5.0, float('nan')
-            )]
-            mission_plan = mission.MissionPlan(items)
-        await self.upload_and_start(drone, mission_plan)
+            items = [mission_item(pos.latitude_deg, pos.longitude_deg, self.altitude)]
+            await self.upload_and_start(drone, telem, mission.MissionPlan(items), altitude=self.altitude)
 
 class Heading(MoveCommand):
     def __init__(self, *, heading):
@@ -99,45 +108,71 @@ class Heading(MoveCommand):
     async def __call__(self, drone, telem):
         logger.info(f"Turning to {self.heading}")
         pos_gps = telem.position
-        pos_utm = utm.from_latlon(pos_gps.latitude_deg, pos_gps.longitude_deg)
-        tgt_utm = (pos_utm[0] + math.sin(math.radians(self.heading)) * 5, pos_utm[1] + math.cos(math.radians(self.heading)) * 5)
-        tgt_gps = utm.to_latlon(*tgt_utm, pos_utm[2], pos_utm[3])
-        items = [mission.MissionItem(
-            *tgt_gps, self.altitude,
-            1.0, False, float('nan'), float('nan'),
-            mission.MissionItem.CameraAction.NONE,
-            5.0, float('nan')
-        )]
-        await self.upload_and_start(drone, mission.MissionPlan(items))
+        frame = geodesy.home_frame(pos_gps)
+        tgt_gps = frame.offset(pos_gps.latitude_deg, pos_gps.longitude_deg, self.heading, 5)
+        items = [mission_item(*tgt_gps, MissionManager.of(drone).altitude)]
+        east, north = frame.east_north(*tgt_gps)
+        await self.upload_and_start(drone, telem, mission.MissionPlan(items), east=east, north=north, yaw=self.heading)
 
 class Direct(MoveCommand):
-    def __init__(self, *, position):
+    def __init__(self, *, position, name=None, fixes=None, overhead=1.0):
         super().__init__()
         self.position = position
+        self.name = name
+        self.fixes = fixes
+        self.overhead = overhead
 
     async def __call__(self, drone, telem):
+        if self.position is None:
+            logger.error(f"Unknown fix {self.name}")
+            return
+        pos = telem.position
+        if self.fixes is not None and self.name in self.fixes.points and pos is not None:
+            distance, bearing = self.fixes.relative(self.name, pos.latitude_deg, pos.longitude_deg)
+            if distance < self.overhead:
+                logger.info(f"Already overhead {self.name}")
+                self.ack()
+                return
+            logger.info(f"Direct {self.name}, {distance:.0f}m on {(bearing + 180) % 360:03.0f}")
         logger.info(f"Set enroute towards {self.position.latitude_deg}, {self.position.longitude_deg}")
-        items = [mission.MissionItem(
-            self.position.latitude_deg, self.position.longitude_deg, self.altitude,
-            1.0, False, float('nan'), float('nan'),
-            mission.MissionItem.CameraAction.NONE,
-            5.0, float('nan')
-        )]
-        await self.upload_and_start(drone, mission.MissionPlan(items))
+        items = [mission_item(self.position.latitude_deg, self.position.longitude_deg,
+                              MissionManager.of(drone).altitude)]
+        await self.upload_and_start(drone, telem, mission.MissionPlan(items))
+
+class FollowRoute(MoveCommand):
+    def __init__(self, *, graph, fixes=None, destination=None):
+        super().__init__()
+        self.graph = graph
+        self.fixes = fixes
+        self.destination = destination
+
+    async def __call__(self, drone, telem):
+        fixes = self.fixes
+        if fixes is None:
+            pos = telem.position
+            fixes = self.graph.path(self.graph.nearest(pos.latitude_deg, pos.longitude_deg), self.destination)
+            if fixes is None:
+                logger.error(f"No route to {self.destination}")
+                return
+        logger.info(f"Following route {' - '.join(fixes)}")
+        await self.upload_and_start(drone, telem, self.graph.plan(fixes, MissionManager.of(drone).altitude))
 
 class Takeoff(MoveCommand):
+    supersedes = False
+
     def __init__(self, *, altitude=None):
         super().__init__()
         self.altitude = altitude
 
     async def __call__(self, drone, telem):
         if self.altitude:
-            MoveCommand.altitude = self.altitude
+            MissionManager.of(drone).altitude = self.altitude
             await drone.action.set_takeoff_altitude(self.altitude)
         if not telem.is_armed:
             await self.try_action(drone.action.arm, action.ActionError)
         await asyncio.wait_for(telem.wait_for_armed(), timeout=10)
         await self.try_action(drone.action.takeoff, action.ActionError)
+        self.ack()
         await asyncio.sleep(5)
         await asyncio.wait_for(telem.wait_for_in_air(), timeout=10)
 
@@ -150,18 +185,11 @@ class Land(MoveCommand):
         if self.position is not None:
             logger.info(f"Inbound for landing at {self.position.latitude_deg}, {self.position.longitude_deg}")
             items = [
-                mission.MissionItem(
-                    self.position.latitude_deg, self.position.longitude_deg, 5.0,
-                    1.0, False, float('nan'), float('nan'),
-                    mission.MissionItem.CameraAction.NONE,
-                    5.0, float('nan')),
-                mission.MissionItem(
-                    self.position.latitude_deg, self.position.longitude_deg, 1.0,
-                    1.0, False, float('nan'), float('nan'),
-                    mission.MissionItem.CameraAction.NONE,
-                    5.0, float('nan'))
+                mission_item(self.position.latitude_deg, self.position.longitude_deg, 5.0),
+                mission_item(self.position.latitude_deg, self.position.longitude_deg, 1.0)
             ]
-            await self.upload_and_start(drone, mission.MissionPlan(items))
+            if not await self.upload_and_start(drone, telem, mission.MissionPlan(items)):
+                return
             async for progress in drone.mission.mission_progress():
                 if progress:
                     logger.debug(progress)
@@ -173,14 +201,26 @@ class Land(MoveCommand):
             logger.info("Landing at current position")
         await asyncio.sleep(5)
         await self.try_action(drone.action.land, action.ActionError)
+        self.ack()
+        MissionManager.of(drone).forget()
         await asyncio.wait_for(telem.wait_for_landed(), timeout=30)
         await self.try_action(drone.action.disarm, action.ActionError)
         await asyncio.wait_for(telem.wait_for_disarmed(), timeout=10)
 
 class ReportCommand(BaseCommand, metaclass=ABCMeta):
+    """
+    Conditional commands register their task with the telemetry trigger engine and return immediately.
+    The task runs once, on the first telemetry update that satisfies the condition.
+    """
+    category = 'report'
+
     def __init__(self, *, task):
         super().__init__()
         self.task = task
+        self.trigger = None
+
+    def cancel(self, telem):
+        return self.trigger is not None and telem.triggers.cancel(self.trigger)
 
     def __str__(self):
         return f"{self.__class__.__name__} calling {self.task}"
@@ -188,20 +228,15 @@ class ReportCommand(BaseCommand, metaclass=ABCMeta):
 class ReportPos(ReportCommand):
     def __init__(self, *, position, min_dist=2, task):
         super().__init__(task=task)
-        self.position = np.array(utm.from_latlon(position.latitude_deg, position.longitude_deg)[0:2])
+        self.position = position
         self.min_dist = min_dist
 
     async def __call__(self, drone, telem):
         logger.debug(f"{self.task} waiting to reach {self.position}")
-        while True:
-            pos_utm = np.array(utm.from_latlon(telem.position.latitude_deg, telem.position.longitude_deg)[0:2])
-            dist = np.linalg.norm(self.position - pos_utm)
-            logger.debug(dist)
-            if dist < self.min_dist:
-                break
-            await asyncio.sleep(1)
-        logger.debug(self)
-        await self.task
+        east, north = geodesy.home_frame(telem.position).east_north(self.position.latitude_deg,
+                                                                    self.position.longitude_deg)
+        self.trigger = telem.triggers.at_position(east, north, self.min_dist, self.task)
+        self.ack()
 
 class ReportAlt(ReportCommand):
     def __init__(self, *, altitude, min_diff=0.5, task):
@@ -211,11 +246,8 @@ class ReportAlt(ReportCommand):
 
     async def __call__(self, drone, telem):
         logger.debug(f"{self.task} waiting to reach {self.altitude}m")
-        while abs(self.altitude - telem.altitude) > self.min_diff:
-            # logger.debug(telem.altitude)
-            await asyncio.sleep(1)
-        logger.debug(self)
-        await self.task
+        self.trigger = telem.triggers.at_altitude(self.altitude, self.min_diff, self.task)
+        self.ack()
 
 class ReportTakeoff(ReportCommand):
     def __init__(self, *, task):
@@ -223,9 +255,8 @@ class ReportTakeoff(ReportCommand):
 
     async def __call__(self, drone, telem):
         logger.debug(f"{self.task} waiting for takeoff state")
-        await telem.wait_for_in_air()
-        logger.debug(self)
-        await self.task
+        self.trigger = telem.triggers.on_flag('in_air', True, self.task, current=telem.in_air)
+        self.ack()
 
 class ReportLanded(ReportCommand):
     def __init__(self, *, task):
@@ -233,9 +264,31 @@ class ReportLanded(ReportCommand):
 
     async def __call__(self, drone, telem):
         logger.debug(f"{self.task} waiting for landed state")
-        await telem.wait_for_landed(1)
-        logger.debug(self)
-        await self.task
+        self.trigger = telem.triggers.on_flag('landed', True, self.task, current=telem.is_landed)
+        self.ack()
+
+
+class ReportPosition(BaseCommand):
+    """Reads back the current position relative to the nearest fix."""
+    category = 'report'
+
+    def __init__(self, *, fixes, respond):
+        super().__init__()
+        self.fixes = fixes
+        self.respond = respond
+
+    async def __call__(self, drone, telem):
+        pos = telem.position
+        if pos is None:
+            report = "position unknown"
+        else:
+            report = f"{self.fixes.describe(pos.latitude_deg, pos.longitude_deg)} at {pos.relative_altitude_m:.0f} metres"
+        logger.info(f"Position report: {report}")
+        self.ack()
+        await self.respond(report)
+
+    def __str__(self):
+        return f"{self.__class__.__name__} Command"
 
 
 class EngineStart(BaseCommand):
@@ -245,6 +298,7 @@ class EngineStart(BaseCommand):
     async def __call__(self, drone, telem):
         logger.info("Engine Start (Armed)")
         await self.try_action(drone.action.arm, action.ActionError)
+        self.ack()
 
     def __str__(self):
         return f"{self.__class__.__name__} Command"
@@ -257,6 +311,7 @@ class EngineShutdown(BaseCommand):
     async def __call__(self, drone, telem):
         logger.info("Engine Shutdown (Disarmed)")
         await self.try_action(drone.action.disarm, action.ActionError)
+        self.ack()
 
     def __str__(self):
         return f"{self.__class__.__name__} Command"
@@ -1,12 +1,88 @@
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
 import os
 import pkgutil
+import queue
 import sys
 import time
+from pathlib import Path
 
 
-def config_logging_stdout(level, full=False):
-    if full:
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the background writer without ever blocking the caller, a full queue drops the record."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the writer runs in this process, so the record keeps its exception for the formatters
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimit(logging.Filter):
+    """
+    Per call site token bucket: every logging statement may emit `burst` records at once and `rate` records per
+    second after that, so a debug log in a loop cannot flood the output. Records above `level` pass unless their
+    call site opts in with extra={'every': seconds}, which allows one record per that many seconds. The number of
+    suppressed records is appended to the next one that passes.
+    """
+
+    def __init__(self, rate=2.0, burst=20, level=logging.DEBUG):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.level = level
+        self.sites = dict()
+
+    def filter(self, record):
+        every = getattr(record, 'every', None)
+        if every is None and record.levelno > self.level:
+            return True
+        rate, burst = (1 / every, 1) if every else (self.rate, self.burst)
+        key = (record.pathname, record.lineno)
+        tokens, last, suppressed = self.sites.get(key, (burst, record.created, 0))
+        tokens = min(burst, tokens + (record.created - last) * rate)
+        if tokens < 1:
+            self.sites[key] = (tokens, record.created, suppressed + 1)
+            return False
+        self.sites[key] = (tokens - 1, record.created, 0)
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar suppressed]"
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One compact JSON object per record."""
+
+    def format(self, record):
+        entry = {'t': round(record.created, 3), 'level': record.levelname, 'logger': record.name,
+                 'msg': record.getMessage()}
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def config_logging_stdout(level, full=False, json_lines=False, max_bytes=10 * 2 ** 20, backups=5):
+    """
+    Logs to stdout and a rotating file in logs/. Records are queued and written by a background thread, so logging
+    from the event loop never waits for the console or the SD card; debug records are rate limited per call site.
+    """
+    if json_lines:
+        formatter = JsonFormatter()
+    elif full:
         formatter = logging.Formatter("{asctime} {levelname}:{name}:{message}", style='{')
     else:
         formatter = logging.Formatter('%(levelname)s: %(message)s')
@@ -15,18 +91,25 @@ def config_logging_stdout(level, full=False):
     cons_handler.setLevel(logging.DEBUG)
     cons_handler.setFormatter(formatter)
 
-    log_file = 'logs/dronebot_' + time.strftime("%Y-%m-%d-%T") + '.log'
+    log_file = 'logs/dronebot_' + time.strftime("%Y-%m-%d-%T") + ('.jsonl' if json_lines else '.log')
     os.makedirs(os.path.dirname(log_file), exist_ok=True)
 
-    file_handler = logging.FileHandler(log_file, mode='a')
+    file_handler = logging.handlers.RotatingFileHandler(log_file, mode='a', maxBytes=max_bytes, backupCount=backups)
     file_handler.setLevel(logging.DEBUG)
     file_handler.setFormatter(formatter)
 
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=10000))
+    queue_handler.addFilter(RateLimit())
+    listener = logging.handlers.QueueListener(queue_handler.queue, cons_handler, file_handler,
+                                              respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
     root_logger = logging.getLogger()
-    root_logger.addHandler(cons_handler)
-    root_logger.addHandler(file_handler)
+    root_logger.addHandler(queue_handler)
 
-    for _, module_name, _ in pkgutil.iter_modules([__package__]):
+    for _, module_name, _ in pkgutil.iter_modules([str(Path(__file__).parent)]):
         logger = logging.getLogger(f"dronebot.{module_name}".upper())
         logger.setLevel(level)
     logging.getLogger('__MAIN__').setLevel(level)
+    return listener
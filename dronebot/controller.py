@@ -1,16 +1,27 @@
 import asyncio
+import functools
 import logging
 import signal
-import sys
+import time
 import traceback
-from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 
 from mavsdk import System, telemetry, action, mission
 
-from dronebot import config_logging
+from dronebot import config_logging, geodesy, tracing
+from dronebot.command import BaseCommand
+from dronebot.executor import CommandExecutor
+from dronebot.geofence import Geofence
+from dronebot.ingest import Ingest
+from dronebot.journal import Journal
+from dronebot.offboard import OffboardGuidance
 from dronebot.parser import Parser
+from dronebot.recorder import FlightRecorder, Kind, RecordingSystem
+from dronebot.startup import StartupGraph
 from dronebot.state import FlightState
 from dronebot.telem import Telemetry
+from dronebot.vocab import Vocabulary
+from dronebot.watchdog import Watchdog
 
 logger = logging.getLogger(__name__.upper())
 
@@ -27,47 +38,92 @@ class Controller:
     """
     Handling mavsdk based asynchronous communication from a companion computer to a drone flight controller.
     * sets up a udp/tcp/serial connection
-    * starts the stdin deepspeech parser in a separate thread
+    * reads deepspeech transcripts from stdin and the `sources` sockets, see Ingest
     * converts the parsed input queue into callable dommands containing mavskd flight instructions
     * watches flight parameters
     * safely handles exeptions and interrupts
+    A controller that is not `standalone` is one vehicle of a Fleet, which owns stdin and the event loop.
     """
 
-    def __init__(self, drone: System, call_sign: str, serial: str, restore: bool):
-        self.drone = drone
+    def __init__(self, drone: System, call_sign: str, serial: str, restore: bool, recorder: FlightRecorder = None,
+                 standalone: bool = True, journal: str = 'saves', sources=('stdin',), missed_ticks: int = 5):
+        self.standalone = standalone
+        self.recorder = recorder
+        self.drone = RecordingSystem(drone, recorder) if recorder else drone
         self.system_address = serial
 
         self.abort_event = asyncio.Event()
         self.command_queue = asyncio.Queue()
-        self.tp_executor = ThreadPoolExecutor()
+        self.ingest = Ingest(sources)
 
-        self.parser = Parser(call_sign)
-        self.flight_state = FlightState(self.command_queue, restore)
+        self.startup_graph = StartupGraph()
+        started = time.perf_counter()
+        vocab = Vocabulary()
+        self.startup_graph.record('vocabulary', time.perf_counter() - started)
+        self.parser = Parser(call_sign, vocab)
+        self.flight_state = FlightState(self.command_queue, restore, call_sign,
+                                        Journal(Path(journal) / f"{call_sign}.journal" if journal else None), vocab)
         self.telemetry = Telemetry(self.drone)
+        self.telemetry.recorder = recorder
+        self.telemetry.geofence = Geofence(self.flight_state.vocab.GEOFENCE)
+        self.telemetry.geofence.listeners.append(self.handle_breach)
+        self.executor = CommandExecutor(self.drone, self.telemetry)
+        self.watchdog = Watchdog(missed=missed_ticks, reactions={'link': self.failsafe_rtb, 'health': self.failsafe_hold})
+        self.telemetry.watchdog = self.watchdog
 
-    async def startup(self):
+    async def startup(self, preflight_timeout=25.0):
+        """
+        Brings the vehicle up as a dependency graph: the TTS engine warms up and the route graph searches the paths
+        between all fixes while mavsdk connects, preflight health, home position and mission params all follow the
+        connection at once.
+        Waits on telemetry events instead of fixed sleeps and logs the time-to-ready breakdown.
+        """
+        graph = self.startup_graph
+        graph.add('tts', self.flight_state.voice.warm_up)
+        # positions and the route graph are built on first use, which should not be the first clearance or reroute
+        graph.add('routes', lambda: self.flight_state.vocab.ROUTES.search())
+        graph.add('connect', self.connect)
+        graph.add('preflight', functools.partial(self.preflight, preflight_timeout), after=['connect'])
+        graph.add('home', self.set_home, after=['connect'])
+        graph.add('params', self.set_params, after=['connect'])
+        await graph.run()
+        logger.info(f"{self.parser.call_sign} startup:\n{graph.report()}")
+
+    async def connect(self):
         await self.drone.connect(system_address=self.system_address)
         logger.info(f"{self.system_address} waiting for connection...")
         async for state in self.drone.core.connection_state():
             if state.is_connected:
                 logger.info(f"Connected to {self.system_address}")
                 break
-            await asyncio.sleep(0.1)
+
+    async def preflight(self, timeout):
         logger.info("Running preflight checklist...")
-        n_tries = 0
-        async for health_all_ok in self.drone.telemetry.health_all_ok():
-            if n_tries == 5:
-                raise ControlError("Preflight check maximum tries exceeded")
-            if health_all_ok:
-                logger.info("Preflight checklist complete")
-                break
-            else:
-                logger.info(f"Preflight check failed {n_tries}/5")
-                async for health in self.drone.telemetry.health():
+
+        async def checklist():
+            reported = False
+            async for health_all_ok in self.drone.telemetry.health_all_ok():
+                if health_all_ok:
+                    return
+                if not reported:
+                    health = await self.telemetry.first(self.drone.telemetry.health, timeout=1)
+                    logger.info("Preflight check failed, waiting for health")
                     logger.debug(str(health).replace(' [', '\n\t').replace(', ', '\n\t').replace(']', ''))
-                    break
-                n_tries += 1
-                await asyncio.sleep(5)
+                    reported = True
+
+        try:
+            await asyncio.wait_for(checklist(), timeout)
+        except asyncio.TimeoutError:
+            raise ControlError(f"Preflight checklist not complete after {timeout:.0f}s") from None
+        logger.info("Preflight checklist complete")
+
+    async def set_home(self):
+        home = await self.telemetry.first(self.drone.telemetry.home, timeout=5)
+        # vehicles of a fleet share the frame of the first one to connect
+        if home is not None and (self.standalone or geodesy.home_frame() is None):
+            geodesy.set_home(home.latitude_deg, home.longitude_deg, home.absolute_altitude_m)
+
+    async def set_params(self):
         logger.info("Setting mission params")
         await self.drone.action.set_takeoff_altitude(5)
         await self.drone.action.set_return_to_launch_altitude(20)
@@ -77,15 +133,17 @@ class Controller:
         try:
             logger.info("Initializing")
             await self.startup()
-            await asyncio.sleep(1)
             logger.info("Starting main routine")
             while not self.abort_event.is_set():
                 try:
                     await asyncio.gather(
-                        self.monitor_atc(),
+                        *([self.monitor_atc()] if self.standalone else []),
                         self.monitor_health(),
+                        self.watchdog.run(),
                         self.telemetry.sub_state_updates(),
                         self.telemetry.sub_position_updates(),
+                        self.telemetry.sub_velocity_updates(),
+                        self.telemetry.sub_battery_updates(),
                         self.fly_commands()
                     )
                 except (action.ActionError, telemetry.TelemetryError, mission.MissionError) as e:
@@ -96,20 +154,38 @@ class Controller:
             logger.debug(traceback.format_exc())
             self.abort_event.set()
             await self.fly_rtb()
-            asyncio.create_task(self.shutdown(asyncio.get_running_loop()))
+            if self.standalone:
+                asyncio.create_task(self.shutdown(asyncio.get_running_loop()))
 
     async def monitor_atc(self):
         logger.info("Monitoring ATC")
         await self.flight_state.voice.speak(full=True)
+        await self.ingest.start()
         while not self.abort_event.is_set():
-            command_list = await asyncio.get_event_loop().run_in_executor(self.tp_executor, self.handle_stdin)
+            transmission = await self.ingest.get()
+            logger.debug(f"Received {transmission}")
+            await self.handle_transmission(transmission.text, transmission.marks)
+
+    async def handle_transmission(self, command, marks=None):
+        """Parses and executes one transmission under its own trace, `marks` carries upstream VAD/ASR times."""
+        trace_id = tracing.tracer.start(command, marks=marks)
+        tracing.current_trace.set(trace_id)
+        try:
+            command_list = self.handle_transcript(command)
+            tracing.mark('parsed')
             await self.flight_state.handle_commands(command_list)
+        finally:
+            tracing.tracer.release(trace_id)
 
-    def handle_stdin(self):
-        command = sys.stdin.readline().rstrip()
+    def handle_transcript(self, command):
+        if self.recorder:
+            self.recorder.record_json(Kind.TRANSCRIPT, command)
         if command == "rtb":
             raise ControlError("Received RTB command input")
-        return self.parser.handle_command(command)
+        command_list = self.parser.handle_command(command)
+        if self.recorder:
+            self.recorder.record_json(Kind.PARSED, command_list)
+        return command_list
 
     async def monitor_health(self):
         logger.info("Monitoring Health")
@@ -117,21 +193,60 @@ class Controller:
         async for health_ok in self.drone.telemetry.health_all_ok():
             if self.abort_event.is_set():
                 break
+            if self.recorder:
+                self.recorder.record(Kind.HEALTH, health_ok)
+            self.watchdog.health(health_ok)
             if not health_ok and trigger_state:
-                logger.warning("Drone health issue encountered")
+                # a flapping health flag warns at most every 30s
+                logger.warning("Drone health issue encountered", extra={'every': 30.0})
                 await self.telemetry.print_telem_status()
                 trigger_state = False
             if health_ok:
                 trigger_state = True
-            await asyncio.sleep(1)
 
     async def fly_commands(self):
         logger.info("Following ATC command queue")
         while not self.abort_event.is_set():
             command = await self.command_queue.get()
             logger.debug(f"Interpreting {command}")
-            task = command(self.drone, self.telemetry)
-            asyncio.create_task(task)
+            if self.recorder:
+                self.recorder.record_json(Kind.COMMAND, str(command))
+            self.executor.submit(command)
+
+    def handle_breach(self, breach):
+        if breach.kind != 'mission':
+            asyncio.create_task(self.fly_hold())
+        asyncio.create_task(self.flight_state.voice.speak("unable"))
+
+    async def fly_hold(self):
+        logger.info("Holding position at geofence")
+        guidance = OffboardGuidance.of(self.drone, self.telemetry)
+        if guidance.active:
+            await guidance.hold()
+        else:
+            await BaseCommand.try_action(self.drone.mission.pause_mission, mission.MissionError)
+
+    async def failsafe_rtb(self):
+        """Link failsafe: drops the queued and running moves and returns to launch, done once the vehicle accepted."""
+        if not self.telemetry.in_air:
+            logger.warning("Link failsafe on the ground, staying put")
+            return
+        self.executor.cancel_category('move')
+        await self.drone.action.return_to_launch()
+        logger.warning("Failsafe: returning home")
+
+    async def failsafe_hold(self):
+        """Health failsafe: drops the queued and running moves and holds position, done once the vehicle accepted."""
+        if not self.telemetry.in_air:
+            logger.warning("Health failsafe on the ground, staying put")
+            return
+        self.executor.cancel_category('move')
+        guidance = OffboardGuidance.of(self.drone, self.telemetry)
+        if guidance.active:
+            await guidance.hold()
+        else:
+            await self.drone.mission.pause_mission()
+        logger.warning("Failsafe: holding position")
 
     async def fly_rtb(self):
         logger.info("Attempt to land at nearest location")
@@ -148,32 +263,40 @@ class Controller:
         logger.debug(traceback.format_exc())
         asyncio.create_task(self.shutdown(loop))
 
-    # noinspection PyBroadException, PyProtectedMember
     async def shutdown(self, loop, sig=None):
         self.abort_event.set()
         if sig:
             logger.info(f"Received exit signal {sig.name}...")
+        self.ingest.close()
         tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
         [task.cancel() for task in tasks]
-        logger.debug("Shutting down executor")
-        self.tp_executor.shutdown(wait=False)
-        logger.debug(f"Releasing {len(self.tp_executor._threads)} threads from executor")
-        for thread in self.tp_executor._threads:
-            try:
-                thread._tstate_lock.release()
-            except Exception:
-                pass
         logger.debug(f"Cancelling {len(tasks)} outstanding tasks")
         await asyncio.gather(*tasks, return_exceptions=True)
+        while not self.command_queue.empty():
+            # dropped unsubmitted, their traces are finished without them
+            tracing.tracer.release(self.command_queue.get_nowait().trace_id)
+        tracing.tracer.close()
         logger.debug(f"Flushing metrics")
         await asyncio.sleep(1)
         loop.stop()
+        self.close()
+
+    def close(self):
+        logger.debug(f"{self.parser.call_sign} commands: {self.executor.summary()}")
+        logger.info(f"{self.parser.call_sign} watchdog: {self.watchdog.summary()}")
         self.flight_state.save()
+        if self.recorder:
+            self.recorder.close()
 
 
 def main(args):
-    vcs = Controller(System(), args.call_sign, args.serial, args.restore)
     loop = asyncio.get_event_loop()
+    recorder = FlightRecorder(args.record, clock=loop.time) if getattr(args, 'record', None) else None
+    tracing.configure(getattr(args, 'trace', None))
+    vcs = Controller(System(), args.call_sign, args.serial, args.restore, recorder,
+                     sources=['stdin'] + (getattr(args, 'listen', None) or []),
+                     missed_ticks=getattr(args, 'missed_ticks', 5))
+    OffboardGuidance.of(vcs.drone, vcs.telemetry).enabled = getattr(args, 'offboard', False)
     signals = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT)
     for s in signals:
         loop.add_signal_handler(s, lambda sig=s: asyncio.create_task(vcs.shutdown(loop, sig)))
@@ -197,10 +320,24 @@ if __name__ == "__main__":
                         help="Set system address for drone serial port connection")
     parser.add_argument('-v', '--verbose', action='store_true',
                         help="Set logging level to DEBUG")
+    parser.add_argument('--log-json', action='store_true',
+                        help="Write logs as compact JSON lines")
     parser.add_argument('-r', '--restore', action='store_true',
-                        help="Restore flight state machine from an earlier state")
+                        help="Restore flight state and pending conditional commands from the journal")
+    parser.add_argument('-l', '--listen', action='append', metavar='unix://PATH|udp://HOST:PORT',
+                        help="Also accept transcripts from ASR processes on this socket, can be repeated")
+    parser.add_argument('--record', metavar='PATH',
+                        help="Record telemetry, transcripts and commands to a binary flight recording")
+    parser.add_argument('--trace', metavar='PATH|udp://HOST:PORT',
+                        help="Export per-transmission latency traces and histograms as JSON lines")
+    parser.add_argument('--offboard', action='store_true',
+                        help="Stream heading and altitude changes as offboard setpoints instead of mission uploads")
+    parser.add_argument('--missed-ticks', type=int, default=5,
+                        help="Telemetry updates (10Hz position and velocity, 1Hz health) that may be missed before "
+                             "the watchdog returns to launch on link loss or holds on bad health. Default: 5")
     ARGS = parser.parse_args()
-    config_logging.config_logging_stdout(logging.DEBUG if ARGS.verbose else logging.INFO, full=True)
+    config_logging.config_logging_stdout(logging.DEBUG if ARGS.verbose else logging.INFO, full=True,
+                                         json_lines=ARGS.log_json)
     # from dronebot import test_commands
     # test_commands.run()
     main(ARGS)
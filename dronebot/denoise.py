@@ -0,0 +1,161 @@
+import logging
+import time
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+logger = logging.getLogger(__name__.upper())
+
+
+class Denoiser:
+    """
+    Streaming noise suppression for 16kHz int16 audio in front of the VAD and DeepSpeech.
+    Frames are transformed with 50% overlapping sqrt-Hann windows, limited to the radio's speech band and a running
+    noise estimate is subtracted from their power spectrum; the output lags the input by one frame. Every call
+    transforms all of its frames at once, in buffers allocated once per block length, and the noise estimate
+    follows the quietest frame of each block: it falls fast and rises slowly. If the average cost of a frame
+    exceeds `budget_ms`, the stage turns itself off and passes audio through unchanged.
+    """
+
+    def __init__(self, rate=16000, frame=320, low_hz=250.0, high_hz=3800.0, over=2.0, floor=0.1, fall=0.5, rise=0.1,
+                 block=16, budget_ms=2.0):
+        self.rate = rate
+        self.frame = frame
+        self.size = 2 * frame
+        self.over = over
+        self.floor_sq = floor * floor
+        self.fall = fall
+        self.rise = rise
+        self.block = block
+        self.budget = budget_ms / 1000
+        # periodic sqrt-Hann for analysis and synthesis, its square sums to one at 50% overlap
+        self.window = np.sqrt(0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self.size) / self.size))
+        freqs = np.fft.rfftfreq(self.size, 1 / rate)
+        self.band = ((freqs >= low_hz) & (freqs <= high_hz)).astype(float)
+        self.buffers = dict()
+        self.enabled = True
+        self.frames = 0
+        self.seconds = 0.0
+        self.cost = 0.0
+        self.reset()
+
+    def reset(self):
+        """Forgets the noise estimate and the audio of the last frame, e.g. between unrelated recordings."""
+        self.noise = None
+        self.quiet = np.zeros(self.size // 2 + 1)
+        self.quiet_energy = np.inf
+        self.quiet_frames = 0
+        self.previous = np.zeros(self.frame)
+        self.tail = np.zeros(self.frame)
+
+    def allocate(self, count):
+        if count not in self.buffers:
+            bins = self.size // 2 + 1
+            self.buffers[count] = {'signal': np.empty((count + 1) * self.frame), 'frames': np.empty((count, self.size)),
+                                   'power': np.empty((count, bins)), 'gain': np.empty((count, bins)),
+                                   'out': np.empty((count, self.frame)), 'pcm': np.empty(count * self.frame, np.int16)}
+        return self.buffers[count]
+
+    def process(self, samples):
+        """Denoises whole frames of int16 samples, returning as many samples as given, one frame late."""
+        samples = np.asarray(samples, dtype=np.int16)
+        if not self.enabled:
+            return samples
+        count = len(samples) // self.frame
+        if count > self.block:
+            return np.concatenate([self.process(samples[start:start + self.block * self.frame])
+                                   for start in range(0, count * self.frame, self.block * self.frame)])
+        if count == 0:
+            return samples[:0]
+        started = time.perf_counter()
+        buffers = self.allocate(count)
+        signal, frames, power, gain, out = (buffers[key] for key in ('signal', 'frames', 'power', 'gain', 'out'))
+
+        signal[:self.frame] = self.previous
+        signal[self.frame:] = samples[:count * self.frame]
+        self.previous[:] = signal[-self.frame:]
+        step = signal.strides[0]
+        np.multiply(as_strided(signal, (count, self.size), (self.frame * step, step), writeable=False), self.window,
+                    out=frames)
+        spectrum = np.fft.rfft(frames, axis=1)
+        np.abs(spectrum, out=power)
+        np.square(power, out=power)
+
+        self.track(power)
+        # power subtraction, as a magnitude gain with a floor against musical noise
+        np.divide(self.noise, power + 1e-9, out=gain)
+        gain *= -self.over
+        gain += 1.0
+        np.maximum(gain, self.floor_sq, out=gain)
+        np.sqrt(gain, out=gain)
+        gain *= self.band
+        spectrum *= gain
+
+        frames[:] = np.fft.irfft(spectrum, n=self.size, axis=1)
+        frames *= self.window
+        out[0] = self.tail
+        out[1:] = frames[:-1, self.frame:]
+        out += frames[:, :self.frame]
+        self.tail[:] = frames[-1, self.frame:]
+        np.clip(out, -32768, 32767, out=out)
+        pcm = buffers['pcm']
+        np.rint(out.reshape(-1), out=out.reshape(-1))
+        pcm[:] = out.reshape(-1)
+
+        self.account(count, time.perf_counter() - started)
+        return pcm.copy()
+
+    def track(self, power):
+        """
+        Updates the noise estimate with the spectrum of the quietest frame of every `block` frames, also when they
+        arrive one by one; a per bin minimum would underestimate the noise by the block length.
+        """
+        energy = power @ self.band
+        quietest = int(np.argmin(energy))
+        if energy[quietest] < self.quiet_energy:
+            self.quiet_energy = energy[quietest]
+            self.quiet[:] = power[quietest]
+        self.quiet_frames += len(power)
+        if self.noise is None:
+            self.noise = self.quiet.copy()
+        elif self.quiet_frames >= self.block:
+            self.noise += np.where(self.quiet < self.noise, self.fall, self.rise) * (self.quiet - self.noise)
+        else:
+            return
+        self.quiet_energy = np.inf
+        self.quiet_frames = 0
+
+    def account(self, count, seconds):
+        first = self.frames == 0
+        self.frames += count
+        self.seconds += seconds
+        cost = seconds / count
+        # the first block pays for the allocations and the FFT setup, it does not count against the budget
+        if not first:
+            self.cost = cost if self.cost == 0.0 else 0.9 * self.cost + 0.1 * cost
+        if self.cost > self.budget:
+            self.enabled = False
+            logger.warning(f"Denoising takes {self.cost * 1000:.2f}ms per frame, over its budget of "
+                           f"{self.budget * 1000:.2f}ms, passing audio through from now on")
+
+    def filter(self, frame):
+        """Denoises one frame of audio bytes as the VAD reads them."""
+        if not self.enabled:
+            return frame
+        return self.process(np.frombuffer(frame, np.int16)).tobytes()
+
+    def stream(self, frames):
+        for frame in frames:
+            yield self.filter(frame)
+
+    def clip(self, samples):
+        """Denoises a whole recording, padded to whole frames and shifted back by the one frame of delay."""
+        self.reset()
+        samples = np.asarray(samples, dtype=np.int16)
+        padded = np.zeros((len(samples) // self.frame + 2) * self.frame, np.int16)
+        padded[:len(samples)] = samples
+        return self.process(padded)[self.frame:self.frame + len(samples)]
+
+    def report(self):
+        return (f"denoised {self.frames} frames, {self.seconds / max(self.frames, 1) * 1e6:.0f}us per frame "
+                f"(budget {self.budget * 1e6:.0f}us){'' if self.enabled else ', turned off over budget'}")
@@ -0,0 +1,147 @@
+import asyncio
+import collections
+import logging
+import traceback
+from enum import IntEnum
+
+from mavsdk import System
+
+from dronebot import tracing
+from dronebot.command import BaseCommand
+from dronebot.telem import Telemetry
+
+logger = logging.getLogger(__name__.upper())
+
+
+class Status(IntEnum):
+    QUEUED = 1
+    STARTED = 2
+    ACKED = 3
+    COMPLETED = 4
+    FAILED = 5
+    CANCELLED = 6
+
+
+class CommandRecord:
+    __slots__ = ('command', 'status', 'times', 'error', 'task')
+
+    def __init__(self, command):
+        self.command = command
+        self.status = None
+        self.times = dict()
+        self.error = None
+        self.task = None
+        self.mark(Status.QUEUED)
+
+    def mark(self, status):
+        # an ack can arrive after the command already finished, e.g. from a trigger it registered
+        if self.status is None or status > self.status:
+            self.status = status
+            self.times[status] = asyncio.get_event_loop().time()
+
+    def elapsed(self, start, end):
+        if start in self.times and end in self.times:
+            return self.times[end] - self.times[start]
+        return None
+
+    @property
+    def done(self):
+        return self.status in (Status.COMPLETED, Status.FAILED, Status.CANCELLED)
+
+    def __str__(self):
+        def ms(start, end):
+            elapsed = self.elapsed(start, end)
+            return "-" if elapsed is None else f"{elapsed * 1000:.0f}ms"
+        end = self.status if self.done else Status.STARTED
+        return (f"{self.command} {self.status.name.lower()}: waited {ms(Status.QUEUED, Status.STARTED)}, "
+                f"acked after {ms(Status.STARTED, Status.ACKED)}, took {ms(Status.STARTED, end)}")
+
+
+class CommandExecutor:
+    """
+    Runs commands from the command queue as tracked tasks.
+    * commands of one category share a concurrency limit, move commands run strictly one at a time in queue order
+    * a new command of a kind that `supersedes` cancels the queued or running older command of the same kind
+    * every command's lifecycle (queued, started, acked, completed/failed/cancelled) is time stamped
+    """
+
+    limits = {'move': 1, 'action': 1, 'report': 32}
+
+    response_timeout = 10.0
+
+    def __init__(self, drone: System, telem: Telemetry, limits=None, history=256):
+        self.drone = drone
+        self.telem = telem
+        self.semaphores = dict((category, asyncio.Semaphore(limit))
+                               for category, limit in dict(self.limits, **(limits or dict())).items())
+        self.latest = dict()
+        self.records = collections.deque(maxlen=history)
+
+    def submit(self, command: BaseCommand):
+        kind = type(command).__name__
+        previous = self.latest.get(kind)
+        if command.supersedes and previous is not None and not previous.done:
+            logger.info(f"{command} supersedes {previous.command}")
+            self.cancel(previous)
+        record = CommandRecord(command)
+        command.on_ack = lambda: self.acked(record)
+        tracing.tracer.mark(command.trace_id, 'dispatched')
+        record.task = asyncio.create_task(self.execute(record))
+        record.task.add_done_callback(lambda _: tracing.tracer.release(command.trace_id))
+        self.latest[kind] = record
+        self.records.append(record)
+        return record
+
+    def acked(self, record):
+        record.mark(Status.ACKED)
+        trace_id = record.command.trace_id
+        tracing.tracer.mark(trace_id, 'acked')
+        if trace_id is None or record.command.category != 'move' or self.telem.position is None:
+            return
+        # the trace stays open until the vehicle visibly moves, or the response timeout passes
+        tracing.tracer.hold(trace_id)
+
+        def respond():
+            tracing.tracer.mark(trace_id, 'response')
+            tracing.tracer.release(trace_id)
+
+        def expire():
+            if self.telem.triggers.cancel(trigger):
+                tracing.tracer.release(trace_id)
+
+        trigger = self.telem.triggers.away_from(*self.telem.east_north(), self.telem.altitude, 0.3, respond)
+        asyncio.get_event_loop().call_later(self.response_timeout, expire)
+
+    async def execute(self, record):
+        command = record.command
+        try:
+            async with self.semaphores[command.category]:
+                record.mark(Status.STARTED)
+                await command(self.drone, self.telem)
+            record.mark(Status.COMPLETED)
+            logger.debug(record)
+        except asyncio.CancelledError:
+            record.mark(Status.CANCELLED)
+            logger.debug(record)
+        except Exception as e:
+            record.error = e
+            record.mark(Status.FAILED)
+            logger.error(f"{record}: {e}")
+            logger.debug(traceback.format_exc())
+
+    def cancel(self, record):
+        if record.task is not None and not record.task.done():
+            record.task.cancel()
+        if hasattr(record.command, 'cancel'):
+            record.command.cancel(self.telem)
+        record.mark(Status.CANCELLED)
+
+    def cancel_category(self, category):
+        """Cancels every queued or running command of `category`, e.g. all moves ahead of a failsafe."""
+        for record in self.records:
+            if record.command.category == category and not record.done:
+                self.cancel(record)
+
+    def summary(self):
+        counts = collections.Counter(record.status.name.lower() for record in self.records)
+        return ", ".join(f"{count} {status}" for status, count in sorted(counts.items())) or "no commands"
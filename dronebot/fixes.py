@@ -0,0 +1,100 @@
+import heapq
+import logging
+import math
+
+from dronebot.geodesy import LocalFrame
+
+logger = logging.getLogger(__name__.upper())
+
+COMPASS = ('north', 'north east', 'east', 'south east', 'south', 'south west', 'west', 'north west')
+
+
+class FixIndex:
+    """
+    2-d tree over the named positions in a local east/north frame, built on first use of Vocabulary.FIXES.
+    Nearest fix and fixes within a radius take logarithmic time in the number of fixes, so position reports and
+    checks of instructed fixes against the current position stay cheap as fixes and runways are added. The tree is
+    implicit: the fixes are sorted so that the median of every slice splits it, alternating east and north.
+    """
+
+    def __init__(self, positions, frame: LocalFrame = None):
+        self.positions = positions
+        names = list(positions)
+        if frame is None:
+            latitudes = sorted(p.latitude_deg for p in positions.values())
+            longitudes = sorted(p.longitude_deg for p in positions.values())
+            frame = LocalFrame(latitudes[len(latitudes) // 2], longitudes[len(longitudes) // 2])
+        self.frame = frame
+        points = [frame.east_north(positions[name].latitude_deg, positions[name].longitude_deg) for name in names]
+        self.nodes = list(zip(points, names))
+        self.build(0, len(self.nodes), 0)
+        self.points = dict((name, point) for point, name in self.nodes)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def build(self, lo, hi, axis):
+        if hi - lo < 2:
+            return
+        self.nodes[lo:hi] = sorted(self.nodes[lo:hi], key=lambda node: node[0][axis])
+        mid = (lo + hi) // 2
+        self.build(lo, mid, 1 - axis)
+        self.build(mid + 1, hi, 1 - axis)
+
+    def search(self, point, radius, limit):
+        """Up to `limit` (distance, name) pairs within `radius` of `point`, nearest first."""
+        found = list()  # max heap of the best `limit` as (-distance, name)
+        stack = [(0, len(self.nodes), 0, 0.0)]
+        while stack:
+            lo, hi, axis, bound = stack.pop()
+            # `bound` is how far the slice is at least from the point, the radius may have shrunk since the push
+            if lo >= hi or bound > radius:
+                continue
+            mid = (lo + hi) // 2
+            (east, north), name = self.nodes[mid]
+            distance = math.hypot(east - point[0], north - point[1])
+            if distance <= radius:
+                if len(found) < limit:
+                    heapq.heappush(found, (-distance, name))
+                elif distance < -found[0][0]:
+                    heapq.heapreplace(found, (-distance, name))
+            if len(found) == limit:
+                radius = min(radius, -found[0][0])
+            offset = point[axis] - self.nodes[mid][0][axis]
+            near, far = ((lo, mid), (mid + 1, hi)) if offset < 0 else ((mid + 1, hi), (lo, mid))
+            # the far side is pushed first so that the near side is searched first and shrinks the radius
+            stack.append((*far, 1 - axis, abs(offset)))
+            stack.append((*near, 1 - axis, 0.0))
+        return sorted((-distance, name) for distance, name in found)
+
+    def nearest(self, latitude_deg, longitude_deg):
+        """(name, distance) of the closest fix, (None, inf) without fixes."""
+        found = self.search(self.frame.east_north(latitude_deg, longitude_deg), math.inf, 1)
+        if not found:
+            return None, math.inf
+        distance, name = found[0]
+        return name, distance
+
+    def within(self, latitude_deg, longitude_deg, radius):
+        """(name, distance) of every fix within `radius` metres, nearest first."""
+        found = self.search(self.frame.east_north(latitude_deg, longitude_deg), radius, len(self.nodes))
+        return [(name, distance) for distance, name in found]
+
+    def relative(self, name, latitude_deg, longitude_deg):
+        """Distance in metres and true bearing in degrees of a position as seen from fix `name`."""
+        fix_east, fix_north = self.points[name]
+        east, north = self.frame.east_north(latitude_deg, longitude_deg)
+        return math.hypot(east - fix_east, north - fix_north), math.degrees(math.atan2(east - fix_east,
+                                                                                       north - fix_north)) % 360
+
+    def describe(self, latitude_deg, longitude_deg, overhead=1.0):
+        """Position relative to the nearest fix as read back on the radio, e.g. "2 metres east of MIQ"."""
+        name, distance = self.nearest(latitude_deg, longitude_deg)
+        if name is None:
+            return "position unknown"
+        fix = name.upper() if len(name) <= 3 else name
+        if distance < overhead:
+            return f"overhead {fix}"
+        _, bearing = self.relative(name, latitude_deg, longitude_deg)
+        metres = round(distance)
+        return f"{metres} metre{'s' if metres != 1 else ''} {COMPASS[round(bearing / 45) % 8]} of {fix}"
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import signal
+import traceback
+from pathlib import Path
+
+from mavsdk import System
+
+from dronebot import config_logging, tracing
+from dronebot.controller import Controller
+from dronebot.ingest import Ingest
+from dronebot.offboard import OffboardGuidance
+from dronebot.parser import call_sign_of
+from dronebot.recorder import FlightRecorder
+
+logger = logging.getLogger(__name__.upper())
+
+
+class Fleet:
+    """
+    Runs several vehicles in one process behind a single ATC transcript stream.
+    Every vehicle is a Controller with its own connection, telemetry, flight state and command executor; the fleet
+    reads the transcripts once and routes each transmission by its call sign, the same ID step the parser uses.
+    Transmissions to unknown call signs are dropped, "rtb" returns every vehicle. A transmission that fails is
+    answered with "say again" by its vehicle only, the others fly on.
+    """
+
+    def __init__(self, controllers, sources=('stdin',)):
+        self.controllers = dict((controller.parser.call_sign, controller) for controller in controllers)
+        self.locks = dict((call_sign, asyncio.Lock()) for call_sign in self.controllers)
+        self.abort_event = asyncio.Event()
+        self.ingest = Ingest(sources)
+        self.dispatches = set()
+
+    def route(self, transmission):
+        return self.controllers.get(call_sign_of(transmission))
+
+    async def dispatch(self, transmission, marks=None):
+        if transmission == "rtb":
+            logger.warning("Received RTB command input, returning all vehicles")
+            await asyncio.gather(*(self.return_vehicle(vehicle) for vehicle in self.controllers.values()))
+            return None
+        controller = self.route(transmission)
+        if controller is None:
+            logger.error(f"No vehicle with call sign '{call_sign_of(transmission)}'")
+            return None
+        if controller.abort_event.is_set():
+            logger.error(f"{controller.parser.call_sign} is returning, ignoring transmission")
+            return None
+        async with self.locks[controller.parser.call_sign]:
+            try:
+                await controller.handle_transmission(transmission, marks)
+            except Exception:
+                logger.exception(f"{controller.parser.call_sign} failed to handle '{transmission}'")
+                await controller.flight_state.voice.speak("say again")
+        return controller
+
+    def submit(self, transmission, marks=None):
+        """Dispatches a transmission in the background, the task is kept until it is done."""
+        task = asyncio.create_task(self.dispatch(transmission, marks))
+        self.dispatches.add(task)
+        task.add_done_callback(self.dispatches.discard)
+        return task
+
+    @staticmethod
+    async def return_vehicle(controller):
+        controller.abort_event.set()
+        try:
+            await controller.fly_rtb()
+        except Exception as e:
+            logger.error(f"{controller.parser.call_sign} failed to return: {e}")
+            logger.debug(traceback.format_exc())
+
+    async def monitor_atc(self):
+        logger.info(f"Monitoring ATC for {', '.join(self.controllers)}")
+        for controller in self.controllers.values():
+            await controller.flight_state.voice.speak(full=True)
+        await self.ingest.start()
+        while not self.abort_event.is_set():
+            transmission = await self.ingest.get()
+            logger.debug(f"Received {transmission}")
+            # vehicles handle transmissions concurrently, each one in order, so one vehicle's readback or
+            # upload does not hold up the next transmission to another
+            self.submit(transmission.text, transmission.marks)
+
+    async def run(self):
+        await asyncio.gather(self.monitor_atc(), *(controller.run() for controller in self.controllers.values()))
+
+    async def shutdown(self, loop, sig=None):
+        self.abort_event.set()
+        if sig:
+            logger.info(f"Received exit signal {sig.name}...")
+        for controller in self.controllers.values():
+            controller.abort_event.set()
+        self.ingest.close()
+        # transmissions still being handled go first, before the controllers they use are torn down
+        dispatches = list(self.dispatches)
+        [task.cancel() for task in dispatches]
+        await asyncio.gather(*dispatches, return_exceptions=True)
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        [task.cancel() for task in tasks]
+        logger.debug(f"Cancelling {len(tasks)} outstanding tasks")
+        await asyncio.gather(*tasks, return_exceptions=True)
+        tracing.tracer.close()
+        for controller in self.controllers.values():
+            try:
+                controller.close()
+            except Exception as e:
+                logger.error(f"{controller.parser.call_sign}: {e}")
+        loop.stop()
+
+    def handle_exception(self, loop, context):
+        msg = context.get("exception", context["message"])
+        logger.exception(f"Caught exception: {msg}")
+        logger.debug(traceback.format_exc())
+        asyncio.create_task(self.shutdown(loop))
+
+
+def parse_vehicle(spec, index):
+    """Parses CALLSIGN=SYSTEM_ADDRESS, the address defaults to the PX4 SITL port of the vehicle's index."""
+    call_sign, _, address = spec.partition('=')
+    return call_sign, address or f"udp://:{14540 + index}"
+
+
+def main(args):
+    loop = asyncio.get_event_loop()
+    tracing.configure(getattr(args, 'trace', None))
+    controllers = list()
+    for i, spec in enumerate(args.vehicles):
+        call_sign, address = parse_vehicle(spec, i)
+        recorder = None
+        if args.record:
+            recorder = FlightRecorder(Path(args.record) / f"{call_sign}.bin", clock=loop.time)
+        # every System starts its own mavsdk_server, which needs its own gRPC port
+        controller = Controller(System(port=args.port + i), call_sign, address, args.restore, recorder,
+                                standalone=False)
+        OffboardGuidance.of(controller.drone, controller.telemetry).enabled = args.offboard
+        controllers.append(controller)
+    fleet = Fleet(controllers, ['stdin'] + (args.listen or []))
+    for s in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(s, lambda sig=s: asyncio.create_task(fleet.shutdown(loop, sig)))
+    loop.set_exception_handler(fleet.handle_exception)
+
+    try:
+        loop.create_task(fleet.run())
+        loop.run_forever()
+    finally:
+        loop.close()
+        logging.info("Successfully shutdown fleet")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Control several vehicles from one ATC transcript stream")
+    parser.add_argument('vehicles', nargs='+', metavar='CALLSIGN[=ADDRESS]',
+                        help="Call sign and system address of each vehicle, e.g. cityairbus1234=udp://:14540")
+    parser.add_argument('-p', '--port', type=int, default=50051,
+                        help="First mavsdk_server port, one per vehicle. Default: 50051")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="Set logging level to DEBUG")
+    parser.add_argument('--log-json', action='store_true',
+                        help="Write logs as compact JSON lines")
+    parser.add_argument('-r', '--restore', action='store_true',
+                        help="Restore flight states and pending conditional commands from the journals")
+    parser.add_argument('-l', '--listen', action='append', metavar='unix://PATH|udp://HOST:PORT',
+                        help="Also accept transcripts from ASR processes on this socket, can be repeated")
+    parser.add_argument('--record', metavar='DIR',
+                        help="Record each vehicle to DIR/CALLSIGN.bin")
+    parser.add_argument('--trace', metavar='PATH|udp://HOST:PORT',
+                        help="Export per-transmission latency traces and histograms as JSON lines")
+    parser.add_argument('--offboard', action='store_true',
+                        help="Stream heading and altitude changes as offboard setpoints instead of mission uploads")
+    ARGS = parser.parse_args()
+    config_logging.config_logging_stdout(logging.DEBUG if ARGS.verbose else logging.INFO, full=True,
+                                         json_lines=ARGS.log_json)
+    main(ARGS)
@@ -0,0 +1,96 @@
+import logging
+import math
+
+import numpy as np
+
+logger = logging.getLogger(__name__.upper())
+
+# WGS84 ellipsoid
+SEMI_MAJOR_AXIS = 6378137.0
+ECCENTRICITY_SQ = 6.69437999014e-3
+
+
+class LocalFrame:
+    """
+    East/north/up tangent plane around a fixed origin.
+    Uses the meridian and prime vertical radii of curvature at the origin, which is exact to well below a
+    millimetre over the few hundred metres the challenge airspace spans, at the cost of two multiplications.
+    All projections accept scalars or arrays.
+    """
+
+    def __init__(self, latitude_deg, longitude_deg, absolute_altitude_m=0.0):
+        self.latitude_deg = latitude_deg
+        self.longitude_deg = longitude_deg
+        self.absolute_altitude_m = absolute_altitude_m
+        phi = math.radians(latitude_deg)
+        w = 1 - ECCENTRICITY_SQ * math.sin(phi) ** 2
+        meridian = SEMI_MAJOR_AXIS * (1 - ECCENTRICITY_SQ) / w ** 1.5
+        prime_vertical = SEMI_MAJOR_AXIS / math.sqrt(w)
+        self.north_per_deg = math.radians(meridian)
+        self.east_per_deg = math.radians(prime_vertical * math.cos(phi))
+
+    def __repr__(self):
+        return f"LocalFrame({self.latitude_deg}, {self.longitude_deg}, {self.absolute_altitude_m})"
+
+    def forward(self, latitude_deg, longitude_deg, absolute_altitude_m=None):
+        """Projects geodetic coordinates into (east, north, up) metres, stacked along the last axis."""
+        east = (np.asarray(longitude_deg, dtype=float) - self.longitude_deg) * self.east_per_deg
+        north = (np.asarray(latitude_deg, dtype=float) - self.latitude_deg) * self.north_per_deg
+        if absolute_altitude_m is None:
+            up = np.zeros_like(east)
+        else:
+            up = np.asarray(absolute_altitude_m, dtype=float) - self.absolute_altitude_m
+        return np.stack(np.broadcast_arrays(east, north, up), axis=-1)
+
+    def inverse(self, enu):
+        """Returns (latitude_deg, longitude_deg, absolute_altitude_m) for points given as [..., (east, north, up)]."""
+        enu = np.asarray(enu, dtype=float)
+        return (self.latitude_deg + enu[..., 1] / self.north_per_deg,
+                self.longitude_deg + enu[..., 0] / self.east_per_deg,
+                self.absolute_altitude_m + enu[..., 2])
+
+    def east_north(self, latitude_deg, longitude_deg):
+        """Scalar fast path for single positions, avoids array allocation in per-sample code."""
+        return ((longitude_deg - self.longitude_deg) * self.east_per_deg,
+                (latitude_deg - self.latitude_deg) * self.north_per_deg)
+
+    def position(self, position):
+        return self.forward(position.latitude_deg, position.longitude_deg, position.absolute_altitude_m)
+
+    def offset(self, latitude_deg, longitude_deg, bearing_deg, distance):
+        """Returns the latitude and longitude `distance` metres from a point along a true bearing."""
+        bearing = math.radians(bearing_deg)
+        return (latitude_deg + math.cos(bearing) * distance / self.north_per_deg,
+                longitude_deg + math.sin(bearing) * distance / self.east_per_deg)
+
+    def distance(self, lat_a, lon_a, lat_b, lon_b):
+        """Horizontal distance in metres, vectorized over either point."""
+        east = (np.asarray(lon_b) - lon_a) * self.east_per_deg
+        north = (np.asarray(lat_b) - lat_a) * self.north_per_deg
+        return np.hypot(east, north)
+
+    def bearing(self, lat_a, lon_a, lat_b, lon_b):
+        """True bearing in degrees from point a to point b, vectorized over either point."""
+        east = (np.asarray(lon_b) - lon_a) * self.east_per_deg
+        north = (np.asarray(lat_b) - lat_a) * self.north_per_deg
+        return np.degrees(np.arctan2(east, north)) % 360
+
+
+_home = None
+
+
+def set_home(latitude_deg, longitude_deg, absolute_altitude_m=0.0):
+    global _home
+    _home = LocalFrame(latitude_deg, longitude_deg, absolute_altitude_m)
+    logger.info(f"Local frame set to {_home}")
+    return _home
+
+
+def home_frame(fallback=None):
+    """
+    Returns the cached home frame. If none was set at connect time, the frame is anchored at `fallback`,
+    a telemetry.Position, so that offsets stay consistent from then on.
+    """
+    if _home is None and fallback is not None:
+        return set_home(fallback.latitude_deg, fallback.longitude_deg, fallback.absolute_altitude_m)
+    return _home
@@ -0,0 +1,177 @@
+import logging
+
+import numpy as np
+
+from dronebot import geodesy
+
+logger = logging.getLogger(__name__.upper())
+
+
+class GeofenceError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return f"{type(self).__name__}: {self.message}"
+
+
+class Box:
+    """Axis aligned box in the local frame, altitudes relative to home."""
+
+    def __init__(self, name, east, north, floor, ceiling):
+        self.name = name
+        self.low = np.array([min(east), min(north), floor])
+        self.high = np.array([max(east), max(north), ceiling])
+        self.center = (self.low[:2] + self.high[:2]) / 2
+
+    def covers(self, points):
+        """True where the point lies over or under the box, whatever its altitude."""
+        return np.all((points[..., :2] >= self.low[:2]) & (points[..., :2] <= self.high[:2]), axis=-1)
+
+    def contains(self, points):
+        return np.all((points >= self.low) & (points <= self.high), axis=-1)
+
+
+class Prism:
+    """Vertical prism over a polygon in the local frame, altitudes relative to home."""
+
+    def __init__(self, name, east, north, floor, ceiling):
+        self.name = name
+        self.xi = np.asarray(east, dtype=float)
+        self.yi = np.asarray(north, dtype=float)
+        self.xj = np.roll(self.xi, -1)
+        self.yj = np.roll(self.yi, -1)
+        self.floor = floor
+        self.ceiling = ceiling
+        self.center = np.array([self.xi.mean(), self.yi.mean()])
+
+    def covers(self, points):
+        """True where the point lies over or under the polygon, whatever its altitude."""
+        x = points[..., 0, None]
+        y = points[..., 1, None]
+        # even-odd ray casting against every edge at once
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing = ((self.yi > y) != (self.yj > y)) & \
+                       (x < (self.xj - self.xi) * (y - self.yi) / (self.yj - self.yi) + self.xi)
+        return np.count_nonzero(crossing, axis=-1) % 2 == 1
+
+    def contains(self, points):
+        return self.covers(points) & (points[..., 2] >= self.floor) & (points[..., 2] <= self.ceiling)
+
+
+class Breach:
+    __slots__ = ('kind', 'point', 'volume')
+
+    def __init__(self, kind, point, volume):
+        self.kind = kind
+        self.point = point
+        self.volume = volume
+
+    def __str__(self):
+        east, north, up = self.point
+        return f"{self.kind} geofence breach at ({east:.1f}, {north:.1f}, {up:.1f}) of {self.volume}"
+
+
+class Geofence:
+    """
+    3D geofence from the GEOFENCE section of vocab.yaml.
+    Points must lie inside at least one inclusion volume and outside every exclusion volume. Volumes are defined
+    in latitude/longitude and compiled into the home frame on first use; altitudes are relative to home. Live
+    altitudes down to `ground` metres below home count as on the ground, as they jitter there on the pad.
+    """
+
+    def __init__(self, config, lookahead=2.0, ground=1.0):
+        self.config = config or dict()
+        self.lookahead = lookahead
+        self.ground = ground
+        self.frame = None
+        self.inclusions = list()
+        self.exclusions = list()
+        self.listeners = list()
+        self.breached = False
+
+    def __bool__(self):
+        return bool(self.config)
+
+    def compile(self, frame):
+        self.frame = frame
+        self.inclusions.clear()
+        self.exclusions.clear()
+        for name, volume in self.config.items():
+            shape = Box if volume.get('box') else Prism
+            corners = np.array(volume.get('box') or volume.get('polygon'), dtype=float)
+            enu = frame.forward(corners[:, 0], corners[:, 1])
+            compiled = shape(name, enu[:, 0], enu[:, 1], volume.get('floor', 0.0), volume.get('ceiling', np.inf))
+            (self.exclusions if volume.get('exclude') else self.inclusions).append(compiled)
+        logger.debug(f"Compiled geofence with {len(self.inclusions)} inclusion and "
+                     f"{len(self.exclusions)} exclusion volumes in {frame}")
+
+    def _compiled(self, fallback=None):
+        frame = geodesy.home_frame(fallback)
+        if frame is not None and frame is not self.frame:
+            self.compile(frame)
+        return self.frame is not None
+
+    def violations(self, points):
+        """Returns the name of the first violated volume for each point, or None where the point is allowed."""
+        points = np.atleast_2d(points)
+        inside = np.full(len(points), not self.inclusions)
+        for volume in self.inclusions:
+            inside |= volume.contains(points)
+        result = [None if ok else self.left(points[i]).name for i, ok in enumerate(inside)]
+        for volume in self.exclusions:
+            for i in np.flatnonzero(volume.contains(points)):
+                result[i] = result[i] or volume.name
+        return result
+
+    def left(self, point):
+        """The inclusion volume a point outside all of them has left: the one above or below it, else the nearest."""
+        for volume in self.inclusions:
+            if volume.covers(point):
+                return volume
+        return min(self.inclusions, key=lambda volume: np.hypot(*(point[:2] - volume.center)))
+
+    def validate(self, mission_plan):
+        """Raises a GeofenceError naming the first mission item outside the geofence."""
+        if not self or not self._compiled():
+            return
+        items = mission_plan.mission_items
+        lat, lon, alt = np.array([(i.latitude_deg, i.longitude_deg, i.relative_altitude_m) for i in items]).T
+        points = self.frame.forward(lat, lon)
+        points[:, 2] = alt
+        for i, volume in enumerate(self.violations(points)):
+            if volume:
+                breach = Breach('mission', points[i], volume)
+                self.notify(breach)
+                raise GeofenceError(f"Mission item {i} violates {volume}")
+
+    def check(self, position, velocity=None):
+        """
+        Checks a live position and, given a NED velocity, where it will be after the lookahead time.
+        Listeners are notified once per excursion, on the first sample that is or will be outside.
+        """
+        if not self or not self._compiled(position):
+            return None
+        east, north = self.frame.east_north(position.latitude_deg, position.longitude_deg)
+        altitude = position.relative_altitude_m
+        if -self.ground <= altitude < 0.0:
+            altitude = 0.0
+        points = np.array([[east, north, altitude]] * 2)
+        if velocity is not None:
+            points[1] += np.array([velocity.east_m_s, velocity.north_m_s, -velocity.down_m_s]) * self.lookahead
+            # a descent ends on the ground, touching down is not a breach of the floor
+            points[1, 2] = max(points[1, 2], min(altitude, 0.0))
+        current, predicted = self.violations(points)
+        if not (current or predicted):
+            self.breached = False
+            return None
+        breach = Breach('position', points[0], current) if current else Breach('predicted', points[1], predicted)
+        if not self.breached:
+            self.breached = True
+            self.notify(breach)
+        return breach
+
+    def notify(self, breach):
+        logger.warning(str(breach))
+        for listener in self.listeners:
+            listener(breach)
@@ -0,0 +1,150 @@
+import math
+
+import numpy as np
+
+
+class PositionSample:
+    __slots__ = ('time', 'latitude_deg', 'longitude_deg', 'absolute_altitude_m', 'relative_altitude_m')
+
+    def __init__(self, time, latitude_deg, longitude_deg, absolute_altitude_m, relative_altitude_m):
+        self.time = time
+        self.latitude_deg = latitude_deg
+        self.longitude_deg = longitude_deg
+        self.absolute_altitude_m = absolute_altitude_m
+        self.relative_altitude_m = relative_altitude_m
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{s}={getattr(self, s)}' for s in self.__slots__)})"
+
+
+class VelocitySample:
+    __slots__ = ('time', 'north_m_s', 'east_m_s', 'down_m_s')
+
+    def __init__(self, time, north_m_s, east_m_s, down_m_s):
+        self.time = time
+        self.north_m_s = north_m_s
+        self.east_m_s = east_m_s
+        self.down_m_s = down_m_s
+
+    __repr__ = PositionSample.__repr__
+
+
+class BatterySample:
+    __slots__ = ('time', 'voltage_v', 'remaining_percent')
+
+    def __init__(self, time, voltage_v, remaining_percent):
+        self.time = time
+        self.voltage_v = voltage_v
+        self.remaining_percent = remaining_percent
+
+    __repr__ = PositionSample.__repr__
+
+
+class TimeSeriesRing:
+    """
+    Fixed capacity ring buffer of time stamped samples, one float64 column per sample field.
+    Once full, the oldest samples are overwritten, so memory use is bounded by the capacity.
+    """
+
+    def __init__(self, sample_type, capacity):
+        self.sample_type = sample_type
+        self.fields = sample_type.__slots__[1:]
+        self.capacity = capacity
+        self.times = np.full(capacity, np.nan)
+        self.data = np.full((capacity, len(self.fields)), np.nan)
+        self.head = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, t, *values):
+        self.times[self.head] = t
+        self.data[self.head] = values
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def latest(self):
+        if not self.count:
+            return None
+        return self.sample_type(float(self.times[self.head - 1]), *map(float, self.data[self.head - 1]))
+
+    def _indices(self, seconds=None):
+        start = self.head - self.count
+        if seconds is not None and self.count:
+            # ring order is time order, so the window start can be found by bisection over the unrolled times
+            order = np.arange(start, self.head) % self.capacity
+            start += int(np.searchsorted(self.times[order], self.times[self.head - 1] - seconds))
+        return np.arange(start, self.head) % self.capacity
+
+    def window(self, seconds=None):
+        """Returns (times, data) copies of the samples within the last `seconds`, oldest first."""
+        indices = self._indices(seconds)
+        return self.times[indices], self.data[indices]
+
+    def column(self, field, seconds=None):
+        indices = self._indices(seconds)
+        return self.times[indices], self.data[indices, self.fields.index(field)]
+
+    def rate(self, field, seconds):
+        """Least squares slope of `field` per second over the window, nan if there are less than two samples."""
+        t, y = self.column(field, seconds)
+        if len(t) < 2:
+            return math.nan
+        t = t - t.mean()
+        denominator = np.dot(t, t)
+        return float(np.dot(t, y - y.mean()) / denominator) if denominator else math.nan
+
+    def moving_average(self, field, seconds):
+        _, y = self.column(field, seconds)
+        return float(y.mean()) if len(y) else math.nan
+
+    def time_to_reach(self, field, target, seconds):
+        """Seconds until `field` reaches `target` at the current rate, inf if it is not converging."""
+        latest = self.latest()
+        if latest is None:
+            return math.inf
+        remaining = target - getattr(latest, field)
+        rate = self.rate(field, seconds)
+        if remaining == 0:
+            return 0.0
+        if math.isnan(rate) or rate == 0 or (remaining > 0) != (rate > 0):
+            return math.inf
+        return remaining / rate
+
+
+class TelemetryHistory:
+    """
+    Bounded time series of position, velocity and battery telemetry for derived rate queries.
+    The default capacity holds ten minutes at 10 Hz per stream.
+    """
+
+    def __init__(self, capacity=6000):
+        self.position = TimeSeriesRing(PositionSample, capacity)
+        self.velocity = TimeSeriesRing(VelocitySample, capacity)
+        self.battery = TimeSeriesRing(BatterySample, capacity)
+
+    def climb_rate(self, seconds=2.0):
+        return self.position.rate('relative_altitude_m', seconds)
+
+    def ground_speed(self, seconds=1.0):
+        _, data = self.velocity.window(seconds)
+        if not len(data):
+            return math.nan
+        return float(np.hypot(data[:, 0], data[:, 1]).mean())
+
+    def mean_altitude(self, seconds=1.0):
+        return self.position.moving_average('relative_altitude_m', seconds)
+
+    def time_to_altitude(self, altitude, seconds=2.0):
+        return self.position.time_to_reach('relative_altitude_m', altitude, seconds)
+
+    def time_to_cover(self, distance, seconds=1.0):
+        """Seconds to fly `distance` metres at the current ground speed, inf while hovering."""
+        speed = self.ground_speed(seconds)
+        if math.isnan(speed) or speed < 0.05:
+            return math.inf
+        return distance / speed
+
+    def battery_drain(self, seconds=60.0):
+        return -self.battery.rate('remaining_percent', seconds)
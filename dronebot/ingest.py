@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import socket
+import sys
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__.upper())
+
+
+class IngestError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return f"{type(self).__name__}: {self.message}"
+
+
+class Transmission:
+    """One transcript with the source it came from and its wall clock arrival time."""
+    __slots__ = ('text', 'source', 'received', 'marks')
+
+    def __init__(self, text, source, received, marks=None):
+        self.text = text
+        self.source = source
+        self.received = received
+        self.marks = dict(marks or ())
+        self.marks.setdefault('received', received)
+
+    def __repr__(self):
+        return f"Transmission({self.text!r}, source={self.source!r})"
+
+
+def decode(line, source):
+    """
+    Decodes a plain text transcript or a JSON object {"text": ..., "marks": {...}} as sent by mic_vad_streaming,
+    whose marks carry the upstream VAD and ASR times into the trace.
+    """
+    received = time.time()
+    line = line.strip()
+    if line.startswith('{'):
+        try:
+            message = json.loads(line)
+            return Transmission(str(message.get('text', '')).strip(), source, received, message.get('marks'))
+        except (json.JSONDecodeError, AttributeError):
+            logger.warning(f"Malformed transcript from {source}: {line}")
+            return None
+    return Transmission(line, source, received)
+
+
+def parse_address(address):
+    """Splits 'stdin', 'unix://PATH' and 'udp://HOST:PORT' into the transport and its address."""
+    if address in ('-', 'stdin'):
+        return 'stdin', None
+    if address.startswith('unix://'):
+        return 'unix', address[len('unix://'):]
+    if address.startswith('udp://'):
+        host, _, port = address[len('udp://'):].rpartition(':')
+        if not port.isdigit():
+            raise IngestError(f"Missing port in {address}")
+        return 'udp', (host or 'localhost', int(port))
+    raise IngestError(f"Unknown transcript source {address}")
+
+
+class DatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, ingest, source):
+        self.ingest = ingest
+        self.source = source
+
+    def datagram_received(self, data, addr):
+        for line in data.decode(errors='replace').splitlines():
+            self.ingest.put(line, self.source)
+
+
+class Ingest:
+    """
+    Merges the transcripts of several producers into one queue, read natively by the event loop.
+    Sources are stdin, a UNIX stream socket taking one transcript per line from any number of ASR processes, and a
+    UDP port taking one transcript per datagram, so speech recognition can run on another core or box.
+    """
+
+    def __init__(self, sources=('stdin',)):
+        self.sources = list(sources)
+        self.queue = asyncio.Queue()
+        self.closables = list()
+        self.tasks = list()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        for address in self.sources:
+            transport, target = parse_address(address)
+            if transport == 'stdin':
+                self.tasks.append(asyncio.create_task(self.read_pipe(sys.stdin, 'stdin')))
+            elif transport == 'unix':
+                Path(target).unlink(missing_ok=True)
+                server = await asyncio.start_unix_server(
+                    lambda reader, writer, source=address: self.read_stream(reader, writer, source), path=target)
+                self.closables.append(server)
+            else:
+                udp, _ = await loop.create_datagram_endpoint(
+                    lambda source=address: DatagramProtocol(self, source), local_addr=target)
+                self.closables.append(udp)
+            logger.info(f"Listening for transcripts on {address}")
+
+    def put(self, line, source):
+        transmission = decode(line, source)
+        if transmission and transmission.text:
+            self.queue.put_nowait(transmission)
+
+    async def get(self):
+        return await self.queue.get()
+
+    async def read_pipe(self, pipe, source):
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        try:
+            await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), pipe)
+        except ValueError:
+            # a redirected regular file cannot be polled, but reading it never blocks for long either
+            for line in await loop.run_in_executor(None, pipe.readlines):
+                self.put(line, source)
+            logger.info(f"End of transcripts on {source}")
+            return
+        await self.read_lines(reader, source)
+
+    async def read_stream(self, reader, writer, source):
+        peer = writer.get_extra_info('peername') or source
+        logger.debug(f"Transcript producer connected on {source}")
+        try:
+            await self.read_lines(reader, source)
+        finally:
+            writer.close()
+            logger.debug(f"Transcript producer {peer} disconnected")
+
+    async def read_lines(self, reader, source):
+        while True:
+            line = await reader.readline()
+            if not line:
+                logger.info(f"End of transcripts on {source}")
+                return
+            self.put(line.decode(errors='replace'), source)
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+        for closable in self.closables:
+            closable.close()
+        for address in self.sources:
+            transport, target = parse_address(address)
+            if transport == 'unix':
+                Path(target).unlink(missing_ok=True)
+
+
+class Sender:
+    """Blocking client for an ASR process, sends each transcript with its marks as one JSON line or datagram."""
+
+    def __init__(self, address):
+        self.transport, self.target = parse_address(address)
+        if self.transport == 'stdin':
+            raise IngestError("Transcripts are sent to a unix:// or udp:// address")
+        self.sock = None
+
+    def connect(self):
+        if self.transport == 'udp':
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(self.target)
+
+    def send(self, text, marks=None):
+        line = json.dumps({'text': text, 'marks': marks or {}}) + "\n"
+        try:
+            if self.sock is None:
+                self.connect()
+            if self.transport == 'udp':
+                self.sock.sendto(line.encode(), self.target)
+            else:
+                self.sock.sendall(line.encode())
+        except OSError as e:
+            logger.error(f"Sending transcript failed: {e}")
+            self.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from dronebot.recorder import encode
+
+logger = logging.getLogger(__name__.upper())
+
+
+class Journal:
+    """
+    Append-only write-ahead journal of JSON lines for one vehicle's flight state.
+    Records are buffered and written with a single fsync per batch, at most `interval` seconds after the first
+    record of the batch. On an event loop the batch is written by the journal's own writer thread, so the fsync does
+    not stall the loop and batches and compactions reach the file in order. After `compact_after` records the
+    journal is atomically replaced by one snapshot record taken from `snapshot`. A torn last line from a crash is
+    ignored when reading, so the journal always restores to the last complete record. Without a path, nothing is
+    written.
+    """
+
+    def __init__(self, path=None, interval=0.05, compact_after=512):
+        self.path = Path(path) if path else None
+        self.interval = interval
+        self.compact_after = compact_after
+        self.snapshot = None
+        self.lock = threading.Lock()
+        self.buffer = list()
+        self.count = 0
+        self.scheduled = None
+        self.writer = None
+        self.file = None
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a+') as file:
+                file.seek(0)
+                self.count = sum(1 for _ in file)
+            self.file = open(self.path, 'a')
+
+    def __bool__(self):
+        return self.file is not None
+
+    def append(self, kind, **data):
+        if not self:
+            return
+        with self.lock:
+            self.buffer.append(json.dumps(dict(kind=kind, t=time.time(), **data), default=encode) + "\n")
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if self.scheduled is None:
+            self.scheduled = loop.call_later(self.interval, self.write_behind, loop)
+
+    def write_behind(self, loop):
+        """Hands the batch to the writer thread, a compaction it makes due takes its snapshot back on the loop."""
+        self.scheduled = None
+        if self.writer is None:
+            self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='journal')
+        loop.run_in_executor(self.writer, self.write).add_done_callback(lambda done: self.written(loop, done))
+
+    def written(self, loop, done):
+        if done.cancelled() or self.writer is None:
+            return
+        if done.exception() is not None:
+            logger.error(f"Writing journal {self.path} failed: {done.exception()}")
+        elif done.result():
+            # the snapshot is taken on the loop, together with the records it already covers
+            with self.lock:
+                record, pending = self.snapshot(), "".join(self.buffer)
+                self.buffer.clear()
+            loop.run_in_executor(self.writer, self.compact, record, pending)
+
+    def write(self):
+        """Writes and fsyncs the buffered records, True if the journal is due for compaction."""
+        with self.lock:
+            if not self.buffer or self.file is None:
+                return False
+            self.file.write("".join(self.buffer))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.count += len(self.buffer)
+            self.buffer.clear()
+        return self.snapshot is not None and self.count > self.compact_after
+
+    def flush(self):
+        self.scheduled = None
+        if self.write():
+            self.compact()
+
+    def compact(self, record=None, pending=None):
+        """Replaces the journal by a single snapshot record, written to a temporary file and renamed over it."""
+        if not self or self.snapshot is None:
+            return
+        if record is None:
+            # a compaction already handed to the writer thread must not replace this newer one
+            self.drain()
+        with self.lock:
+            if record is None:
+                record, pending = self.snapshot(), "".join(self.buffer)
+                self.buffer.clear()
+            temporary = self.path.with_suffix('.tmp')
+            with open(temporary, 'w') as file:
+                file.write(json.dumps(dict(kind='snapshot', t=time.time(), **record), default=encode) + "\n")
+                file.write(pending)
+                file.flush()
+                os.fsync(file.fileno())
+            self.file.close()
+            os.replace(temporary, self.path)
+            self.file = open(self.path, 'a')
+            self.count = 1 + pending.count("\n")
+        logger.debug(f"Compacted journal {self.path}")
+
+    def records(self):
+        if not self.path or not self.path.exists():
+            return []
+        records = list()
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    logger.warning(f"Ignoring torn record at the end of {self.path}")
+                    break
+        return records
+
+    def truncate(self):
+        if not self:
+            return
+        self.drain()
+        with self.lock:
+            self.buffer.clear()
+            self.file.close()
+            self.file = open(self.path, 'w')
+            self.count = 0
+
+    def drain(self):
+        """Waits for the batches and compactions handed to the writer thread."""
+        if self.writer is not None:
+            self.writer.shutdown(wait=True)
+            self.writer = None
+
+    def close(self):
+        if self.scheduled is not None:
+            self.scheduled.cancel()
+        self.drain()
+        self.flush()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
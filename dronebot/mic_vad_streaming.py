@@ -1,30 +1,33 @@
+import atexit
 import collections
 import logging
 import os
 import os.path
 import queue
+import time
 import wave
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-import deepspeech
 import numpy as np
-import pyaudio
-import webrtcvad
-from halo import Halo
-from scipy import signal
+
+# deepspeech, pyaudio, webrtcvad, scipy and halo are imported where they are first used, so --help starts
+# without them and resampling is only loaded for devices that need it
 
 logging.basicConfig(level=20)
 
 class Audio(object):
     """Streams raw audio from microphone. Data is received in a separate thread, and stored in a buffer, to be read from."""
 
-    FORMAT = pyaudio.paInt16
+    SAMPLE_WIDTH = 2
     # Network/VAD rate-space
     RATE_PROCESS = 16000
     CHANNELS = 1
     BLOCKS_PER_SECOND = 50
 
     def __init__(self, callback=None, device=None, input_rate=RATE_PROCESS, file=None):
+        import pyaudio
+
         def proxy_callback(in_data, frame_count, time_info, status):
             #pylint: disable=unused-argument
             if self.chunk is not None:
@@ -41,7 +44,7 @@ class Audio(object):
         self.pa = pyaudio.PyAudio()
 
         kwargs = {
-            'format': self.FORMAT,
+            'format': pyaudio.get_format_from_width(self.SAMPLE_WIDTH),
             'channels': self.CHANNELS,
             'rate': self.input_rate,
             'input': True,
@@ -70,6 +73,7 @@ class Audio(object):
             data (binary): Input audio stream
             input_rate (int): Input audio rate to resample from
         """
+        from scipy import signal
         data16 = np.fromstring(string=data, dtype=np.int16)
         resample_size = int(len(data16) / self.input_rate * self.RATE_PROCESS)
         resample = signal.resample(data16, resample_size)
@@ -96,9 +100,7 @@ class Audio(object):
         logging.info("write wav %s", filename)
         wf = wave.open(filename, 'wb')
         wf.setnchannels(self.CHANNELS)
-        # wf.setsampwidth(self.pa.get_sample_size(FORMAT))
-        assert self.FORMAT == pyaudio.paInt16
-        wf.setsampwidth(2)
+        wf.setsampwidth(self.SAMPLE_WIDTH)
         wf.setframerate(self.sample_rate)
         wf.writeframes(data)
         wf.close()
@@ -108,6 +110,7 @@ class VADAudio(Audio):
     """Filter & segment audio with voice activity detection."""
 
     def __init__(self, aggressiveness=3, device=None, input_rate=None, file=None):
+        import webrtcvad
         super().__init__(device=device, input_rate=input_rate, file=file)
         self.vad = webrtcvad.Vad(aggressiveness)
 
@@ -155,32 +158,121 @@ class VADAudio(Audio):
                     yield None
                     ring_buffer.clear()
 
+def load_model(ARGS):
+    import deepspeech
+    logging.info("ARGS.model: %s", ARGS.model)
+    model = deepspeech.Model(ARGS.model)
+    if ARGS.scorer:
+        logging.info("ARGS.scorer: %s", ARGS.scorer)
+        model.enableExternalScorer(ARGS.scorer)
+    return model, time.time()
+
+def word_errors(reference, hypothesis):
+    """Word level edit distance between two transcripts."""
+    reference, hypothesis = reference.split(), hypothesis.split()
+    row = list(range(len(hypothesis) + 1))
+    for i, word in enumerate(reference, 1):
+        previous, row[0] = row[0], i
+        for j, guess in enumerate(hypothesis, 1):
+            previous, row[j] = row[j], min(row[j] + 1, row[j - 1] + 1, previous + (word != guess))
+    return row[-1]
+
+def load_rescorer(ARGS):
+    """Grammar rescoring of the decoder's N best transcripts, None with a single candidate."""
+    if ARGS.candidates < 2:
+        return None
+    from dronebot.rescore import Rescorer
+    rescorer = Rescorer(ARGS.call_sign)
+    rescorer.warm_up()
+    return rescorer
+
+def load_denoiser(ARGS):
+    if not ARGS.denoise:
+        return None
+    from dronebot.denoise import Denoiser
+    return Denoiser(budget_ms=ARGS.denoise_budget)
+
+def transcribe_store(ARGS):
+    """Transcribes the clips of an ingested audio store and reports the word error rate, without any decoding."""
+    from dronebot.audiostore import AudioStore
+    from dronebot.rescore import candidates_of
+    model, _ = load_model(ARGS)
+    rescorer = load_rescorer(ARGS)
+    denoiser = load_denoiser(ARGS)
+    errors = words = 0
+    with AudioStore(ARGS.store) as store:
+        for row, transcript, samples in store.items(ARGS.split):
+            started = time.time()
+            audio = np.frombuffer(samples, np.int16)
+            if denoiser:
+                audio = denoiser.clip(audio)
+            if rescorer:
+                text, _ = rescorer.choose(candidates_of(model.sttWithMetadata(audio, ARGS.candidates)))
+            else:
+                text = model.stt(audio)
+            errors += word_errors(transcript, text)
+            words += len(transcript.split())
+            logging.info("Row %d in %.0fms: %s", row, (time.time() - started) * 1000, text)
+            if text != transcript:
+                logging.info("   expected: %s", transcript)
+    print("WER %.3f over %d words" % (errors / max(words, 1), words))
+    if rescorer:
+        print(rescorer.report())
+    if denoiser:
+        print(denoiser.report())
+
 def main(ARGS):
+    from dronebot.config_logging import RateLimit
+    for handler in logging.getLogger().handlers:
+        handler.addFilter(RateLimit())
+
     # Load DeepSpeech model
     if os.path.isdir(ARGS.model):
         model_dir = ARGS.model
         ARGS.model = os.path.join(model_dir, 'output_graph.pb')
         ARGS.scorer = os.path.join(model_dir, ARGS.scorer)
+    if ARGS.store:
+        return transcribe_store(ARGS)
 
     print('Initializing model...')
-    logging.info("ARGS.model: %s", ARGS.model)
-    model = deepspeech.Model(ARGS.model)
-    if ARGS.scorer:
-        logging.info("ARGS.scorer: %s", ARGS.scorer)
-        model.enableExternalScorer(ARGS.scorer)
-
-    # Start audio with VAD
-    vad_audio = VADAudio(aggressiveness=ARGS.vad_aggressiveness,
-                         device=ARGS.device,
-                         input_rate=ARGS.rate,
-                         file=ARGS.file)
+    started = time.time()
+    # the model loads while the audio device opens
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        loading = pool.submit(load_model, ARGS)
+        # Start audio with VAD
+        vad_audio = VADAudio(aggressiveness=ARGS.vad_aggressiveness,
+                             device=ARGS.device,
+                             input_rate=ARGS.rate,
+                             file=ARGS.file)
+        audio_ready = time.time()
+        model, model_ready = loading.result()
+    logging.info("Audio ready after %.0fms, model after %.0fms, listening after %.0fms",
+                 (audio_ready - started) * 1000, (model_ready - started) * 1000, (time.time() - started) * 1000)
     print("Listening (ctrl-C to exit)...")
-    frames = vad_audio.vad_collector()
+    denoiser = load_denoiser(ARGS)
+    if denoiser:
+        atexit.register(lambda: print(denoiser.report()))
+        frames = vad_audio.vad_collector(frames=denoiser.stream(vad_audio.frame_generator()))
+    else:
+        frames = vad_audio.vad_collector()
 
     # Stream from microphone to DeepSpeech using VAD
     spinner = None
     if not ARGS.nospinner:
+        from halo import Halo
         spinner = Halo(spinner='line')
+    tracer = None
+    if ARGS.trace:
+        from dronebot.tracing import Tracer
+        tracer = Tracer(ARGS.trace)
+    sender = None
+    if ARGS.send:
+        from dronebot.ingest import Sender
+        sender = Sender(ARGS.send)
+    rescorer = load_rescorer(ARGS)
+    if rescorer:
+        from dronebot.rescore import candidates_of
+        atexit.register(lambda: print(rescorer.report()))
     stream_context = model.createStream()
     wav_data = bytearray()
     for frame in frames:
@@ -192,10 +284,20 @@ def main(ARGS):
         else:
             if spinner: spinner.stop()
             logging.debug("end utterence")
+            vad_end = time.time()
             if ARGS.savewav:
                 vad_audio.write_wav(os.path.join(ARGS.savewav, datetime.now().strftime("savewav_%Y-%m-%d_%H-%M-%S_%f.wav")), wav_data)
                 wav_data = bytearray()
-            text = stream_context.finishStream()
+            if rescorer:
+                text, _ = rescorer.choose(candidates_of(stream_context.finishStreamWithMetadata(ARGS.candidates)))
+            else:
+                text = stream_context.finishStream()
+            asr_finish = time.time()
+            logging.info("ASR finished %.0fms after end of utterance", (asr_finish - vad_end) * 1000)
+            if tracer:
+                tracer.export({'text': text, 'marks': {'vad_end': vad_end, 'asr_finish': asr_finish}})
+            if sender and text:
+                sender.send(text, {'vad_end': vad_end, 'asr_finish': asr_finish})
             print("Recognized: %s" % text)
             if ARGS.keyboard:
                 from pyautogui import typewrite
@@ -227,6 +329,23 @@ if __name__ == '__main__':
                         help=f"Input device sample rate. Default: {DEFAULT_SAMPLE_RATE}. Your device may require 44100.")
     parser.add_argument('-k', '--keyboard', action='store_true', 
                         help="Type output through system keyboard")
+    parser.add_argument('--trace', metavar='PATH|udp://HOST:PORT',
+                        help="Export end of utterance and ASR finish times as JSON lines")
+    parser.add_argument('--send', metavar='unix://PATH|udp://HOST:PORT',
+                        help="Send each transcript with its VAD and ASR times to a controller listening on this socket")
+    parser.add_argument('--denoise', action='store_true',
+                        help="Band limit and subtract the background noise before VAD and ASR")
+    parser.add_argument('--denoise-budget', type=float, default=2.0, metavar='MS',
+                        help="Average time per 20ms frame the denoising may take before it turns itself off. Default: 2")
+    parser.add_argument('--store', metavar='DIR',
+                        help="Transcribe the clips of an audio store (python3 -m dronebot.audiostore) and report the WER")
+    parser.add_argument('--split', choices=('train', 'dev', 'test'),
+                        help="Only transcribe this split of --store. Default: all clips")
+    parser.add_argument('-n', '--candidates', type=int, default=5,
+                        help="Transcripts the decoder returns, the first one the command grammar can parse is used. "
+                             "1 disables the rescoring. Default: 5")
+    parser.add_argument('-c', '--call_sign', default="cityairbus1234",
+                        help="Call sign the rescoring expects. Default: cityairbus1234")
     ARGS = parser.parse_args()
     if ARGS.savewav: os.makedirs(ARGS.savewav, exist_ok=True)
     main(ARGS)
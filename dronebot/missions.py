@@ -0,0 +1,146 @@
+import asyncio
+import copy
+import logging
+import time
+import traceback
+import weakref
+
+from mavsdk import System, mission
+
+logger = logging.getLogger(__name__.upper())
+
+
+def mission_item(latitude_deg, longitude_deg, relative_altitude_m, speed_m_s=1.0, loiter_time_s=5.0):
+    return mission.MissionItem(
+        latitude_deg, longitude_deg, relative_altitude_m,
+        speed_m_s, False, float('nan'), float('nan'),
+        mission.MissionItem.CameraAction.NONE,
+        loiter_time_s, float('nan')
+    )
+
+
+def with_altitude(items, relative_altitude_m):
+    changed = list()
+    for item in items:
+        item = copy.copy(item)
+        item.relative_altitude_m = relative_altitude_m
+        changed.append(item)
+    return changed
+
+
+def item_key(item):
+    # centimetre resolution, anything finer is below what the autopilot can fly anyway
+    return (round(item.latitude_deg, 7), round(item.longitude_deg, 7), round(item.relative_altitude_m, 2),
+            round(item.speed_m_s, 2), item.is_fly_through, round(item.loiter_time_s, 1))
+
+
+class UploadStats:
+    __slots__ = ('uploads', 'jumps', 'skipped', 'total_s', 'max_s', 'last_s')
+
+    def __init__(self):
+        self.uploads = 0
+        self.jumps = 0
+        self.skipped = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.last_s = 0.0
+
+    def add(self, seconds):
+        self.uploads += 1
+        self.total_s += seconds
+        self.last_s = seconds
+        self.max_s = max(self.max_s, seconds)
+
+    @property
+    def mean_s(self):
+        return self.total_s / self.uploads if self.uploads else 0.0
+
+    def __str__(self):
+        return (f"{self.uploads} uploads (last {self.last_s * 1000:.0f}ms, mean {self.mean_s * 1000:.0f}ms, "
+                f"max {self.max_s * 1000:.0f}ms), {self.jumps} jumps, {self.skipped} skipped")
+
+
+class MissionManager:
+    """
+    Tracks the mission plan stored on one vehicle and applies new plans with the fewest MAVLink round trips:
+    * an identical plan is not uploaded again, the mission is only (re)started
+    * a plan equal to the remaining tail of the stored plan jumps to that item
+    * anything else clears and uploads, timing the upload
+    """
+
+    _managers = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def of(cls, drone: System):
+        if drone not in cls._managers:
+            cls._managers[drone] = cls(drone)
+        return cls._managers[drone]
+
+    def __init__(self, drone: System):
+        self.drone = drone
+        self.plan = None
+        self.keys = ()
+        self.current = 0
+        self.altitude = 5
+        self.stats = UploadStats()
+
+    @property
+    def remaining_items(self):
+        """Items of the stored plan that have not been reached yet."""
+        if self.plan is None:
+            return []
+        return self.plan.mission_items[min(self.current, len(self.keys) - 1):]
+
+    async def progress(self, timeout=0.5):
+        async def read():
+            async for mission_progress in self.drone.mission.mission_progress():
+                return mission_progress
+        try:
+            mission_progress = await asyncio.wait_for(read(), timeout)
+        except asyncio.TimeoutError:
+            return self.current
+        logger.debug(mission_progress)
+        self.current = max(mission_progress.current, 0)
+        return self.current
+
+    async def apply(self, mission_plan):
+        keys = tuple(map(item_key, mission_plan.mission_items))
+        if keys == self.keys:
+            logger.debug("Mission unchanged, skipping upload")
+            self.stats.skipped += 1
+            await self.start()
+            return 'unchanged'
+        offset = len(self.keys) - len(keys)
+        if keys and offset > 0 and self.keys[offset:] == keys:
+            logger.debug(f"Mission is the tail of the stored plan, jumping to item {offset}")
+            self.stats.jumps += 1
+            await self.drone.mission.set_current_mission_item(offset)
+            self.current = offset
+            await self.start()
+            return 'jump'
+        started = time.perf_counter()
+        await self.drone.mission.clear_mission()
+        await self.drone.mission.upload_mission(mission_plan)
+        self.stats.add(time.perf_counter() - started)
+        self.plan = mission_plan
+        self.keys = keys
+        self.current = 0
+        logger.debug("Mission:" + "".join(map(
+            lambda item: f"\n\t{item.latitude_deg}, {item.longitude_deg}, {item.relative_altitude_m}",
+            mission_plan.mission_items)))
+        logger.info(f"Mission uploaded in {self.stats.last_s * 1000:.0f}ms, {self.stats}")
+        await self.start()
+        return 'upload'
+
+    async def start(self):
+        try:
+            await self.drone.mission.start_mission()
+        except mission.MissionError as e:
+            logger.error(e)
+            logger.debug(traceback.format_exc())
+
+    def forget(self):
+        """Drops the stored plan, e.g. after the autopilot left mission mode for a landing or RTL."""
+        self.plan = None
+        self.keys = ()
+        self.current = 0
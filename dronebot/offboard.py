@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import math
+import time
+import traceback
+import weakref
+
+from mavsdk import System, mission, offboard
+
+from dronebot.missions import MissionManager
+from dronebot.telem import Telemetry
+
+logger = logging.getLogger(__name__.upper())
+
+
+class OffboardGuidance:
+    """
+    Optional low latency control mode streaming velocity setpoints through mavsdk offboard.
+    A proportional guidance loop flies towards a target in the home frame (east, north, relative altitude) with a
+    commanded yaw, fed from the latest Telemetry sample. New targets take effect on the next setpoint, so a turn
+    or climb starts within one loop period instead of after a mission upload. If offboard mode cannot be started,
+    `steer` returns False and the caller falls back to mission mode. If a setpoint is rejected later, guidance
+    leaves offboard mode and flies the mission plan given with the target, or holds without one. Once a second
+    the stream checks that the vehicle is still in offboard mode; if it left it, e.g. for an RTL, streaming stops
+    and the next `steer` engages offboard mode again.
+    """
+
+    _guidance = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def of(cls, drone: System, telem: Telemetry):
+        if drone not in cls._guidance:
+            cls._guidance[drone] = cls(drone, telem)
+        return cls._guidance[drone]
+
+    def __init__(self, drone: System, telem: Telemetry, rate=20, gain=0.8, max_speed=2.0, max_climb=1.0):
+        self.drone = drone
+        self.telem = telem
+        self.rate = rate
+        self.gain = gain
+        self.max_speed = max_speed
+        self.max_climb = max_climb
+        self.enabled = False
+        self.target = None
+        self.yaw = 0.0
+        self.task = None
+        self.requested = None
+        self.plan = None
+
+    @property
+    def active(self):
+        return self.task is not None and not self.task.done()
+
+    def setpoint(self):
+        east, north = self.telem.east_north()
+        target_east, target_north, target_alt = self.target
+        d_east = target_east - east
+        d_north = target_north - north
+        distance = math.hypot(d_east, d_north)
+        speed = min(self.gain * distance, self.max_speed)
+        scale = speed / distance if distance > 1e-3 else 0.0
+        climb = max(-self.max_climb, min(self.max_climb, self.gain * (target_alt - self.telem.altitude)))
+        return offboard.VelocityNedYaw(d_north * scale, d_east * scale, -climb, self.yaw)
+
+    async def engaged(self):
+        try:
+            return await self.drone.offboard.is_active()
+        except offboard.OffboardError:
+            return False
+
+    async def steer(self, *, east=None, north=None, altitude=None, yaw=None, plan=None):
+        """
+        Sets a new target, keeping unspecified components, and starts streaming if needed. `plan` is the mission
+        plan for the same instruction, flown instead if a setpoint is rejected.
+        """
+        if self.telem.position is None:
+            return False
+        if self.active and not await self.engaged():
+            logger.info("Vehicle left offboard mode, engaging it again")
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.target = None
+        if self.target is None:
+            current = self.telem.east_north()
+            self.target = (current[0], current[1], self.telem.altitude)
+        self.target = (self.target[0] if east is None else east,
+                       self.target[1] if north is None else north,
+                       self.target[2] if altitude is None else altitude)
+        if yaw is not None:
+            self.yaw = yaw
+        self.plan = plan
+        self.requested = time.perf_counter()
+        if self.active:
+            return True
+        try:
+            await self.drone.offboard.set_velocity_ned(self.setpoint())
+            await self.drone.offboard.start()
+        except offboard.OffboardError as e:
+            logger.error(f"Offboard unavailable, falling back to mission mode: {e}")
+            logger.debug(traceback.format_exc())
+            self.target = None
+            return False
+        logger.info("Offboard guidance started")
+        self.task = asyncio.create_task(self.stream())
+        return True
+
+    async def hold(self):
+        east, north = self.telem.east_north()
+        return await self.steer(east=east, north=north, altitude=self.telem.altitude)
+
+    async def stream(self):
+        period = 1 / self.rate
+        sent = 0
+        while True:
+            try:
+                await self.drone.offboard.set_velocity_ned(self.setpoint())
+            except offboard.OffboardError as e:
+                logger.error(f"Offboard setpoint rejected, falling back to mission mode: {e}")
+                await self.fall_back()
+                return
+            sent += 1
+            if sent % self.rate == 0 and not await self.engaged():
+                logger.warning("Vehicle left offboard mode, guidance stopped")
+                self.target = None
+                return
+            if self.requested is not None:
+                logger.debug(f"Offboard setpoint sent {(time.perf_counter() - self.requested) * 1000:.0f}ms after request")
+                self.requested = None
+            await asyncio.sleep(period)
+
+    async def fall_back(self):
+        """Leaves offboard mode, so PX4 does not trigger its offboard loss failsafe, and flies on in mission mode."""
+        self.target = None
+        try:
+            await self.drone.offboard.stop()
+        except offboard.OffboardError as e:
+            logger.error(e)
+            logger.debug(traceback.format_exc())
+        try:
+            if self.plan is not None:
+                await MissionManager.of(self.drone).apply(self.plan)
+            else:
+                await self.drone.mission.pause_mission()
+        except mission.MissionError as e:
+            logger.error(e)
+            logger.debug(traceback.format_exc())
+
+    async def stop(self):
+        """Stops streaming and leaves offboard mode, e.g. before a mission upload takes over."""
+        if not self.active:
+            return
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.target = None
+        try:
+            await self.drone.offboard.stop()
+        except offboard.OffboardError as e:
+            logger.error(e)
+            logger.debug(traceback.format_exc())
+        logger.info("Offboard guidance stopped")
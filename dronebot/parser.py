@@ -3,7 +3,6 @@ import re
 
 from text_to_num import alpha2digit
 
-from dronebot import config_logging
 from dronebot.vocab import Vocabulary
 
 logger = logging.getLogger(__name__.upper())
@@ -17,24 +16,35 @@ class CommunicationError(Exception):
         return self.message
 
 
+def call_sign_of(cmd_string):
+    """Call sign a transmission is addressed to, e.g. 'cityairbus1234' for 'cityairbus one two three four ...'."""
+    token = re.sub(r"(?<=\d)\s(?=\d)", "", alpha2digit(cmd_string, "en", True)).split()
+    if not token:
+        return None
+    if len(token) > 1 and token[1].isdigit():
+        return token[0] + token[1]
+    return token[0]
+
+
 class Parser(object):
     """
     Converts stdin command strings from deepspeech into parsed command data.
     """
 
-    def __init__(self, call_sign):
+    def __init__(self, call_sign, vocab: Vocabulary = None):
         self.call_sign = call_sign
-        self.vocab = Vocabulary()
+        self.vocab = vocab or Vocabulary()
         self.command_list = list()
 
     def find_next_verb(self, phrase):
+        """First verb in `phrase` as (start, end, verb, mode), the longer one where two start together."""
+        found = None
         for mode in self.vocab.VERBS.keys():
             for r in self.vocab.VERBS.get(mode):
                 match = re.search(r, phrase)
-                if match:
-                    # logger.debug(match)
-                    return match.start(), match.end(), r, mode
-        return 0, 0, 0, 0
+                if match and (found is None or (match.start(), -match.end()) < (found[0], -found[1])):
+                    found = match.start(), match.end(), r, mode
+        return found or (0, 0, 0, 0)
 
     def handle_phrase(self, phrase, mode):
         logger.debug(f"Handle phrase '{phrase}'")
@@ -63,16 +73,13 @@ class Parser(object):
         if not verb2:
             j1 = len(phrase)
         self.handle_phrase(phrase[i1:i2+j1], mode)
-        self.handle_phrase_queue(phrase[j1:])
+        # j1 is relative to the end of this phrase's verb
+        self.handle_phrase_queue(phrase[i2+j1:])
 
     def handle_id(self, cmd_string):
-        cmd_string = re.sub(r"(?<=\d)\s(?=\d)", "", alpha2digit(cmd_string, "en", True))
-        token = cmd_string.split()
-        if len(token) > 1 and token[1].isdigit():
-            token[0] += token[1]
-            token.remove(token[1])
-        if token[0] != self.call_sign:
-            raise CommunicationError(f"Call sign '{token[0]}' not recognized")
+        call_sign = call_sign_of(cmd_string)
+        if call_sign != self.call_sign:
+            raise CommunicationError(f"Call sign '{call_sign}' not recognized")
 
     def handle_command(self, cmd_string):
         self.command_list.clear()
@@ -87,6 +94,8 @@ class Parser(object):
 
 if __name__ == '__main__':
     import argparse
+
+    from dronebot import config_logging
     parser = argparse.ArgumentParser(description="Control PIXHAWK via MavSDK-Python with ATC commands (and respond)")
     parser.add_argument('-c', '--call_sign', default="cityairbus1234",
                         help="Set custom call sign")
@@ -0,0 +1,200 @@
+import enum
+import inspect
+import json
+import logging
+import mmap
+import struct
+import threading
+import time
+from enum import IntEnum
+from pathlib import Path
+
+logger = logging.getLogger(__name__.upper())
+
+MAGIC = b'DBFR\x01\x00'
+HEADER = struct.Struct('<BdI')
+
+
+class Kind(IntEnum):
+    POSITION = 1
+    VELOCITY = 2
+    BATTERY = 3
+    FLAG = 4
+    HEALTH = 5
+    TRANSCRIPT = 10
+    PARSED = 11
+    COMMAND = 12
+    CALL = 13
+
+
+# fixed size telemetry payloads, everything else is stored as utf-8 json
+PAYLOADS = {
+    Kind.POSITION: struct.Struct('<4d'),
+    Kind.VELOCITY: struct.Struct('<3d'),
+    Kind.BATTERY: struct.Struct('<2d'),
+    Kind.FLAG: struct.Struct('<B?'),
+    Kind.HEALTH: struct.Struct('<?'),
+}
+
+FLAGS = ('armed', 'in_air', 'landed')
+
+
+def encode(obj):
+    if isinstance(obj, enum.Enum):
+        return obj.name
+    if hasattr(obj, 'latitude_deg') and hasattr(obj, 'absolute_altitude_m'):
+        return {'__position__': [obj.latitude_deg, obj.longitude_deg, obj.absolute_altitude_m,
+                                 obj.relative_altitude_m]}
+    if hasattr(obj, '__dict__'):
+        return {'__type__': type(obj).__name__, **vars(obj)}
+    return str(obj)
+
+
+class FlightRecorder:
+    """
+    Appends telemetry samples, transcripts, parsed commands and mavsdk calls to a binary flight recording.
+    Each record is a (kind, time, length) header followed by its payload, so the file can be memory mapped and
+    scanned without parsing the payloads.
+    An existing recording is never overwritten, the new one gets a timestamp suffix instead.
+    """
+
+    def __init__(self, path, clock=time.monotonic):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            self.path = self.path.with_name(f"{self.path.stem}-{time.strftime('%Y%m%d-%H%M%S')}{self.path.suffix}")
+        self.clock = clock
+        self.start = clock()
+        self.lock = threading.Lock()
+        self.file = open(self.path, 'xb')
+        self.file.write(MAGIC)
+        self.count = 0
+        logger.info(f"Recording flight to {self.path}")
+
+    def write(self, kind, payload):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(HEADER.pack(kind, self.clock() - self.start, len(payload)))
+            self.file.write(payload)
+            self.count += 1
+
+    def record(self, kind, *values):
+        self.write(kind, PAYLOADS[kind].pack(*values))
+
+    def record_json(self, kind, value):
+        self.write(kind, json.dumps(value, default=encode).encode())
+
+    def record_flag(self, name, value):
+        self.record(Kind.FLAG, FLAGS.index(name), value)
+
+    def record_call(self, name, args, kwargs=None):
+        call = {'name': name, 'args': list(args)}
+        if kwargs:
+            call['kwargs'] = kwargs
+        self.record_json(Kind.CALL, call)
+
+    def flush(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+                logger.info(f"Recorded {self.count} records to {self.path}")
+
+
+class Record:
+    __slots__ = ('kind', 'time', 'value')
+
+    def __init__(self, kind, time, value):
+        self.kind = kind
+        self.time = time
+        self.value = value
+
+    def __repr__(self):
+        return f"Record({self.kind.name}, {self.time:.3f}, {self.value})"
+
+
+class FlightRecording:
+    """
+    Read-only memory mapped view of a flight recording.
+    The record offsets are indexed once on open, payloads are decoded on access.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} is not a flight recording")
+        self.index = list()
+        offset = len(MAGIC)
+        size = len(self.buffer)
+        while offset + HEADER.size <= size:
+            kind, t, length = HEADER.unpack_from(self.buffer, offset)
+            if offset + HEADER.size + length > size:
+                logger.warning(f"Truncated record at offset {offset} of {self.path}")
+                break
+            self.index.append((Kind(kind), t, offset + HEADER.size, length))
+            offset += HEADER.size + length
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def duration(self):
+        return self.index[-1][1] if self.index else 0.0
+
+    def decode(self, kind, offset, length):
+        if kind in PAYLOADS:
+            return PAYLOADS[kind].unpack_from(self.buffer, offset)
+        return json.loads(bytes(self.buffer[offset:offset + length]))
+
+    def records(self, *kinds):
+        for kind, t, offset, length in self.index:
+            if not kinds or kind in kinds:
+                yield Record(kind, t, self.decode(kind, offset, length))
+
+    def close(self):
+        self.buffer.close()
+
+
+class _RecordingPlugin:
+    def __init__(self, drone, name, recorder):
+        self._drone = drone
+        self._name = name
+        self._recorder = recorder
+
+    def __getattr__(self, item):
+        # plugins only exist once the System is connected, so they are resolved on every access
+        attr = getattr(getattr(self._drone, self._name), item)
+        if not inspect.iscoroutinefunction(attr):
+            # streams (async generators) and plain attributes pass through
+            return attr
+        name = f"{self._name}.{item}"
+        recorder = self._recorder
+
+        async def call(*args, **kwargs):
+            recorder.record_call(name, args, kwargs)
+            return await attr(*args, **kwargs)
+        return call
+
+
+class RecordingSystem:
+    """
+    Wraps a mavsdk System so every action, mission and offboard call is appended to the flight recording.
+    Streaming plugins are passed through untouched.
+    """
+
+    recorded_plugins = ('action', 'mission', 'offboard')
+
+    def __init__(self, drone, recorder):
+        self._drone = drone
+        for name in self.recorded_plugins:
+            setattr(self, name, _RecordingPlugin(drone, name, recorder))
+
+    def __getattr__(self, item):
+        return getattr(self._drone, item)
@@ -0,0 +1,279 @@
+import asyncio
+import bisect
+import json
+import logging
+import math
+import selectors
+import time
+from concurrent.futures import Executor, Future
+
+from mavsdk import telemetry, mission
+
+from dronebot import config_logging
+from dronebot.controller import Controller
+from dronebot.recorder import FlightRecording, Kind, FLAGS, encode
+from dronebot.voice import Voice
+
+logger = logging.getLogger(__name__.upper())
+
+
+class ScaledClock:
+    """
+    Event loop clock running `speed` times faster than the wall clock.
+    An infinite speed jumps straight to the next scheduled timer whenever the loop is idle, which also makes the
+    order of timer callbacks independent of the host load.
+    """
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.offset = 0.0
+        self.origin = time.monotonic()
+
+    @property
+    def jump(self):
+        return math.isinf(self.speed)
+
+    def time(self):
+        if self.jump:
+            return self.offset
+        return self.offset + (time.monotonic() - self.origin) * self.speed
+
+    def advance(self, seconds):
+        self.offset += seconds
+
+
+class _ScaledSelector:
+    def __init__(self, clock):
+        self.clock = clock
+        self.selector = selectors.DefaultSelector()
+
+    def select(self, timeout=None):
+        if timeout is None or timeout <= 0:
+            return self.selector.select(timeout)
+        if not self.clock.jump:
+            return self.selector.select(timeout / self.clock.speed)
+        events = self.selector.select(0)
+        if not events:
+            self.clock.advance(timeout)
+        return events
+
+    def __getattr__(self, item):
+        return getattr(self.selector, item)
+
+
+class ScaledClockLoop(asyncio.SelectorEventLoop):
+    def __init__(self, speed=1.0):
+        self.clock = ScaledClock(speed)
+        super().__init__(selector=_ScaledSelector(self.clock))
+
+    def time(self):
+        return self.clock.time()
+
+
+class InlineExecutor(Executor):
+    """Runs executor jobs synchronously, so blocking helpers like the TTS queue stay on the replay clock."""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class SilentTTS:
+    def __init__(self):
+        self.responses = list()
+
+    def respond(self, utterance):
+        logger.info(f"Respond: '{utterance}'")
+        self.responses.append((asyncio.get_event_loop().time(), utterance))
+
+
+class _ReplayStream:
+    def __init__(self, system, times, values):
+        self.system = system
+        self.times = times
+        self.values = values
+
+    async def __call__(self):
+        """Yields the latest recorded value at subscription time, then every later value on the replay clock."""
+        i = max(bisect.bisect_right(self.times, self.system.elapsed()) - 1, 0)
+        while i < len(self.times):
+            await asyncio.sleep(max(self.times[i] - self.system.elapsed(), 0))
+            yield self.values[i]
+            i += 1
+        await asyncio.Event().wait()
+
+
+async def _silent_stream():
+    await asyncio.Event().wait()
+    yield
+
+
+class _Plugin:
+    def __init__(self, system, name, streams=None):
+        self._system = system
+        self._name = name
+        self._streams = streams
+
+    def __getattr__(self, item):
+        if self._streams is not None:
+            if item.startswith('set_rate'):
+                async def set_rate(*args):
+                    pass
+                return set_rate
+            # streams missing from the recording never produce an item
+            return self._streams.get(item, _silent_stream)
+
+        async def call(*args):
+            self._system.calls.append((self._system.elapsed(), f"{self._name}.{item}", args))
+            logger.debug(f"{self._name}.{item}{args}")
+        return call
+
+
+class _Mission(_Plugin):
+    @staticmethod
+    async def mission_progress():
+        while True:
+            yield mission.MissionProgress(1, 1)
+            await asyncio.sleep(0.1)
+
+
+class _Connected:
+    is_connected = True
+
+
+class ReplaySystem:
+    """
+    Stand-in for mavsdk.System serving telemetry streams from a flight recording on the loop clock.
+    Action, mission and offboard calls are collected in `calls` instead of being sent to a vehicle.
+    """
+
+    def __init__(self, recording: FlightRecording):
+        self.recording = recording
+        self.start = None
+        self.calls = list()
+        columns = dict()
+
+        def add(name, t, value):
+            times, values = columns.setdefault(name, (list(), list()))
+            times.append(t)
+            values.append(value)
+
+        for record in recording.records(Kind.POSITION, Kind.VELOCITY, Kind.BATTERY, Kind.FLAG, Kind.HEALTH):
+            if record.kind == Kind.POSITION:
+                add('position', record.time, telemetry.Position(*record.value))
+            elif record.kind == Kind.VELOCITY:
+                add('velocity_ned', record.time, telemetry.VelocityNed(*record.value))
+            elif record.kind == Kind.BATTERY:
+                add('battery', record.time, telemetry.Battery(*record.value))
+            elif record.kind == Kind.HEALTH:
+                add('health_all_ok', record.time, record.value[0])
+            else:
+                flag, value = record.value
+                if FLAGS[flag] == 'landed':
+                    add('landed_state', record.time,
+                        telemetry.LandedState.ON_GROUND if value else telemetry.LandedState.IN_AIR)
+                else:
+                    add(FLAGS[flag], record.time, value)
+        columns.setdefault('health_all_ok', ([0.0], [True]))
+        columns.setdefault('armed', ([0.0], [False]))
+        columns.setdefault('in_air', ([0.0], [False]))
+        columns.setdefault('landed_state', ([0.0], [telemetry.LandedState.ON_GROUND]))
+        if 'position' in columns:
+            columns['home'] = ([0.0], columns['position'][1][:1])
+        streams = dict((name, _ReplayStream(self, *column)) for name, column in columns.items())
+
+        self.core = _Plugin(self, 'core', {'connection_state': self.connection_state})
+        self.telemetry = _Plugin(self, 'telemetry', streams)
+        self.action = _Plugin(self, 'action')
+        self.mission = _Mission(self, 'mission')
+        self.offboard = _Plugin(self, 'offboard')
+
+    def elapsed(self):
+        return asyncio.get_event_loop().time() - self.start
+
+    async def connect(self, system_address=None):
+        self.start = asyncio.get_event_loop().time()
+
+    @staticmethod
+    async def connection_state():
+        while True:
+            yield _Connected()
+
+
+class ReplayController(Controller):
+    """Feeds the transcripts of a flight recording back through the parser and flight state at their recorded time."""
+
+    def __init__(self, recording: FlightRecording, call_sign: str):
+        Voice.tts = SilentTTS()
+        Voice.tp_exec = InlineExecutor()
+        super().__init__(ReplaySystem(recording), call_sign, "replay://", False, journal=None)
+        self.startup_graph.executor = InlineExecutor()
+        self.recording = recording
+        # gaps in the recorded telemetry are reported, but the vehicle's reaction to a failsafe is not recorded
+        self.watchdog.reactions = dict()
+
+    async def monitor_atc(self):
+        logger.info("Replaying ATC")
+        for record in self.recording.records(Kind.TRANSCRIPT):
+            await asyncio.sleep(max(record.time - self.drone.elapsed(), 0))
+            logger.info(f"Transcript: '{record.value}'")
+            await self.handle_transmission(record.value)
+        await asyncio.Event().wait()
+
+    async def replay(self, margin=5.0):
+        loop = asyncio.get_event_loop()
+        started = time.monotonic()
+        task = asyncio.create_task(self.run())
+        await asyncio.sleep(self.recording.duration)
+        # the telemetry ends with the recording, that is not a lost link
+        self.watchdog.last.clear()
+        await asyncio.sleep(margin)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        logger.info(f"Replayed {self.recording.duration:.1f}s of flight in {time.monotonic() - started:.2f}s "
+                    f"wall time (clock at {loop.time():.1f}s)")
+        return ReplayResult(self.drone.calls, Voice.tts.responses)
+
+
+class ReplayResult:
+    __slots__ = ('calls', 'responses')
+
+    def __init__(self, calls, responses):
+        self.calls = calls
+        self.responses = responses
+
+    def format(self):
+        lines = [(t, f"{t:8.2f} {name}({json.dumps(list(args), default=encode)[1:-1]})") for t, name, args in self.calls]
+        lines += [(t, f"{t:8.2f} respond '{utterance}'") for t, utterance in self.responses]
+        return "\n".join(line for _, line in sorted(lines, key=lambda line: line[0]))
+
+
+def replay(path, speed=math.inf, call_sign="cityairbus1234"):
+    recording = FlightRecording(path)
+    loop = ScaledClockLoop(speed)
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(ReplayController(recording, call_sign).replay())
+    finally:
+        loop.close()
+        recording.close()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay a flight recording through the control stack")
+    parser.add_argument('recording', help="Path to a flight recording written with --record")
+    parser.add_argument('-x', '--speed', type=float, default=math.inf,
+                        help="Replay speed factor, 'inf' runs as fast as possible. Default: inf")
+    parser.add_argument('-c', '--call_sign', default="cityairbus1234",
+                        help="Set custom call sign")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="Set logging level to DEBUG")
+    ARGS = parser.parse_args()
+    config_logging.config_logging_stdout(logging.DEBUG if ARGS.verbose else logging.INFO)
+    print(replay(ARGS.recording, ARGS.speed, ARGS.call_sign).format())
@@ -0,0 +1,71 @@
+import logging
+import time
+
+from dronebot.parser import CommunicationError, Parser
+from dronebot.vocab import Vocabulary
+
+logger = logging.getLogger(__name__.upper())
+
+
+def candidates_of(metadata):
+    """(text, confidence) of every transcript of a DeepSpeech Metadata, best first."""
+    return [("".join(token.text for token in transcript.tokens), transcript.confidence)
+            for transcript in metadata.transcripts]
+
+
+class Rescorer:
+    """
+    Picks the ASR candidate the controller can act on. Candidates are tried in the decoder's order and the first one
+    that is addressed to `call_sign` and parses into at least one command wins, so a best string the parser would
+    reject costs a "say again" only if none of the others parses either. Counts how often that happened.
+    """
+
+    def __init__(self, call_sign, vocab: Vocabulary = None):
+        self.parser = Parser(call_sign, vocab)
+        self.transmissions = 0
+        self.rescued = 0
+        self.rejected = 0
+        self.seconds = 0.0
+
+    def warm_up(self):
+        """Loads the lazily built parts of the vocabulary, so the first transmission is rescored as fast as the rest."""
+        self.parser.vocab.POSITIONS
+        self.parser.vocab.ROUTES
+
+    def commands(self, text):
+        """Number of commands the parser finds in `text`, 0 if it is not for us or has no known command."""
+        parser = self.parser
+        parser.command_list.clear()
+        try:
+            parser.handle_id(text)
+            parser.handle_phrase_queue(text)
+        except (CommunicationError, RecursionError):
+            return 0
+        return len(parser.command_list)
+
+    def choose(self, candidates):
+        """Best parseable (text, confidence) of `candidates`, the decoder's best one if none parses."""
+        started = time.perf_counter()
+        self.transmissions += 1
+        chosen = None
+        tried = dict()
+        for rank, (text, confidence) in enumerate(candidates):
+            if text not in tried:
+                tried[text] = self.commands(text)
+            if tried[text]:
+                chosen = rank
+                break
+        self.seconds += time.perf_counter() - started
+        if chosen is None:
+            self.rejected += 1
+            return candidates[0] if candidates else ("", 0.0)
+        if chosen:
+            self.rescued += 1
+            logger.info(f"Rescored candidate {chosen + 1} of {len(candidates)}: '{candidates[chosen][0]}' "
+                        f"instead of '{candidates[0][0]}'")
+        return candidates[chosen]
+
+    def report(self):
+        return (f"rescoring avoided {self.rescued} say again of {self.transmissions} transmissions, "
+                f"{self.rejected} had no parseable candidate, "
+                f"{self.seconds / max(self.transmissions, 1) * 1000:.1f}ms per transmission")
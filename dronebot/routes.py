@@ -0,0 +1,157 @@
+import heapq
+import logging
+import math
+
+import numpy as np
+from mavsdk import mission
+
+from dronebot.fixes import FixIndex
+from dronebot.geofence import Geofence
+from dronebot.missions import mission_item, with_altitude
+
+logger = logging.getLogger(__name__.upper())
+
+
+class Route:
+    __slots__ = ('destination', 'fixes')
+
+    def __init__(self, destination, fixes):
+        self.destination = destination
+        self.fixes = tuple(fixes)
+
+    @property
+    def last_fix(self):
+        return self.fixes[-1]
+
+    def __repr__(self):
+        return f"Route({self.destination}: {' - '.join(self.fixes)})"
+
+
+class RouteGraph:
+    """
+    Waypoint graph over the fixes in vocab.yaml. Two fixes are connected if the straight leg between them stays
+    inside the geofence at cruise altitude, so every shortest path is geofence-respecting. Building the graph only
+    plans the filed routes, so tools that merely load the vocabulary stay fast. The legs of a fix are checked the
+    first time a path leaves it and the shortest paths from an origin are found once with Dijkstra and kept;
+    `search` does this for every fix, which the controller runs while the vehicle connects, so re-routing at
+    command time is a lookup. Mission plans are cached per fix sequence and altitude.
+    """
+
+    def __init__(self, positions, routes, geofence=None, cruise_altitude=5.0, step=1.0, fixes: FixIndex = None):
+        self.positions = positions
+        self.routes = dict((name, Route(name, fixes)) for name, fixes in (routes or dict()).items())
+        self.names = list(positions)
+        self.index = dict((name, i) for i, name in enumerate(self.names))
+        self.fixes = fixes or FixIndex(positions)
+        self.frame = self.fixes.frame
+        lat, lon = np.array([(p.latitude_deg, p.longitude_deg) for p in positions.values()]).T
+        self.points = self.frame.forward(lat, lon)
+        self.points[:, 2] = cruise_altitude
+        self.fence = Geofence(geofence)
+        self.fence.compile(self.frame)
+        self.step = step
+        self.inside = [i for i, volume in enumerate(self.fence.violations(self.points)) if volume is None]
+        self.legs = dict()
+        self.trees = dict()
+        self.plans = dict()
+        self.cruise_altitude = cruise_altitude
+        for route in self.routes.values():
+            missing = [fix for fix in route.fixes if fix not in self.index]
+            if missing:
+                raise KeyError(f"{route} uses unknown fixes {missing}")
+        self.precompute()
+        logger.debug(f"Compiled {len(self.names)} fixes and {len(self.routes)} routes, "
+                     f"{len(self.trees)} origins searched")
+
+    def neighbours(self, i):
+        """Lengths of the legs from fix `i` that stay inside the geofence, checked on first use."""
+        if i not in self.legs:
+            legs = dict()
+            if i in self.inside:
+                for j in self.inside:
+                    if j == i:
+                        continue
+                    if j in self.legs:
+                        if i in self.legs[j]:
+                            legs[j] = self.legs[j][i]
+                        continue
+                    length = float(np.hypot(*(self.points[j, :2] - self.points[i, :2])))
+                    t = np.linspace(0, 1, int(np.ceil(length / self.step)) + 1)[:, None]
+                    leg = self.points[i] + t * (self.points[j] - self.points[i])
+                    if not any(self.fence.violations(leg)):
+                        legs[j] = length
+            self.legs[i] = legs
+        return self.legs[i]
+
+    def tree(self, origin):
+        """Shortest path tree from `origin` (Dijkstra) as the previous fix of every reachable fix, cached."""
+        if origin not in self.trees:
+            start = self.index[origin]
+            distance = {start: 0.0}
+            previous = {start: None}
+            done = set()
+            heap = [(0.0, start)]
+            while heap:
+                d, i = heapq.heappop(heap)
+                if i in done:
+                    continue
+                done.add(i)
+                for j, length in self.neighbours(i).items():
+                    if d + length < distance.get(j, math.inf):
+                        distance[j] = d + length
+                        previous[j] = i
+                        heapq.heappush(heap, (d + length, j))
+            self.trees[origin] = previous
+        return self.trees[origin]
+
+    def search(self):
+        """Searches the shortest paths from every fix, all pairs of fixes are a lookup afterwards."""
+        for origin in self.names:
+            self.tree(origin)
+        logger.debug(f"Searched the shortest paths from {len(self.trees)} fixes")
+        return self
+
+    def path(self, origin, destination):
+        """Fixes of the shortest geofence-respecting path, both ends included, None if there is none."""
+        if origin not in self.index or destination not in self.index:
+            return None
+        previous = self.tree(origin)
+        path = [self.index[destination]]
+        if path[0] not in previous:
+            return None
+        while previous[path[-1]] is not None:
+            path.append(previous[path[-1]])
+        return tuple(self.names[i] for i in reversed(path))
+
+    def nearest(self, latitude_deg, longitude_deg):
+        return self.fixes.nearest(latitude_deg, longitude_deg)[0]
+
+    def reroute(self, route, fix):
+        """Fixes to fly when cleared direct `fix` on `route`: the route tail if on it, else the shortest way on."""
+        if fix in route.fixes:
+            return route.fixes[route.fixes.index(fix):]
+        return self.path(fix, route.last_fix)
+
+    def plan(self, fixes, altitude=None):
+        """MissionPlan flying through `fixes` in order, cached per fix sequence and altitude."""
+        fixes = tuple(fixes)
+        altitude = self.cruise_altitude if altitude is None else round(altitude, 2)
+        key = (fixes, altitude)
+        if key not in self.plans:
+            items = [mission_item(self.positions[fixes[0]].latitude_deg, self.positions[fixes[0]].longitude_deg,
+                                  self.cruise_altitude)]
+            for origin, destination in zip(fixes, fixes[1:]):
+                path = self.path(origin, destination)
+                if path is None:
+                    raise KeyError(f"No geofence-respecting path from {origin} to {destination}")
+                items.extend(mission_item(self.positions[fix].latitude_deg, self.positions[fix].longitude_deg,
+                                          self.cruise_altitude) for fix in path[1:])
+            if altitude != self.cruise_altitude:
+                items = with_altitude(items, altitude)
+            self.plans[key] = mission.MissionPlan(items)
+        return self.plans[key]
+
+    def precompute(self, altitude=None):
+        """Builds the plan of every filed route, so following it after takeoff is a cache hit."""
+        for route in self.routes.values():
+            self.plan(route.fixes, altitude)
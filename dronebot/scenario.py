@@ -0,0 +1,309 @@
+import asyncio
+import logging
+import math
+import re
+import time
+from pathlib import Path
+
+import yaml
+
+from dronebot import config_logging, tracing
+from dronebot.controller import Controller
+from dronebot.offboard import OffboardGuidance
+from dronebot.replay import InlineExecutor, ScaledClockLoop, SilentTTS
+from dronebot.sim import SimSystem
+from dronebot.voice import Voice
+
+logger = logging.getLogger(__name__.upper())
+
+
+class ScenarioError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return f"{type(self).__name__}: {self.message}"
+
+
+class Scenario:
+    """
+    Scripted transmissions and the expected outcome of the flight.
+    A text file holds one transmission per line, spaced `interval` seconds apart, and expects nothing. A YAML file
+    has `transmissions`, plain strings at the default spacing or {at: seconds, say: text}, and `expect` with any of
+    state, armed, landed, near: {fix, within}, responses (substrings that must be read back in this order),
+    read_back_once (substrings read back exactly once), scheduled (number of commands deferred by a condition),
+    failsafes (kinds the watchdog declared, in order), reactions ({substring of a transmission: seconds}, the
+    longest time from the transmission until the vehicle changes its commanded velocity), calls (mavsdk requests
+    that must be made in this order), spans (latency spans, e.g. acked>response, measured by finished traces) and
+    max_errors. Readbacks are compared case and spacing insensitive. `faults` are injected into the simulator,
+    {at: seconds, telemetry_loss: seconds}, {at: seconds, unhealthy: seconds} or {at: seconds, setpoints_rejected:
+    seconds}. `offboard` flies heading and altitude changes through offboard guidance, `latency` is the simulated
+    time of one MAVLink round trip.
+    """
+
+    def __init__(self, name, transmissions, expect=None, call_sign="cityairbus1234", settle=600.0, faults=None,
+                 offboard=False, latency=0.0):
+        self.name = name
+        self.transmissions = transmissions
+        self.faults = faults or list()
+        self.offboard = offboard
+        self.latency = latency
+        self.expect = expect or dict()
+        self.call_sign = call_sign
+        self.settle = settle
+
+    @classmethod
+    def load(cls, path, interval=20.0):
+        path = Path(path)
+        if path.suffix in ('.yaml', '.yml'):
+            with open(path) as file:
+                spec = yaml.safe_load(file)
+            interval = spec.get('interval', interval)
+            lines = spec.get('transmissions', [])
+            kwargs = dict((key, spec[key]) for key in ('expect', 'call_sign', 'settle', 'faults', 'offboard', 'latency')
+                          if key in spec)
+        else:
+            lines = path.read_text().splitlines()
+            kwargs = dict()
+        transmissions = list()
+        at = 0.0
+        for line in lines:
+            if isinstance(line, dict):
+                at = float(line.get('at', at))
+                line = line.get('say', '')
+            if line.strip():
+                transmissions.append((at, line.strip()))
+                at += interval
+        if not transmissions:
+            raise ScenarioError(f"{path} has no transmissions")
+        return cls(path.stem, transmissions, **kwargs)
+
+
+def normalized(text):
+    """Lower case with single spaces and none before a comma, text2num versions space numbers differently."""
+    return re.sub(r" ,", ",", " ".join(text.lower().split()))
+
+
+class ScenarioResult:
+    __slots__ = ('scenario', 'state', 'armed', 'in_air', 'position', 'nearest', 'distance', 'responses', 'errors',
+                 'calls', 'flown', 'max_altitude', 'scheduled', 'failsafes', 'reactions', 'spans', 'sim_time',
+                 'wall_time')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def failures(self):
+        expect = self.scenario.expect
+        failed = list()
+        if 'state' in expect and self.state != expect['state']:
+            failed.append(f"state is {self.state}, expected {expect['state']}")
+        if 'armed' in expect and self.armed != expect['armed']:
+            failed.append(f"armed is {self.armed}, expected {expect['armed']}")
+        if 'landed' in expect and self.in_air == expect['landed']:
+            failed.append(f"{'in air' if self.in_air else 'landed'}, expected {'landed' if expect['landed'] else 'in air'}")
+        if 'near' in expect:
+            fix, within = expect['near']['fix'], expect['near'].get('within', 2.0)
+            distance = self.distance.get(fix)
+            if distance is None:
+                failed.append(f"unknown fix {fix}")
+            elif distance > within:
+                failed.append(f"{distance:.1f}m from {fix}, expected within {within}m")
+        remaining = iter(normalized(utterance) for _, utterance in self.responses)
+        for expected in expect.get('responses', []):
+            if not any(normalized(expected) in utterance for utterance in remaining):
+                failed.append(f"no readback containing '{expected}' in order")
+                break
+        remaining = iter(name for _, name, _ in self.calls)
+        for expected in expect.get('calls', []):
+            if expected not in remaining:
+                failed.append(f"no {expected} call in order")
+                break
+        for expected in expect.get('read_back_once', []):
+            count = sum(normalized(utterance).count(normalized(expected)) for _, utterance in self.responses)
+            if count != 1:
+                failed.append(f"'{expected}' read back {count} times, expected once")
+        if 'scheduled' in expect and self.scheduled != expect['scheduled']:
+            failed.append(f"{self.scheduled} conditional commands scheduled, expected {expect['scheduled']}")
+        if 'failsafes' in expect and [event.kind for event in self.failsafes] != expect['failsafes']:
+            failed.append(f"failsafes {[event.kind for event in self.failsafes]}, expected {expect['failsafes']}")
+        for expected, within in expect.get('reactions', dict()).items():
+            measured = [seconds for transmission, seconds in self.reactions if expected.lower() in transmission]
+            if not measured:
+                failed.append(f"no transmission containing '{expected}'")
+            elif None in measured:
+                failed.append(f"no reaction to '{expected}'")
+            elif max(measured) > within:
+                failed.append(f"reaction to '{expected}' took {max(measured):.2f}s, expected within {within}s")
+        missing = [span for span in expect.get('spans', []) if span not in self.spans]
+        if missing:
+            failed.append(f"no finished trace measured {', '.join(missing)}")
+        if len(self.errors) > expect.get('max_errors', math.inf):
+            failed.append(f"{len(self.errors)} errors logged, expected at most {expect['max_errors']}")
+        return failed
+
+    def format(self):
+        lines = [f"{self.scenario.name}: {self.sim_time:.0f}s of flight in {self.wall_time:.2f}s wall time",
+                 f"  state {self.state}, {'armed' if self.armed else 'disarmed'}, "
+                 f"{'in air' if self.in_air else 'on ground'} {self.nearest[1]:.1f}m from {self.nearest[0]} "
+                 f"at {self.position[3]:.1f}m",
+                 f"  flown {self.flown:.0f}m, max altitude {self.max_altitude:.1f}m, {len(self.calls)} mavsdk calls, "
+                 f"{len(self.responses)} readbacks, {len(self.errors)} errors"]
+        lines += [f"  reacted to '{transmission}' in {seconds:.2f}s" for transmission, seconds in self.reactions
+                  if seconds is not None]
+        lines += [f"  failsafe: {event}" for event in self.failsafes]
+        lines += [f"  error: {message}" for message in self.errors]
+        lines += [f"  FAILED: {failure}" for failure in self.failures()]
+        return "\n".join(lines)
+
+
+class _ErrorLog(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.messages = list()
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class ScenarioController(Controller):
+    """Flies a scenario against a simulated vehicle, feeding its transmissions at their scripted time."""
+
+    def __init__(self, scenario: Scenario, system: SimSystem = None):
+        Voice.tts = SilentTTS()
+        Voice.tp_exec = InlineExecutor()
+        super().__init__(system or SimSystem(), scenario.call_sign, "sim://", False, journal=None)
+        self.startup_graph.executor = InlineExecutor()
+        self.scenario = scenario
+        self.sim = self.drone
+        self.script_done = asyncio.Event()
+        self.reactions = list()
+        OffboardGuidance.of(self.drone, self.telemetry).enabled = scenario.offboard
+
+    async def monitor_atc(self):
+        logger.info(f"Flying scenario {self.scenario.name}")
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        for fault in self.scenario.faults:
+            if 'telemetry_loss' in fault:
+                loop.call_at(started + fault['at'], self.sim.lose_telemetry, fault['telemetry_loss'])
+            if 'unhealthy' in fault:
+                loop.call_at(started + fault['at'], self.sim.degrade_health, fault['unhealthy'])
+            if 'setpoints_rejected' in fault:
+                loop.call_at(started + fault['at'], self.sim.reject_setpoints, fault['setpoints_rejected'])
+        for at, transmission in self.scenario.transmissions:
+            await asyncio.sleep(max(started + at - loop.time(), 0))
+            logger.info(f"Transcript: '{transmission}'")
+            asyncio.ensure_future(self.reaction(transmission, self.sim.vehicle.wanted, loop.time()))
+            try:
+                await self.handle_transmission(transmission)
+            except Exception:
+                # counted as an error of the scenario, the rest of the script is still flown
+                logger.exception(f"Failed to handle '{transmission}'")
+        # the script is done once its last fault was injected
+        last_fault = max((fault['at'] for fault in self.scenario.faults), default=0.0)
+        await asyncio.sleep(max(started + last_fault - loop.time(), 0))
+        self.script_done.set()
+        await asyncio.Event().wait()
+
+    async def reaction(self, transmission, wanted, started, timeout=10.0):
+        """Measures the time until the vehicle changes its commanded velocity after `transmission`, if it does."""
+        loop = asyncio.get_event_loop()
+        entry = [transmission, None]
+        self.reactions.append(entry)
+        while loop.time() - started < timeout:
+            if max(abs(now - before) for now, before in zip(self.sim.vehicle.wanted, wanted)) > 0.1:
+                entry[1] = loop.time() - started
+                return
+            await asyncio.sleep(1 / self.sim.rate)
+
+    async def settled(self, quiet=5.0):
+        """Returns once the vehicle was idle for `quiet` seconds, or after the scenario's settle time."""
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + self.scenario.settle
+        idle_since = None
+        while loop.time() < deadline:
+            if self.sim.vehicle.idle() and all(record.done for record in self.executor.records):
+                idle_since = loop.time() if idle_since is None else idle_since
+                if loop.time() - idle_since >= quiet:
+                    return
+            else:
+                idle_since = None
+            await asyncio.sleep(1)
+        logger.warning(f"{self.scenario.name} did not settle within {self.scenario.settle:.0f}s")
+
+    async def fly(self):
+        loop = asyncio.get_event_loop()
+        errors = _ErrorLog()
+        logging.getLogger().addHandler(errors)
+        # a fresh tracer per flight, its histograms hold the spans of this scenario's finished traces
+        tracer = tracing.configure(None)
+        started = time.monotonic()
+        task = asyncio.create_task(self.run())
+        try:
+            await self.script_done.wait()
+            await self.settled()
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            self.sim.close()
+            logging.getLogger().removeHandler(errors)
+        position = self.sim.gps_position()
+        distance = dict((fix, float(self.sim.frame.distance(position.latitude_deg, position.longitude_deg,
+                                                             fix_position.latitude_deg, fix_position.longitude_deg)))
+                        for fix, fix_position in self.flight_state.vocab.POSITIONS.items())
+        vehicle = self.sim.vehicle
+        return ScenarioResult(
+            scenario=self.scenario, state=self.flight_state.state, armed=vehicle.armed, in_air=vehicle.in_air,
+            position=(position.latitude_deg, position.longitude_deg, position.absolute_altitude_m,
+                      position.relative_altitude_m),
+            nearest=min(distance.items(), key=lambda item: item[1]), distance=distance,
+            responses=list(Voice.tts.responses), errors=errors.messages, calls=list(self.sim.calls),
+            flown=vehicle.distance, max_altitude=vehicle.max_altitude, scheduled=self.flight_state.next_key,
+            failsafes=list(self.watchdog.events), reactions=[tuple(entry) for entry in self.reactions],
+            spans=set(tracer.summary()), sim_time=loop.time(), wall_time=time.monotonic() - started)
+
+
+def fly(scenario, speed=math.inf, **kinematics):
+    loop = ScaledClockLoop(speed)
+    asyncio.set_event_loop(loop)
+    system = SimSystem(latency=scenario.latency, **kinematics)
+    try:
+        return loop.run_until_complete(ScenarioController(scenario, system).fly())
+    finally:
+        loop.close()
+
+
+def main(args):
+    failed = 0
+    for path in args.scenarios:
+        scenario = Scenario.load(path, args.interval)
+        walls = list()
+        for _ in range(args.repeat):
+            result = fly(scenario, args.speed)
+            walls.append(result.wall_time)
+            failed += bool(result.failures())
+        print(result.format())
+        if args.repeat > 1:
+            print(f"  {args.repeat} runs, wall time mean {sum(walls) / len(walls):.2f}s, max {max(walls):.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Fly scripted ATC scenarios against a simulated vehicle")
+    parser.add_argument('scenarios', nargs='+', metavar='PATH',
+                        help="Transcript (one transmission per line) or YAML scenario with expectations")
+    parser.add_argument('-x', '--speed', type=float, default=math.inf,
+                        help="Simulation speed factor, 'inf' (default) runs as fast as possible")
+    parser.add_argument('-i', '--interval', type=float, default=20.0,
+                        help="Seconds between transmissions without a scripted time. Default: 20")
+    parser.add_argument('-n', '--repeat', type=int, default=1,
+                        help="Fly every scenario this many times, e.g. to benchmark the control stack")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="Set logging level to DEBUG")
+    ARGS = parser.parse_args()
+    config_logging.config_logging_stdout(logging.DEBUG if ARGS.verbose else logging.WARNING)
+    sys.exit(main(ARGS))
@@ -0,0 +1,405 @@
+import asyncio
+import logging
+import math
+
+from mavsdk import action, core, mission, offboard, telemetry
+
+from dronebot.geodesy import LocalFrame
+
+logger = logging.getLogger(__name__.upper())
+
+# PX4_HOME of test/run_jmavsim.sh
+HOME = (48.688583, 11.525510, 367.0)
+
+
+class Kinematics:
+    """
+    Point mass multicopter in the east/north/up frame of its home position.
+    The flight mode chooses a commanded velocity, the actual velocity follows it within the acceleration limit and
+    the position integrates the velocity. Modes follow PX4 closely enough for the control stack: takeoff climbs to
+    the takeoff altitude and holds, a mission flies its items in order and loiters at each, land descends until
+    touchdown, RTL climbs to the return altitude, flies home and lands, offboard flies the streamed setpoint.
+    """
+
+    def __init__(self, cruise_speed=5.0, climb_rate=2.0, descent_rate=1.0, acceleration=4.0,
+                 acceptance_radius=1.0, drain_per_s=0.05):
+        self.cruise_speed = cruise_speed
+        self.climb_rate = climb_rate
+        self.descent_rate = descent_rate
+        self.acceleration = acceleration
+        self.acceptance_radius = acceptance_radius
+        self.drain_per_s = drain_per_s
+
+        self.position = [0.0, 0.0, 0.0]
+        self.velocity = [0.0, 0.0, 0.0]
+        self.armed = False
+        self.in_air = False
+        self.mode = 'ready'
+        self.target = None
+        self.items = list()
+        self.current = 0
+        self.loiter = None
+        self.setpoint = None
+        self.takeoff_altitude = 2.5
+        self.rtl_altitude = 30.0
+        self.battery = 100.0
+        self.distance = 0.0
+        self.max_altitude = 0.0
+        self.wanted = (0.0, 0.0, 0.0)
+
+    @property
+    def speed(self):
+        return math.sqrt(sum(v * v for v in self.velocity))
+
+    @property
+    def mission_finished(self):
+        return bool(self.items) and self.current >= len(self.items)
+
+    def idle(self):
+        """True when nothing is left to fly: on the ground, holding, at the end of the mission or at the setpoint."""
+        if self.speed > 0.05:
+            return False
+        return (not self.in_air or self.mode in ('hold', 'offboard')
+                or (self.mode == 'mission' and self.mission_finished))
+
+    def hold(self):
+        self.mode = 'hold'
+        self.target = tuple(self.position)
+
+    def commanded(self):
+        """Velocity the current flight mode asks for, (east, north, up) in m/s."""
+        if not self.armed:
+            return 0.0, 0.0, 0.0
+        east, north, up = self.position
+        if self.mode == 'offboard' and self.setpoint is not None:
+            return self.setpoint
+        if self.mode == 'takeoff':
+            if up >= self.takeoff_altitude - 0.1:
+                self.hold()
+            return self.towards((east, north, self.takeoff_altitude), self.cruise_speed)
+        if self.mode == 'land':
+            return 0.0, 0.0, -self.descent_rate if self.in_air else 0.0
+        if self.mode == 'rtl':
+            altitude = max(up, self.rtl_altitude) if math.hypot(east, north) > self.acceptance_radius else up
+            if math.hypot(east, north) <= self.acceptance_radius:
+                self.mode = 'land'
+            return self.towards((0.0, 0.0, altitude), self.cruise_speed)
+        if self.mode == 'mission' and not self.mission_finished:
+            *target, speed, loiter_s = self.items[self.current]
+            if self.reached(target):
+                if self.loiter is None:
+                    self.loiter = loiter_s
+                elif self.loiter <= 0:
+                    self.current += 1
+                    self.loiter = None
+            return self.towards(target, speed)
+        if self.mode == 'mission' and self.items:
+            return self.towards(self.items[-1][:3], self.cruise_speed)
+        if self.target is not None:
+            return self.towards(self.target, self.cruise_speed)
+        return 0.0, 0.0, 0.0
+
+    def reached(self, target):
+        east, north, up = self.position
+        return math.hypot(target[0] - east, target[1] - north) <= self.acceptance_radius and abs(target[2] - up) <= 0.5
+
+    def towards(self, target, speed, gain=1.0):
+        d_east, d_north, d_up = (t - p for t, p in zip(target, self.position))
+        distance = math.hypot(d_east, d_north)
+        horizontal = min(speed, gain * distance)
+        scale = horizontal / distance if distance > 1e-6 else 0.0
+        climb = max(-self.descent_rate, min(self.climb_rate, gain * d_up))
+        return d_east * scale, d_north * scale, climb
+
+    def step(self, dt):
+        wanted = self.wanted = self.commanded()
+        change = [w - v for w, v in zip(wanted, self.velocity)]
+        size = math.sqrt(sum(c * c for c in change))
+        limit = self.acceleration * dt
+        if size > limit:
+            change = [c * limit / size for c in change]
+        self.velocity = [v + c for v, c in zip(self.velocity, change)]
+        moved = [v * dt for v in self.velocity]
+        self.position = [p + m for p, m in zip(self.position, moved)]
+        self.distance += math.hypot(moved[0], moved[1])
+        if self.position[2] <= 0.0:
+            self.position[2] = 0.0
+            self.velocity = [0.0, 0.0, 0.0]
+            if self.in_air:
+                logger.debug("Touchdown")
+            self.in_air = False
+        elif self.position[2] > 0.1:
+            self.in_air = True
+        self.max_altitude = max(self.max_altitude, self.position[2])
+        if self.loiter is not None:
+            self.loiter -= dt
+        if self.armed:
+            self.battery = max(0.0, self.battery - self.drain_per_s * dt)
+
+
+def _denied(error, result_type, origin, result='COMMAND_DENIED', message="denied by simulator"):
+    return error(result_type(getattr(result_type.Result, result), message), origin)
+
+
+class _SimPlugin:
+    def __init__(self, system):
+        self._system = system
+
+    @property
+    def _vehicle(self):
+        return self._system.vehicle
+
+    async def _call(self, name, *args, trips=1):
+        """Records a request, answered after `trips` round trips of the simulated link."""
+        self._system.calls.append((asyncio.get_event_loop().time(), name, args))
+        logger.debug(f"{name}{args}")
+        if self._system.latency:
+            await asyncio.sleep(trips * self._system.latency)
+
+
+class _SimCore(_SimPlugin):
+    @staticmethod
+    async def connection_state():
+        while True:
+            yield core.ConnectionState("sim", True)
+            await asyncio.sleep(1)
+
+
+class _SimAction(_SimPlugin):
+    async def arm(self):
+        await self._call('action.arm')
+        self._vehicle.armed = True
+
+    async def disarm(self):
+        await self._call('action.disarm')
+        if self._vehicle.in_air:
+            raise _denied(action.ActionError, action.ActionResult, 'disarm()', 'COMMAND_DENIED_NOT_LANDED',
+                          "vehicle in air")
+        self._vehicle.armed = False
+        self._vehicle.mode = 'ready'
+
+    async def takeoff(self):
+        await self._call('action.takeoff')
+        if not self._vehicle.armed:
+            raise _denied(action.ActionError, action.ActionResult, 'takeoff()', message="vehicle not armed")
+        self._vehicle.mode = 'takeoff'
+
+    async def land(self):
+        await self._call('action.land')
+        self._vehicle.mode = 'land'
+
+    async def return_to_launch(self):
+        await self._call('action.return_to_launch')
+        self._vehicle.mode = 'rtl'
+
+    async def hold(self):
+        await self._call('action.hold')
+        self._vehicle.hold()
+
+    async def set_takeoff_altitude(self, altitude):
+        await self._call('action.set_takeoff_altitude', altitude)
+        self._vehicle.takeoff_altitude = altitude
+
+    async def set_return_to_launch_altitude(self, altitude):
+        await self._call('action.set_return_to_launch_altitude', altitude)
+        self._vehicle.rtl_altitude = altitude
+
+
+class _SimMission(_SimPlugin):
+    async def clear_mission(self):
+        await self._call('mission.clear_mission')
+        if self._vehicle.mode == 'mission':
+            # PX4 loiters until a new mission is started
+            self._vehicle.hold()
+        self._vehicle.items = list()
+        self._vehicle.current = 0
+
+    async def upload_mission(self, mission_plan):
+        # the count, a request and an item per mission item and the ack
+        await self._call('mission.upload_mission', len(mission_plan.mission_items),
+                         trips=1 + len(mission_plan.mission_items))
+        frame = self._system.frame
+        items = list()
+        for item in mission_plan.mission_items:
+            east, north = frame.east_north(item.latitude_deg, item.longitude_deg)
+            speed = item.speed_m_s if item.speed_m_s > 0 else self._vehicle.cruise_speed
+            loiter = item.loiter_time_s if item.loiter_time_s == item.loiter_time_s else 0.0
+            items.append((east, north, item.relative_altitude_m, speed, loiter))
+        self._vehicle.items = items
+        self._vehicle.current = 0
+        self._vehicle.loiter = None
+
+    async def start_mission(self):
+        await self._call('mission.start_mission')
+        if not self._vehicle.items:
+            raise _denied(mission.MissionError, mission.MissionResult, 'start_mission()', 'NO_MISSION_AVAILABLE',
+                          "no mission uploaded")
+        self._vehicle.mode = 'mission'
+
+    async def pause_mission(self):
+        await self._call('mission.pause_mission')
+        self._vehicle.hold()
+
+    async def set_current_mission_item(self, index):
+        await self._call('mission.set_current_mission_item', index)
+        if not 0 <= index < len(self._vehicle.items):
+            raise _denied(mission.MissionError, mission.MissionResult, 'set_current_mission_item()',
+                          'INVALID_ARGUMENT', f"no mission item {index}")
+        self._vehicle.current = index
+        self._vehicle.loiter = None
+
+    async def is_mission_finished(self):
+        return self._vehicle.mission_finished
+
+    async def mission_progress(self):
+        while True:
+            yield mission.MissionProgress(self._vehicle.current, len(self._vehicle.items))
+            await asyncio.sleep(1)
+
+
+class _SimOffboard(_SimPlugin):
+    async def set_velocity_ned(self, velocity_ned_yaw):
+        if asyncio.get_event_loop().time() < self._system.setpoints_rejected_until:
+            raise _denied(offboard.OffboardError, offboard.OffboardResult, 'set_velocity_ned()')
+        self._vehicle.setpoint = (velocity_ned_yaw.east_m_s, velocity_ned_yaw.north_m_s, -velocity_ned_yaw.down_m_s)
+
+    async def start(self):
+        await self._call('offboard.start')
+        if self._vehicle.setpoint is None:
+            raise _denied(offboard.OffboardError, offboard.OffboardResult, 'start()', 'NO_SETPOINT_SET',
+                          "no setpoint set")
+        self._vehicle.mode = 'offboard'
+
+    async def stop(self):
+        await self._call('offboard.stop')
+        self._vehicle.setpoint = None
+        self._vehicle.hold()
+
+    async def is_active(self):
+        return self._vehicle.mode == 'offboard'
+
+
+FLIGHT_MODES = {
+    'ready': telemetry.FlightMode.READY, 'takeoff': telemetry.FlightMode.TAKEOFF, 'hold': telemetry.FlightMode.HOLD,
+    'mission': telemetry.FlightMode.MISSION, 'land': telemetry.FlightMode.LAND,
+    'rtl': telemetry.FlightMode.RETURN_TO_LAUNCH, 'offboard': telemetry.FlightMode.OFFBOARD,
+}
+
+
+class _SimTelemetry(_SimPlugin):
+    def __init__(self, system):
+        super().__init__(system)
+        self.rates = dict(position=10.0, velocity_ned=10.0, battery=1.0)
+
+    def __getattr__(self, item):
+        if item.startswith('set_rate_'):
+            async def set_rate(rate):
+                self.rates[item[len('set_rate_'):]] = rate
+            return set_rate
+        raise AttributeError(item)
+
+    async def _stream(self, value, rate):
+        loop = asyncio.get_event_loop()
+        while True:
+            if loop.time() >= self._system.telemetry_lost_until:
+                yield value()
+            await asyncio.sleep(1 / rate)
+
+    def position(self):
+        return self._stream(self._system.gps_position, self.rates['position'])
+
+    def velocity_ned(self):
+        vehicle = self._vehicle
+        return self._stream(lambda: telemetry.VelocityNed(vehicle.velocity[1], vehicle.velocity[0],
+                                                          -vehicle.velocity[2]), self.rates['velocity_ned'])
+
+    def battery(self):
+        return self._stream(lambda: telemetry.Battery(12.6 - 2.1 * (1 - self._vehicle.battery / 100),
+                                                      self._vehicle.battery / 100), self.rates['battery'])
+
+    def armed(self):
+        return self._stream(lambda: self._vehicle.armed, 5.0)
+
+    def in_air(self):
+        return self._stream(lambda: self._vehicle.in_air, 5.0)
+
+    def landed_state(self):
+        return self._stream(lambda: telemetry.LandedState.IN_AIR if self._vehicle.in_air
+                            else telemetry.LandedState.ON_GROUND, 5.0)
+
+    def flight_mode(self):
+        return self._stream(lambda: FLIGHT_MODES[self._vehicle.mode], 5.0)
+
+    def health_all_ok(self):
+        loop = asyncio.get_event_loop()
+        return self._stream(lambda: loop.time() >= self._system.unhealthy_until, 1.0)
+
+    def health(self):
+        return self._stream(lambda: telemetry.Health(*[True] * 7), 1.0)
+
+    def home(self):
+        return self._stream(lambda: telemetry.Position(*self._system.home, 0.0), 1.0)
+
+    def gps_info(self):
+        return self._stream(lambda: telemetry.GpsInfo(12, telemetry.FixType.FIX_3D), 1.0)
+
+
+class SimSystem:
+    """
+    In-process stand-in for the parts of mavsdk.System dronebot uses, flying a Kinematics model on the event loop
+    clock. Run it on a ScaledClockLoop for faster than real time flights. Requests are collected in `calls` like
+    in a replay. `lose_telemetry`, `degrade_health` and `reject_setpoints` inject faults. Every request waits
+    `latency` seconds per MAVLink round trip it takes; setpoints are not acknowledged and take none.
+    """
+
+    def __init__(self, home=HOME, rate=20.0, latency=0.0, **kinematics):
+        self.home = home
+        self.frame = LocalFrame(*home)
+        self.rate = rate
+        self.latency = latency
+        self.vehicle = Kinematics(**kinematics)
+        self.calls = list()
+        self.telemetry_lost_until = -math.inf
+        self.unhealthy_until = -math.inf
+        self.setpoints_rejected_until = -math.inf
+        self.task = None
+        self.core = _SimCore(self)
+        self.action = _SimAction(self)
+        self.mission = _SimMission(self)
+        self.offboard = _SimOffboard(self)
+        self.telemetry = _SimTelemetry(self)
+
+    async def connect(self, system_address=None):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        last = loop.time()
+        while True:
+            await asyncio.sleep(1 / self.rate)
+            now = loop.time()
+            self.vehicle.step(now - last)
+            last = now
+
+    def lose_telemetry(self, seconds):
+        """No telemetry stream updates for `seconds`, as on a lost link; the vehicle flies on."""
+        self.telemetry_lost_until = asyncio.get_event_loop().time() + seconds
+        logger.debug(f"Telemetry lost for {seconds}s")
+
+    def degrade_health(self, seconds):
+        self.unhealthy_until = asyncio.get_event_loop().time() + seconds
+        logger.debug(f"Health not ok for {seconds}s")
+
+    def reject_setpoints(self, seconds):
+        self.setpoints_rejected_until = asyncio.get_event_loop().time() + seconds
+        logger.debug(f"Offboard setpoints rejected for {seconds}s")
+
+    def gps_position(self):
+        east, north, up = self.vehicle.position
+        latitude, longitude, altitude = self.frame.inverse([east, north, up])
+        return telemetry.Position(float(latitude), float(longitude), float(altitude), up)
+
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__.upper())
+
+
+class StartupError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return f"{type(self).__name__}: {self.message}"
+
+
+class StartupGraph:
+    """
+    Runs startup steps as a dependency graph: every step starts as soon as the steps it needs are done, so
+    independent steps (mavsdk connection, TTS engine, ...) run at the same time. Plain functions run in `executor`,
+    the loop's default one if None. The time of every step is kept for the time-to-ready breakdown.
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor
+        self.steps = dict()
+        self.timings = dict()
+        self.started = None
+
+    def add(self, name, step, after=()):
+        for dependency in after:
+            if dependency not in self.steps:
+                raise StartupError(f"{name} depends on unknown step {dependency}")
+        self.steps[name] = (step, tuple(after))
+
+    def record(self, name, seconds):
+        """Adds a step that already ran before the graph, e.g. loading the vocabulary in the constructor."""
+        self.timings[name] = (-seconds, 0.0)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self.started = loop.time()
+        tasks = dict()
+
+        async def run_step(name, step, after):
+            await asyncio.gather(*(tasks[dependency] for dependency in after))
+            begin = loop.time()
+            if asyncio.iscoroutinefunction(step):
+                result = await step()
+            else:
+                result = await loop.run_in_executor(self.executor, step)
+            self.timings[name] = (begin - self.started, loop.time() - self.started)
+            logger.debug(f"Startup step {name} done after {(loop.time() - begin) * 1000:.0f}ms")
+            return result
+
+        for name, (step, after) in self.steps.items():
+            tasks[name] = asyncio.ensure_future(run_step(name, step, after))
+        try:
+            results = await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return dict(zip(tasks, results))
+
+    def critical_path(self):
+        """Chain of steps that determined the time to ready, found by following the latest finishing dependency."""
+        if not self.steps:
+            return []
+        name = max(self.steps, key=lambda step: self.timings.get(step, (0, 0))[1])
+        path = [name]
+        while self.steps[name][1]:
+            name = max(self.steps[name][1], key=lambda step: self.timings[step][1])
+            path.insert(0, name)
+        return path
+
+    def report(self):
+        lines = [f"{'step':12s} {'start':>8s} {'end':>8s} {'duration':>9s}"]
+        for name, (begin, end) in sorted(self.timings.items(), key=lambda item: item[1]):
+            lines.append(f"{name:12s} {begin * 1000:7.0f}ms {end * 1000:7.0f}ms {(end - begin) * 1000:8.0f}ms")
+        ready = max((end for _, end in self.timings.values()), default=0.0) - \
+            min((begin for begin, _ in self.timings.values()), default=0.0)
+        lines.append(f"ready for ATC after {ready:.2f}s, critical path: {' > '.join(self.critical_path())}")
+        return "\n".join(lines)
+
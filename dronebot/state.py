@@ -1,151 +1,354 @@
+import asyncio
+import inspect
 import logging
-import pickle
+import time
 import traceback
-from pathlib import Path
 from typing import List, Dict, Any
 
 from mavsdk import telemetry
-from transitions import MachineError
-from transitions.extensions.asyncio import AsyncMachine
 
-from dronebot import command as cmd
+from dronebot import command as cmd, tracing
+from dronebot.journal import Journal
 from dronebot.vocab import Vocabulary
 from dronebot.voice import Voice
 
 logger = logging.getLogger(__name__.upper())
 
 
+class StateError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+    def __str__(self):
+        return f"{type(self).__name__}: {self.message}"
+
+
 class FlightState(object):
     """
-    @DynamicAttrs
+    Flight phase of one vehicle, advanced by ATC clearances.
+    The transition table is compiled into a dict keyed by (trigger, state, clearance type) and validated when the
+    module is loaded, parsed commands are dispatched through a dict keyed by mode, so handling a command or firing
+    a trigger is a single lookup. A source of '*' expands to every state, a destination of '=' keeps the state.
+    Transitions, conditional commands and queued commands are written to a journal, from which `restore` rebuilds
+    the state, route and pending conditional commands after a crash.
     """
     states = ['parked', 'depart', 'flight', 'inbound', 'landing']
     transitions = [
-        ['recieve_clearance', 'parked',  'depart',  'clearance_valid', None, None, 'callback_startup'],
-        ['recieve_clearance', 'depart',  'flight',  'clearance_valid', None, None, 'callback_takeoff'],
-        ['recieve_clearance', 'flight',  'inbound', 'clearance_valid', 'direct_approach', None, 'callback_inbound'],
-        ['recieve_clearance', 'flight',  'landing', 'clearance_valid', None, None, 'callback_landing'],
-        ['recieve_clearance', 'inbound', 'landing', 'clearance_valid', None, None, 'callback_landing'],
-        ['park', 'landing', 'parked', None, None, None, 'callback_shutdown']
+        # trigger            source     clearance   destination  callback
+        ['recieve_clearance', 'parked',  'route',    'depart',    'callback_startup'],
+        ['recieve_clearance', 'depart',  'takeoff',  'flight',    'callback_takeoff'],
+        ['recieve_clearance', 'flight',  'ils',      'inbound',   'callback_inbound'],
+        ['recieve_clearance', 'flight',  'land',     'landing',   'callback_landing'],
+        ['recieve_clearance', 'inbound', 'land',     'landing',   'callback_landing'],
+        ['recieve_clearance', 'flight',  'route',    '=',         'callback_reroute'],
+        ['recieve_clearance', '*',       'shutdown', '=',         'callback_engine_shutdown'],
+        ['park',              'landing', None,       'parked',    'callback_shutdown']
     ]
+    handlers = {
+        'ALTITUDE': 'handle_altitude',
+        'HEADING': 'handle_heading',
+        'POSITION': 'handle_position',
+        'REPORT': 'handle_report',
+        'CONTACT': 'handle_contact',
+        'CLEARANCE': 'handle_clearance'
+    }
+    table = None
+    pipelined = True
+
+    @classmethod
+    def compile(cls):
+        table = dict()
+        for trigger, source, kind, destination, callback in cls.transitions:
+            if not callable(getattr(cls, callback, None)):
+                raise StateError(f"Transition {trigger} from {source} has no callback {callback}")
+            for state in (cls.states if source == '*' else [source]):
+                target = state if destination == '=' else destination
+                if state not in cls.states or target not in cls.states:
+                    raise StateError(f"Transition {trigger} from {state} to {target} uses an unknown state")
+                if (trigger, state, kind) in table:
+                    raise StateError(f"Transition {trigger} from {state} on '{kind}' is defined twice")
+                table[(trigger, state, kind)] = (target, getattr(cls, callback))
+        for handler in cls.handlers.values():
+            if not callable(getattr(cls, handler, None)):
+                raise StateError(f"Unknown command handler {handler}")
+        cls.table = table
 
-    def __init__(self, command_queue, restore):
-        initial = self.load() if restore else 'parked'
-        self.machine = AsyncMachine(self, states=self.states, transitions=self.transitions, initial=initial, queued=True)
+    def __init__(self, command_queue, restore, call_sign="cityairbus1234", journal: Journal = None,
+                 vocab: Vocabulary = None):
+        self.call_sign = call_sign
         self.command_queue = command_queue
-        self.voice = Voice(atc="manching tower")
-        self.vocab = Vocabulary()
+        self.voice = Voice(atc="manching tower", call_sign=call_sign)
+        self.vocab = vocab or Vocabulary()
+        self.dispatch = dict((int(self.vocab.MODE[mode]), getattr(self, handler))
+                             for mode, handler in self.handlers.items())
+        self.state = 'parked'
+        self.route = None
+        self.pending = dict()
+        self.next_key = 0
+        self.readback = None
+        self.journal = journal or Journal()
+        self.journal.snapshot = self.snapshot
+        if restore:
+            self.restore()
+        else:
+            self.journal.truncate()
+            self.journal.append('snapshot', **self.snapshot())
 
-    def clearance_valid(self, **clearance):
-        valid = {
-            'parked': ['route'],
-            'depart': ['takeoff'],
-            'flight': ['ils', 'land'],
-            'inbound': ['land']
-        }
-        return clearance['type'] in valid.get(self.state)
+    async def trigger(self, trigger, kind=None, **kwargs):
+        try:
+            destination, callback = self.table[(trigger, self.state, kind)]
+        except KeyError:
+            raise StateError(f"Can't trigger {trigger} {kind or ''} from state {self.state}") from None
+        logger.debug(f"{trigger}: <{self.state}> -> <{destination}>")
+        self.state = destination
+        await callback(self, **kwargs)
+        self.journal.append('transition', trigger=trigger, state=self.state,
+                            route=self.route.destination if self.route else None)
+
+    async def recieve_clearance(self, **clearance):
+        await self.trigger('recieve_clearance', clearance['type'], **clearance)
 
-    def direct_approach(self, **clearance):
-        return clearance['type'] in ['land'] and self.state == 'flight'
+    async def park(self):
+        await self.trigger('park')
 
     async def callback_startup(self, **clearance):
-        await self.command_queue.put(cmd.EngineStart())
+        self.route = clearance.get('route')
+        self.queue(cmd.EngineStart())
 
     async def callback_takeoff(self, **clearance):
-        await self.command_queue.put(cmd.Takeoff())
+        self.queue(cmd.Takeoff())
+        if self.route:
+            self.queue(cmd.FollowRoute(graph=self.vocab.ROUTES, fixes=self.route.fixes))
 
     async def callback_inbound(self, **clearance):
-        await self.command_queue.put(cmd.Direct(position=clearance['position']))
+        self.queue(cmd.Direct(position=clearance['position']))
         response_task = self.voice.speak(f"Inbound {clearance['description']}")
-        await self.command_queue.put(cmd.ReportPos(position=clearance['position'], task=response_task))
+        self.queue(cmd.ReportPos(position=clearance['position'], task=response_task))
 
     async def callback_landing(self, **clearance):
-        await self.command_queue.put(cmd.Land(position=clearance['position']))
-        await self.command_queue.put(cmd.ReportLanded(task=self.park()))
+        self.queue(cmd.Land(position=clearance['position']))
+        self.queue(cmd.ReportLanded(task=self.park()))
+
+    async def callback_reroute(self, **clearance):
+        # change of destination, continue from the nearest fix
+        if not clearance.get('route'):
+            raise StateError("Unknown destination")
+        self.route = clearance['route']
+        self.queue(cmd.FollowRoute(graph=self.vocab.ROUTES, destination=self.route.last_fix))
+
+    async def callback_engine_shutdown(self, **clearance):
+        self.queue(cmd.EngineShutdown())
 
     async def callback_shutdown(self, **clearance):
         await self.voice.speak("request engine shutdown")
 
     async def handle_commands(self, command_list: List[Dict[str, Any]]):
+        """
+        Dispatches the commands of one transmission and reads them back as one combined transmission.
+        Vehicle commands are queued as soon as each one is handled; the readback is spoken in the background,
+        after the readback of the previous transmission, unless `pipelined` is off. Phrases are read back in the
+        order the commands were transmitted, including the ones deferred by a condition. A condition is read back
+        once and never scheduled itself, only the commands it defers are.
+        """
         condition = None
         modes = self.vocab.MODE
-        scheduled = list()
+        deferred = list()
         for command in command_list:
             if command:
                 logger.debug(f"Handling command {command}")
                 mode = command['mode'] if command else None
                 if mode == modes.CONDITION or (condition == 'route' and mode == modes.ALTITUDE):
                     condition = command[str(mode)]
-                    scheduled.append(command)
+                    deferred.append((len(self.voice.phrases), command))
+                elif type(condition) is telemetry.Position:
+                    # everything after "when reaching <fix>" waits for the vehicle to get there
+                    deferred.append((len(self.voice.phrases), command))
                 elif mode == modes.CLEARANCE and command[str(mode)]['type'] == 'route':
                     condition = 'route'
                     await self.update(**command)
                 else:
                     await self.update(**command)
             elif self.state == 'parked':
-                await self.voice.speak("request I F R clearance")
+                self.voice.phrases.append("request I F R clearance")
             else:
                 logger.debug(f"State: <{self.state}>")
-                await self.voice.speak("unable")
-        for command in scheduled:
-            if condition:
+                self.voice.phrases.append("unable")
+        inserted = 0
+        for position, command in deferred:
+            end = len(self.voice.phrases)
+            if command['mode'] == modes.CONDITION:
+                self.voice.phrases.append(command['phrase'])
+            elif condition:
                 logger.debug(f"Handling condition {condition}:{type(condition)}")
-                if type(condition) is telemetry.Position:
-                    await self.command_queue.put(cmd.ReportPos(position=condition, task=command))
-                    self.voice.phrases.append(command['phrase'])
-                if type(condition) is float:
-                    respond_task = self.voice.speak(f"inbound MIQ, passing fifteen hundred feet climbing flight level {round(float(condition) / 0.3034)}")
-                    climb_task = self.command_queue.put(cmd.Altitude(altitude=condition))
-                    await self.command_queue.put(cmd.ReportAlt(altitude=4.6, task=respond_task))
-                    await self.command_queue.put(cmd.ReportAlt(altitude=4.6, task=climb_task))
-                    self.voice.phrases.append(command['phrase'])
+                self.schedule(condition, command)
             else:
                 await self.update(**command)
-        await self.voice.speak()
+            phrases = self.voice.phrases[end:]
+            del self.voice.phrases[end:]
+            self.voice.phrases[position + inserted:position + inserted] = phrases
+            inserted += len(phrases)
+        phrases = list(self.voice.phrases)
+        self.voice.phrases.clear()
+        self.readback = asyncio.ensure_future(self.read_back(self.readback, phrases))
+        if not self.pipelined:
+            await self.readback
+
+    async def read_back(self, previous, phrases):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        if phrases:
+            await self.voice.say(phrases)
+
+    def queue(self, command):
+        self.journal.append('command', command=str(command))
+        # the transmission's trace stays open until the command has run, released by the executor
+        tracing.tracer.hold(command.trace_id)
+        self.command_queue.put_nowait(command)
+
+    def schedule(self, condition, command, key=None, readback=True):
+        """Queues the report command that runs `command` once `condition` (a position or altitude) is met."""
+        if key is None:
+            key = self.next_key
+        self.next_key = max(self.next_key, key + 1)
+        entry = {'key': key, 'condition': condition, 'mode': command['mode'].name, 'match': command.get('match'),
+                 'phrase': command['phrase']}
+        self.pending[key] = entry
+        self.journal.append('pending', **entry)
+        if type(condition) is telemetry.Position:
+            # the phrase is read back now, firing only dispatches what the command asks the vehicle to do
+            deferred = self.vehicle_command(command)
+            action = (lambda: self.queue(deferred)) if deferred else (lambda: self.update_silently(command))
+            self.queue(cmd.ReportPos(position=condition, task=self.fire(key, action)))
+        if type(condition) is float:
+            respond_task = self.voice.speak(f"inbound MIQ, passing fifteen hundred feet climbing flight level {round(float(condition) / 0.3034)}")
+            self.queue(cmd.ReportAlt(altitude=4.6, task=respond_task))
+            deferred = cmd.Altitude(altitude=condition)
+            self.queue(cmd.ReportAlt(altitude=4.6, task=self.fire(key, lambda: self.queue(deferred))))
+        if readback:
+            self.voice.phrases.append(command['phrase'])
+
+    async def fire(self, key, action):
+        self.pending.pop(key, None)
+        self.journal.append('fired', key=key)
+        result = action()
+        if inspect.isawaitable(result):
+            await result
+
+    def snapshot(self):
+        return {'state': self.state, 'route': self.route.destination if self.route else None,
+                'pending': list(self.pending.values())}
+
+    def decode(self, entry):
+        """Rebuilds a pending conditional command from its journal entry by parsing its phrase again."""
+        condition = entry['condition']
+        if isinstance(condition, dict):
+            condition = telemetry.Position(*condition['__position__'])
+        mode = self.vocab.MODE[entry['mode']]
+        for pattern in self.vocab.NOUNS.get(mode, ()):
+            command = self.vocab.get_kwargs(pattern, entry['phrase'], mode)
+            if command and command['match'] == entry['match']:
+                return condition, command
+        return condition, {'phrase': entry['phrase'], 'mode': mode}
+
+    def restore(self):
+        started = time.perf_counter()
+        records = self.journal.records()
+        state, route, pending = 'parked', None, dict()
+        for record in records:
+            kind = record['kind']
+            if kind == 'snapshot':
+                state, route = record['state'], record['route']
+                pending = dict((entry['key'], entry) for entry in record['pending'])
+            elif kind == 'transition':
+                state, route = record['state'], record['route']
+            elif kind == 'pending':
+                pending[record['key']] = record
+            elif kind == 'fired':
+                pending.pop(record['key'], None)
+        if state not in self.states:
+            raise StateError(f"Unknown state '{state}'")
+        self.state = state
+        self.route = self.vocab.ROUTES.routes.get(route)
+        for key, entry in pending.items():
+            self.schedule(*self.decode(entry), key=key, readback=False)
+        if self.state == 'landing':
+            self.queue(cmd.ReportLanded(task=self.park()))
+        self.journal.compact()
+        logger.info(f"Restored <{self.state}> with {len(pending)} pending commands from {len(records)} journal "
+                    f"records in {(time.perf_counter() - started) * 1000:.1f}ms")
 
     async def update(self, **command):
         try:
             mode = command['mode']
-            modes = self.vocab.MODE
             logger.debug(f"Mode: {mode}")
             if mode is None:
                 self.voice.phrases.append("say again")
-            if mode == modes.ALTITUDE:
-                await self.command_queue.put(cmd.Altitude(altitude=command[str(mode)]))
-                self.voice.phrases.append(command['phrase'])
-            if mode == modes.HEADING:
-                await self.command_queue.put(cmd.Heading(heading=command[str(mode)]))
-                self.voice.phrases.append(command['phrase'])
-            if mode == modes.POSITION:
-                await self.command_queue.put(cmd.Direct(position=command[str(mode)]))
-                self.voice.phrases.append(command['phrase'])
-            if mode == modes.REPORT:
-                if command[str(mode)] == 'departure' and self.state == 'depart':
-                    self.voice.phrases.append("ready for departure")
-            if mode == modes.CONTACT:
-                Voice.atc = command[str(mode)]
-                self.voice.phrases.append(command['phrase'])
-            if mode == modes.CLEARANCE:
-                logger.debug(command[str(mode)])
-                if command[str(mode)]['type'] == 'shutdown':
-                    await self.command_queue.put(cmd.EngineShutdown())
-                elif self.clearance_valid(**command[str(mode)]):
-                    await self.recieve_clearance(**command[str(mode)])
-                    self.voice.phrases.append(command['phrase'])
-                else:
-                    self.voice.phrases.append("Unable")
-        except MachineError as e:
+            else:
+                handler = self.dispatch.get(mode)
+                if handler is not None:
+                    await handler(command)
+            tracing.mark('transition')
+        except StateError as e:
             logger.error(e)
             logger.debug(f"State: <{self.state}>")
             logger.debug(traceback.format_exc())
             self.voice.phrases.append("Unable")
 
+    async def update_silently(self, command):
+        """Handles a deferred command that is not a vehicle command, its phrase was read back when scheduled."""
+        end = len(self.voice.phrases)
+        await self.update(**command)
+        del self.voice.phrases[end:]
+
+    def vehicle_command(self, command):
+        """The vehicle command of an altitude, heading or position command, None for the other modes."""
+        mode = command['mode']
+        if str(mode) not in command:
+            return None
+        if mode == self.vocab.MODE.ALTITUDE:
+            return cmd.Altitude(altitude=command[str(mode)])
+        if mode == self.vocab.MODE.HEADING:
+            return cmd.Heading(heading=command[str(mode)])
+        if mode == self.vocab.MODE.POSITION:
+            fixes = self.route and self.vocab.ROUTES.reroute(self.route, command['match'])
+            if fixes and self.state == 'flight':
+                return cmd.FollowRoute(graph=self.vocab.ROUTES, fixes=fixes)
+            return cmd.Direct(position=command[str(mode)], name=command['match'], fixes=self.vocab.FIXES)
+        return None
+
+    async def handle_altitude(self, command):
+        self.queue(self.vehicle_command(command))
+        self.voice.phrases.append(command['phrase'])
+
+    async def handle_heading(self, command):
+        self.queue(self.vehicle_command(command))
+        self.voice.phrases.append(command['phrase'])
+
+    async def handle_position(self, command):
+        self.queue(self.vehicle_command(command))
+        self.voice.phrases.append(command['phrase'])
+
+    async def handle_report(self, command):
+        if command[str(command['mode'])] == 'departure' and self.state == 'depart':
+            self.voice.phrases.append("ready for departure")
+        if command[str(command['mode'])] == 'position':
+            # answered as its own transmission once the executor has read the current position
+            self.queue(cmd.ReportPosition(fixes=self.vocab.FIXES, respond=lambda report: self.voice.say([report])))
+
+    async def handle_contact(self, command):
+        self.voice.atc = command[str(command['mode'])]
+        self.voice.phrases.append(command['phrase'])
+
+    async def handle_clearance(self, command):
+        clearance = command[str(command['mode'])]
+        logger.debug(clearance)
+        await self.recieve_clearance(**clearance)
+        if clearance['type'] != 'shutdown':
+            self.voice.phrases.append(command['phrase'])
+
     def save(self):
         logger.debug(f"Saving flight state <{self.state}>")
-        with open(Path('saves/flight_state.p').absolute(), 'wb+') as save_handle:
-            pickle.dump(self.state, save_handle)
+        self.journal.compact()
+        self.journal.close()
 
-    def load(self):
-        logger.debug("Loading flight state")
-        with open(Path('saves/flight_state.p').absolute(), 'rb') as load_handle:
-            return pickle.load(load_handle)
+FlightState.compile()
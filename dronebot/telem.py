@@ -3,8 +3,15 @@ import logging
 
 from mavsdk import System, telemetry
 
+from dronebot import geodesy
+from dronebot.geofence import Geofence
+from dronebot.history import TelemetryHistory
+from dronebot.recorder import Kind
+from dronebot.triggers import TriggerEngine
+
 logger = logging.getLogger(__name__.upper())
 
+
 class Telemetry:
     def __init__(self, drone: System):
         self.drone = drone
@@ -14,26 +21,74 @@ class Telemetry:
         self.in_air = False
         self.is_armed = False
         self.is_landed = True
+        self.velocity = None
+        self.battery = None
+        self.history = TelemetryHistory()
+        self.triggers = TriggerEngine()
+        self.geofence = Geofence(None)
+        self.recorder = None
+        self.watchdog = None
+
+    @staticmethod
+    def now():
+        return asyncio.get_event_loop().time()
+
+    def east_north(self):
+        """Current horizontal position in the home frame."""
+        return geodesy.home_frame(self.position).east_north(self.position.latitude_deg, self.position.longitude_deg)
 
     async def sub_position_updates(self):
         await self.drone.telemetry.set_rate_position(10)
         async for position in self.drone.telemetry.position():
+            if self.watchdog:
+                self.watchdog.beat('position')
             self.position = position
             self.altitude = position.relative_altitude_m
+            self.history.position.append(self.now(), position.latitude_deg, position.longitude_deg,
+                                         position.absolute_altitude_m, position.relative_altitude_m)
+            self.triggers.update(*self.east_north(), position.relative_altitude_m)
+            self.geofence.check(position, self.velocity)
+            if self.recorder:
+                self.recorder.record(Kind.POSITION, position.latitude_deg, position.longitude_deg,
+                                     position.absolute_altitude_m, position.relative_altitude_m)
+
+    async def sub_velocity_updates(self):
+        await self.drone.telemetry.set_rate_velocity_ned(10)
+        async for velocity in self.drone.telemetry.velocity_ned():
+            if self.watchdog:
+                self.watchdog.beat('velocity')
+            self.velocity = velocity
+            self.history.velocity.append(self.now(), velocity.north_m_s, velocity.east_m_s, velocity.down_m_s)
+            if self.recorder:
+                self.recorder.record(Kind.VELOCITY, velocity.north_m_s, velocity.east_m_s, velocity.down_m_s)
+
+    async def sub_battery_updates(self):
+        await self.drone.telemetry.set_rate_battery(1)
+        async for battery in self.drone.telemetry.battery():
+            self.battery = battery
+            self.history.battery.append(self.now(), battery.voltage_v, battery.remaining_percent)
+            if self.recorder:
+                self.recorder.record(Kind.BATTERY, battery.voltage_v, battery.remaining_percent)
 
     async def sub_state_updates(self):
         while True:
             async for armed in self.drone.telemetry.armed():
-                self.is_armed = armed
+                self.update_flag('is_armed', 'armed', armed)
                 break
             async for in_air in self.drone.telemetry.in_air():
-                self.in_air = in_air
+                self.update_flag('in_air', 'in_air', in_air)
                 break
             async for landed_state in self.drone.telemetry.landed_state():
-                self.is_landed = (landed_state == telemetry.LandedState.ON_GROUND)
+                self.update_flag('is_landed', 'landed', landed_state == telemetry.LandedState.ON_GROUND)
                 break
             await asyncio.sleep(1)
 
+    def update_flag(self, attr, name, value):
+        if self.recorder and getattr(self, attr) != value:
+            self.recorder.record_flag(name, value)
+        setattr(self, attr, value)
+        self.triggers.update_flag(name, value)
+
     async def wait_for_armed(self, rate=10):
         while not self.is_armed:
             await asyncio.sleep(1 / rate)
@@ -54,25 +109,67 @@ class Telemetry:
             await asyncio.sleep(1 / rate)
         return True
 
-    async def print_telem_status(self):
-        async for is_armed in self.drone.telemetry.armed():
-            logger.debug(f"Armed state:\n\t{is_armed}")
-            break
-        async for flight_mode in self.drone.telemetry.flight_mode():
-            logger.debug(f"Flight mode:\n\t{flight_mode}")
-            break
-        async for landed_state in self.drone.telemetry.landed_state():
-            logger.debug(f"Landed State:\n\t{landed_state}")
-            break
-        async for battery in self.drone.telemetry.battery():
-            logger.debug(str(battery).replace(' [', '\n\t').replace(', ', '\n\t').replace(']', ''))
-            break
-        async for gps_info in self.drone.telemetry.gps_info():
-            logger.debug(str(gps_info).replace(' [', '\n\t').replace(', ', '\n\t').replace(']', ''))
-            break
-        async for health in self.drone.telemetry.health():
-            logger.debug(str(health).replace(' [', '\n\t').replace(', ', '\n\t').replace(']', ''))
-            break
-        async for position in self.drone.telemetry.position():
-            logger.debug(str(position).replace(' [', '\n\t').replace(', ', '\n\t').replace(']', ''))
-            break
+    @staticmethod
+    async def first(stream, timeout):
+        """Returns the first item of a telemetry stream, or None if it does not arrive within `timeout` seconds."""
+        async def read():
+            async for item in stream():
+                return item
+        try:
+            return await asyncio.wait_for(read(), timeout)
+        except asyncio.TimeoutError:
+            logger.debug(f"No {stream.__name__} telemetry within {timeout}s")
+            return None
+
+    async def snapshot(self, timeout=1.0, cached=True):
+        """
+        Collects one item of every diagnostic stream concurrently, so a snapshot takes a single round trip.
+        Streams that are already subscribed to are read from their latest value when `cached` is set.
+        """
+        streams = self.drone.telemetry
+        position = self.position if cached else None
+        battery = self.battery if cached else None
+        values = await asyncio.gather(
+            self.first(streams.armed, timeout),
+            self.first(streams.flight_mode, timeout),
+            self.first(streams.landed_state, timeout),
+            self.first(streams.battery, timeout) if battery is None else _ready(battery),
+            self.first(streams.gps_info, timeout),
+            self.first(streams.health, timeout),
+            self.first(streams.position, timeout) if position is None else _ready(position)
+        )
+        return TelemetrySnapshot(self.now(), *values)
+
+    async def print_telem_status(self, timeout=1.0):
+        snapshot = await self.snapshot(timeout)
+        logger.debug(snapshot.format())
+        return snapshot
+
+
+async def _ready(value):
+    return value
+
+
+class TelemetrySnapshot:
+    __slots__ = ('time', 'is_armed', 'flight_mode', 'landed_state', 'battery', 'gps_info', 'health', 'position')
+
+    def __init__(self, time, is_armed, flight_mode, landed_state, battery, gps_info, health, position):
+        self.time = time
+        self.is_armed = is_armed
+        self.flight_mode = flight_mode
+        self.landed_state = landed_state
+        self.battery = battery
+        self.gps_info = gps_info
+        self.health = health
+        self.position = position
+
+    @property
+    def missing(self):
+        return [name for name in self.__slots__[1:] if getattr(self, name) is None]
+
+    def format(self):
+        lines = ["Telemetry snapshot:"]
+        for name in self.__slots__[1:]:
+            value = getattr(self, name)
+            lines.append(f"\t{name}: {'n/a' if value is None else value}")
+        return "\n".join(lines)
@@ -0,0 +1,167 @@
+import bisect
+import collections
+import contextvars
+import json
+import logging
+import socket
+import threading
+import time
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger(__name__.upper())
+
+# stages of one transmission in the order they happen
+STAGES = ('vad_end', 'asr_finish', 'received', 'parsed', 'transition', 'dispatched', 'acked', 'response')
+
+# correlation id of the transmission being handled, inherited by every task and command created while handling it
+current_trace = contextvars.ContextVar('current_trace', default=None)
+
+
+class Histogram:
+    bounds_ms = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, float('inf'))
+
+    def __init__(self):
+        self.counts = [0] * len(self.bounds_ms)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def add(self, ms):
+        self.counts[bisect.bisect_left(self.bounds_ms, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+
+    def percentile(self, p):
+        """Upper bucket bound below which `p` percent of the samples fall."""
+        rank = p / 100 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds_ms, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return bound
+        return 0
+
+    def to_dict(self):
+        return {'count': self.count, 'mean_ms': self.total_ms / self.count if self.count else 0.0,
+                'p50_ms': self.percentile(50), 'p95_ms': self.percentile(95),
+                'buckets': dict((str(bound), count) for bound, count in zip(self.bounds_ms, self.counts) if count)}
+
+
+class Trace:
+    __slots__ = ('trace_id', 'text', 'marks', 'holds')
+
+    def __init__(self, trace_id, text, marks):
+        self.trace_id = trace_id
+        self.text = text
+        self.marks = dict(marks or ())
+        self.holds = 1
+
+    def spans(self):
+        """Milliseconds between consecutive marks in time order, plus the total from first to last mark."""
+        marked = sorted(((stage, self.marks[stage]) for stage in STAGES if stage in self.marks), key=lambda m: m[1])
+        spans = dict((f"{a}>{b}", (tb - ta) * 1000) for (a, ta), (b, tb) in zip(marked, marked[1:]))
+        if len(marked) > 1:
+            spans['total'] = (marked[-1][1] - marked[0][1]) * 1000
+        return spans
+
+
+class Tracer:
+    """
+    Collects per-transmission latency spans from VAD end to the first telemetry response of the vehicle.
+    Marks are wall clock times so they can come from a separate ASR process. A trace is finished once the
+    transmission was handled, every command it queued has run or was dropped and every acked move command either moved the
+    vehicle or gave up;
+    finished traces are added to per-span histograms and written as JSON lines to the sink, a file path or
+    udp://host:port.
+    """
+
+    def __init__(self, sink=None, max_open=64):
+        self.lock = threading.Lock()
+        self.open = collections.OrderedDict()
+        self.max_open = max_open
+        self.histograms = collections.defaultdict(Histogram)
+        self.sink = None
+        self.address = None
+        if sink and sink.startswith('udp://'):
+            host, port = sink[len('udp://'):].rsplit(':', 1)
+            self.address = (host or 'localhost', int(port))
+            self.sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        elif sink:
+            Path(sink).parent.mkdir(parents=True, exist_ok=True)
+            self.sink = open(sink, 'a')
+
+    def start(self, text, trace_id=None, marks=None):
+        trace_id = trace_id or uuid.uuid4().hex[:12]
+        with self.lock:
+            trace = Trace(trace_id, text, marks)
+            trace.marks.setdefault('received', time.time())
+            self.open[trace_id] = trace
+            while len(self.open) > self.max_open:
+                _, stale = self.open.popitem(last=False)
+                logger.debug(f"Dropping unfinished trace {stale.trace_id}")
+        return trace_id
+
+    def mark(self, trace_id, stage, t=None):
+        """Time stamps a stage once, later marks of the same stage are ignored."""
+        with self.lock:
+            trace = self.open.get(trace_id)
+            if trace is not None:
+                trace.marks.setdefault(stage, time.time() if t is None else t)
+
+    def hold(self, trace_id):
+        with self.lock:
+            if trace_id in self.open:
+                self.open[trace_id].holds += 1
+
+    def release(self, trace_id):
+        with self.lock:
+            trace = self.open.get(trace_id)
+            if trace is None:
+                return
+            trace.holds -= 1
+            if trace.holds > 0:
+                return
+            del self.open[trace_id]
+            spans = trace.spans()
+            for name, ms in spans.items():
+                self.histograms[name].add(ms)
+        logger.debug(f"Trace {trace_id} '{trace.text}': " + ", ".join(f"{k} {v:.0f}ms" for k, v in spans.items()))
+        self.export({'trace': trace_id, 'text': trace.text, 'marks': trace.marks, 'spans': spans})
+
+    def export(self, record):
+        if self.sink is None:
+            return
+        line = json.dumps(record)
+        try:
+            if self.address:
+                self.sink.sendto(line.encode(), self.address)
+            else:
+                self.sink.write(line + "\n")
+                self.sink.flush()
+        except OSError as e:
+            logger.error(f"Trace export failed: {e}")
+
+    def summary(self):
+        with self.lock:
+            return dict((name, histogram.to_dict()) for name, histogram in self.histograms.items())
+
+    def close(self):
+        self.export({'histograms': self.summary()})
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+
+
+tracer = Tracer()
+
+
+def configure(sink):
+    global tracer
+    tracer = Tracer(sink)
+    return tracer
+
+
+def mark(stage, trace_id=None):
+    trace_id = trace_id or current_trace.get()
+    if trace_id is not None:
+        tracer.mark(trace_id, stage)
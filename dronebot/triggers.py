@@ -0,0 +1,188 @@
+import asyncio
+import inspect
+import logging
+from enum import IntEnum
+
+import numpy as np
+
+logger = logging.getLogger(__name__.upper())
+
+
+class Target(IntEnum):
+    POSITION = 1
+    ALTITUDE = 2
+    DEPARTURE = 3
+
+
+class Trigger:
+    __slots__ = ('index', 'generation', 'description')
+
+    def __init__(self, index, generation, description):
+        self.index = index
+        self.generation = generation
+        self.description = description
+
+    def __repr__(self):
+        return f"Trigger({self.description})"
+
+
+class TriggerEngine:
+    """
+    Pending spatial and altitude conditions, stored column-wise so a telemetry update checks all of them in one
+    vectorized pass. Each condition owns a task (coroutine, awaitable or callable) that is scheduled exactly once
+    when the condition is met. State conditions (in air, landed) are keyed by flag and checked on flag changes.
+    Triggers registered or moved by a task fired during an update are checked against the same sample once that
+    update has fired everything it found.
+    """
+
+    def __init__(self, capacity=16):
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.target = np.full((capacity, 3), np.nan)
+        self.radius = np.zeros(capacity)
+        self.active = np.zeros(capacity, dtype=bool)
+        self.generation = np.zeros(capacity, dtype=np.int64)
+        self.tasks = [None] * capacity
+        self.flags = dict()
+        self.sample = None
+        self.updating = False
+        self.changed = False
+
+    def __len__(self):
+        return int(self.active.sum()) + sum(map(len, self.flags.values()))
+
+    def _grow(self):
+        capacity = len(self.active)
+        self.kind = np.concatenate((self.kind, np.zeros(capacity, dtype=np.int8)))
+        self.target = np.concatenate((self.target, np.full((capacity, 3), np.nan)))
+        self.radius = np.concatenate((self.radius, np.zeros(capacity)))
+        self.active = np.concatenate((self.active, np.zeros(capacity, dtype=bool)))
+        self.generation = np.concatenate((self.generation, np.zeros(capacity, dtype=np.int64)))
+        self.tasks.extend([None] * capacity)
+
+    def _register(self, kind, target, radius, task, description):
+        free = np.flatnonzero(~self.active)
+        if not len(free):
+            self._grow()
+            free = np.flatnonzero(~self.active)
+        i = int(free[0])
+        self.kind[i] = kind
+        self.target[i] = target
+        self.radius[i] = radius
+        self.active[i] = True
+        self.generation[i] += 1
+        self.tasks[i] = task
+        trigger = Trigger(i, int(self.generation[i]), description)
+        logger.debug(f"Registered {trigger}")
+        if self.sample is not None:
+            self.update(*self.sample)
+        return trigger
+
+    def at_position(self, east, north, radius, task):
+        return self._register(Target.POSITION, (east, north, np.nan), radius, task,
+                              f"within {radius}m of ({east:.1f}, {north:.1f})")
+
+    def at_altitude(self, altitude, tolerance, task):
+        return self._register(Target.ALTITUDE, (np.nan, np.nan, altitude), tolerance, task,
+                              f"within {tolerance}m of {altitude:.1f}m")
+
+    def away_from(self, east, north, altitude, distance, task):
+        """Fires once the vehicle is more than `distance` metres (3D) away from the given point."""
+        return self._register(Target.DEPARTURE, (east, north, altitude), distance, task,
+                              f"beyond {distance}m of ({east:.1f}, {north:.1f}, {altitude:.1f})")
+
+    def on_flag(self, name, value, task, current=None):
+        trigger = Trigger(-1, 0, f"{name} is {value}")
+        if current == value:
+            self._fire(trigger, task)
+        else:
+            self.flags.setdefault((name, value), list()).append((trigger, task))
+        return trigger
+
+    def pending(self, trigger):
+        if trigger.index < 0:
+            return any(trigger is t for waiting in self.flags.values() for t, _ in waiting)
+        return bool(self.active[trigger.index]) and self.generation[trigger.index] == trigger.generation
+
+    def cancel(self, trigger):
+        """Drops a pending trigger without running its task, returns False if it already fired."""
+        if not self.pending(trigger):
+            return False
+        if trigger.index < 0:
+            for key, waiting in self.flags.items():
+                for t, task in waiting:
+                    if t is trigger:
+                        waiting.remove((t, task))
+                        _discard(task)
+                        break
+        else:
+            self.active[trigger.index] = False
+            _discard(self.tasks[trigger.index])
+            self.tasks[trigger.index] = None
+        logger.debug(f"Cancelled {trigger}")
+        return True
+
+    def replace(self, trigger, *, target=None, radius=None, task=None):
+        """Moves a pending trigger to a new target, radius or task in place, returns False if it already fired."""
+        if not self.pending(trigger) or trigger.index < 0:
+            return False
+        i = trigger.index
+        if target is not None:
+            self.target[i] = target
+        if radius is not None:
+            self.radius[i] = radius
+        if task is not None:
+            _discard(self.tasks[i])
+            self.tasks[i] = task
+        if self.sample is not None:
+            self.update(*self.sample)
+        return True
+
+    def update(self, east, north, altitude):
+        self.sample = (east, north, altitude)
+        if self.updating:
+            self.changed = True
+            return
+        self.updating = True
+        try:
+            self.changed = True
+            while self.changed:
+                self.changed = False
+                self._check(east, north, altitude)
+        finally:
+            self.updating = False
+
+    def _check(self, east, north, altitude):
+        if not self.active.any():
+            return
+        horizontal = np.hypot(self.target[:, 0] - east, self.target[:, 1] - north)
+        vertical = np.abs(self.target[:, 2] - altitude)
+        departure = self.kind == Target.DEPARTURE
+        distance = np.where(self.kind == Target.POSITION, horizontal, vertical)
+        distance[departure] = np.hypot(horizontal[departure], vertical[departure])
+        reached = np.where(departure, distance > self.radius, distance <= self.radius)
+        fired = np.flatnonzero(self.active & reached)
+        generations = self.generation[fired].copy()
+        for i, generation in zip(fired, generations):
+            # a task fired before may have cancelled this trigger, or its slot was reused since
+            if not self.active[i] or self.generation[i] != generation:
+                continue
+            self.active[i] = False
+            task, self.tasks[i] = self.tasks[i], None
+            self._fire(Trigger(int(i), int(self.generation[i]), "target reached"), task)
+
+    def update_flag(self, name, value):
+        for trigger, task in self.flags.pop((name, value), ()):
+            self._fire(trigger, task)
+
+    @staticmethod
+    def _fire(trigger, task):
+        logger.debug(f"Firing {trigger}: {task}")
+        if inspect.isawaitable(task):
+            asyncio.ensure_future(task)
+        elif callable(task):
+            task()
+
+
+def _discard(task):
+    if inspect.iscoroutine(task):
+        task.close()
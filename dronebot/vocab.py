@@ -1,25 +1,44 @@
 import re
 from enum import IntEnum
+from functools import cached_property
 from pathlib import Path
 
 import yaml
-from mavsdk import telemetry
 
 
 class Vocabulary:
     """
     Container class for vocabulary loaded from a YAML config file.
+    POSITIONS, ROUTES and FIXES need mavsdk and numpy, they are built on first use so that parser-only tooling starts
+    without loading either.
     @DynamicAttrs
     """
 
     def __init__(self):
         with open((Path(__file__).parent / 'vocab.yaml').resolve()) as file:
-            vocab = yaml.load(file, Loader=yaml.FullLoader)
+            vocab = yaml.load(file, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
 
         setattr(self, 'MODE', IntEnum('MODE', vocab.get('MODES')))
         setattr(self, 'VERBS', dict((self.MODE[key], set(val)) for key, val in vocab.get('VERBS').items()))
         setattr(self, 'NOUNS', dict((self.MODE[key], set(val)) for key, val in vocab.get('NOUNS').items()))
-        setattr(self, 'POSITIONS', dict((key, telemetry.Position(*val)) for key, val in vocab.get('POSITIONS').items()))
+        setattr(self, 'GEOFENCE', vocab.get('GEOFENCE', dict()))
+        self.config = vocab
+
+    @cached_property
+    def POSITIONS(self):
+        from mavsdk import telemetry
+        return dict((key, telemetry.Position(*val)) for key, val in self.config.get('POSITIONS').items())
+
+    @cached_property
+    def ROUTES(self):
+        from dronebot.routes import RouteGraph
+        return RouteGraph(self.POSITIONS, self.config.get('ROUTES'), self.GEOFENCE, fixes=self.FIXES)
+
+    @cached_property
+    def FIXES(self):
+        """Spatial index over POSITIONS, the route graph shares its frame."""
+        from dronebot.fixes import FixIndex
+        return FixIndex(self.POSITIONS)
 
     def get_kwargs(self, pattern, phrase, mode):
         match = re.search(pattern, phrase)
@@ -39,8 +58,7 @@ class Vocabulary:
             if mode == self.MODE.CLEARANCE:
                 clearance = {'type': match.group('type')}
                 if clearance['type'] == 'route':
-                    clearance['route'] = None
-                    # TODO: add loading flight plan from vocab.yaml
+                    clearance['route'] = self.ROUTES.routes.get(match.group('val'))
                 if clearance['type'] in ['ils', 'land']:
                     clearance['description'] = ' '.join([match.group('val'), match.group('unit')])
                     clearance['position'] = self.POSITIONS.get(clearance['description'])
@@ -48,7 +66,7 @@ class Vocabulary:
             if mode == self.MODE.CONTACT:
                 command[str(mode)] = match.group('val')
             if mode == self.MODE.CONDITION:
-                command[str(mode)] = self.POSITIONS.get(match.group('val'))
+                command[str(mode)] = self.POSITIONS.get(match.group('val').strip())
             if mode == self.MODE.REPORT:
                 command[str(mode)] = match.group('val')
             return command
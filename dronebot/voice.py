@@ -1,22 +1,29 @@
 import asyncio
 import logging
 import queue
+import re
 from concurrent.futures import ThreadPoolExecutor
-from threading import Thread
-
-import pyttsx3
+from threading import Event, Thread
 
 logger = logging.getLogger(__name__.upper())
 
+DIGITS = ('zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'niner')
+
+
+def spoken(call_sign):
+    """Radio readback of a call sign, 'cityairbus1234' is read as 'cityairbus one two three four'."""
+    return re.sub(r"\d", lambda match: f" {DIGITS[int(match.group())]}", call_sign)
+
 
 class Voice:
     atc = ""
     tts = None
     tp_exec = None
 
-    def __init__(self, *, atc=None):
+    def __init__(self, *, atc=None, call_sign="cityairbus1234"):
         if atc:
             Voice.atc = atc
+        self.call_sign = spoken(call_sign)
         if not self.tts:
             Voice.tts = TTS()
         if not self.tp_exec:
@@ -26,23 +33,37 @@ class Voice:
     async def speak(self, quick_phrase="", *, full=False):
         self.phrases.append(quick_phrase) if quick_phrase else None
         if len(self.phrases) > 0 or full:
-            sentence = (f"{self.atc.capitalize()}, " if full else "")
-            sentence += (f"{', '.join(self.phrases)}, " if len(self.phrases) > 0 else "")
-            sentence += "Cityairbus one two three four."
-            await asyncio.get_event_loop().run_in_executor(self.tp_exec, self.tts.respond, sentence.capitalize())
+            phrases = list(self.phrases)
             self.phrases.clear()
+            await self.say(phrases, full=full)
+
+    async def say(self, phrases, *, full=False):
+        """Speaks the given phrases as one transmission, leaving phrases collected meanwhile for the next one."""
+        sentence = (f"{self.atc.capitalize()}, " if full else "")
+        sentence += (f"{', '.join(phrases)}, " if len(phrases) > 0 else "")
+        sentence += f"{self.call_sign}."
+        await asyncio.get_event_loop().run_in_executor(self.tp_exec, self.tts.respond, sentence.capitalize())
+
+    async def warm_up(self, timeout=10.0):
+        """Waits until the TTS engine, started in the background by the constructor, can speak."""
+        ready = getattr(self.tts, 'ready', None)
+        if ready is not None and not await asyncio.get_event_loop().run_in_executor(None, ready.wait, timeout):
+            logger.warning(f"TTS engine not ready after {timeout:.0f}s")
 
 
 class TTS(Thread):
     def __init__(self):
         super().__init__()
         self.queue = queue.Queue()
+        self.ready = Event()
         self.daemon = True
         self.start()
 
     def run(self):
+        import pyttsx3
         tts_engine = pyttsx3.init()
         tts_engine.startLoop(False)
+        self.ready.set()
         t_running = True
         while t_running:
             if self.queue.empty():
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__.upper())
+
+
+class FailsafeEvent:
+    __slots__ = ('kind', 'detail', 'detection', 'reaction', 'error')
+
+    def __init__(self, kind, detail, detection, reaction=None, error=None):
+        self.kind = kind
+        self.detail = detail
+        self.detection = detection
+        self.reaction = reaction
+        self.error = error
+
+    def __repr__(self):
+        reaction = f"reacted in {self.reaction * 1000:.0f}ms" if self.reaction is not None else "no reaction"
+        return (f"{self.kind} failsafe, {self.detail}: detected after {self.detection * 1000:.0f}ms, {reaction}"
+                f"{f' ({self.error})' if self.error else ''}")
+
+
+class Watchdog:
+    """
+    Heartbeat watchdog over the telemetry subscriptions. Every update of a watched stream is time stamped with
+    `beat`; the link counts as lost once a stream missed `missed` ticks of its expected rate, and the vehicle as
+    unhealthy once health_all_ok was false for `missed` ticks of the health rate. Either one runs its reaction at
+    once, so a failsafe starts at most `missed` ticks plus one check period after the last good update. Streams are
+    only watched from their first update on. Detection (from the last good update) and reaction (until the vehicle
+    accepted the failsafe) are kept in `events`.
+    """
+
+    def __init__(self, rates=None, missed=5, health_rate=1.0, reactions=None):
+        self.rates = rates or {'position': 10.0, 'velocity': 10.0}
+        self.missed = missed
+        self.health_rate = health_rate
+        self.reactions = reactions or dict()
+        self.period = min(1 / rate for rate in self.rates.values()) / 2
+        self.last = dict()
+        self.lost = set()
+        self.unhealthy_since = None
+        self.degraded = set()
+        self.events = list()
+
+    @staticmethod
+    def now():
+        return asyncio.get_event_loop().time()
+
+    def beat(self, stream):
+        self.last[stream] = self.now()
+
+    def health(self, ok):
+        if ok:
+            self.unhealthy_since = None
+            self.recover('health')
+        elif self.unhealthy_since is None:
+            self.unhealthy_since = self.now()
+
+    def check(self, now):
+        for stream, last in self.last.items():
+            silent = now - last
+            if silent > self.missed / self.rates[stream]:
+                if stream not in self.lost:
+                    self.lost.add(stream)
+                    self.declare('link', f"no {stream} update for {silent:.2f}s", silent)
+            elif stream in self.lost:
+                self.lost.discard(stream)
+                if not self.lost:
+                    self.recover('link')
+        if self.unhealthy_since is not None and now - self.unhealthy_since >= self.missed / self.health_rate:
+            self.declare('health', f"health not ok for {now - self.unhealthy_since:.2f}s", now - self.unhealthy_since)
+
+    def declare(self, kind, detail, detection):
+        if kind in self.degraded:
+            return
+        self.degraded.add(kind)
+        event = FailsafeEvent(kind, detail, detection)
+        self.events.append(event)
+        logger.warning(f"Watchdog: {detail}")
+        asyncio.ensure_future(self.react(event))
+
+    async def react(self, event):
+        reaction = self.reactions.get(event.kind)
+        if reaction is None:
+            return
+        started = self.now()
+        try:
+            await reaction()
+        except Exception as e:
+            event.error = e
+        event.reaction = self.now() - started
+        logger.warning(event)
+
+    def recover(self, kind):
+        if kind in self.degraded:
+            self.degraded.discard(kind)
+            logger.info(f"Watchdog: {kind} restored")
+
+    async def run(self):
+        while True:
+            self.check(self.now())
+            await asyncio.sleep(self.period)
+
+    def summary(self):
+        if not self.events:
+            return "no failsafes"
+        return "; ".join(repr(event) for event in self.events)
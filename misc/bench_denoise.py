@@ -0,0 +1,86 @@
+import argparse
+import time
+
+import numpy as np
+
+from dronebot.denoise import Denoiser
+
+RATE = 16000
+FRAME = 320
+
+
+def synthetic(seconds, seed):
+    """Voiced syllables in the radio band with white noise and mains hum on top, clean and noisy."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(RATE * seconds) / RATE
+    envelope = np.clip(np.sin(2 * np.pi * 2.5 * t), 0, None) * (t > 1)
+    speech = envelope * sum(np.sin(2 * np.pi * f * t) / k for k, f in enumerate((300, 600, 900, 1500, 2400), 1)) * 6000
+    noise = rng.standard_normal(len(t)) * 1500 + 2000 * np.sin(2 * np.pi * 50 * t)
+    return speech, np.clip(speech + noise, -32768, 32767).astype(np.int16)
+
+
+def snr(clean, test):
+    return 10 * np.log10((clean ** 2).sum() / ((test - clean) ** 2).sum())
+
+
+def cost(noisy, budget_ms):
+    frames = [noisy[start:start + FRAME].tobytes() for start in range(0, len(noisy) - FRAME + 1, FRAME)]
+    denoiser = Denoiser(budget_ms=budget_ms)
+    started = time.perf_counter()
+    streamed = np.frombuffer(b"".join(denoiser.stream(frames)), np.int16)
+    per_frame = (time.perf_counter() - started) / len(frames)
+    denoiser = Denoiser(budget_ms=budget_ms)
+    started = time.perf_counter()
+    denoiser.clip(noisy)
+    per_frame_block = (time.perf_counter() - started) / (len(noisy) / FRAME)
+    return per_frame, per_frame_block, streamed
+
+
+def wer(args):
+    """Word error rate on the distorted clips of an audio store, without and with denoising."""
+    from dronebot.audiostore import AudioStore
+    from dronebot.mic_vad_streaming import load_model, word_errors
+    model, _ = load_model(args)
+    denoiser = Denoiser(budget_ms=args.budget)
+    errors, words = [0, 0], 0
+    with AudioStore(args.store) as store:
+        rows = [row for row in store.rows() if '/distorted/' in store.clips[row]['path']]
+        for row in rows:
+            audio = np.frombuffer(store.clip(row), np.int16)
+            transcript = store.transcript(row)
+            words += len(transcript.split())
+            for i, samples in enumerate((audio, denoiser.clip(audio))):
+                errors[i] += word_errors(transcript, model.stt(samples))
+    print(f"WER on {len(rows)} distorted clips: {errors[0] / max(words, 1):.3f} raw, "
+          f"{errors[1] / max(words, 1):.3f} denoised")
+
+
+def main(args):
+    speech, noisy = synthetic(args.seconds, args.seed)
+    per_frame, per_frame_block, streamed = cost(noisy, args.budget)
+    print(f"streaming, frame by frame: {per_frame * 1e6:7.1f}us per 20ms frame ({per_frame / 0.02:.1%} of real time)")
+    print(f"recording, 16 frame blocks: {per_frame_block * 1e6:6.1f}us per 20ms frame")
+    print(f"synthetic SNR: {snr(speech, noisy):.1f}dB noisy, "
+          f"{snr(speech, Denoiser(over=0.0).clip(noisy)):.1f}dB band limited, "
+          f"{snr(speech[:-FRAME], streamed[FRAME:].astype(float)):.1f}dB denoised")
+    if args.store:
+        wer(args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost per frame and effect of the denoising front end")
+    parser.add_argument('-t', '--seconds', type=int, default=10,
+                        help="Length of the synthetic recording. Default: 10")
+    parser.add_argument('-b', '--budget', type=float, default=2.0,
+                        help="Budget per frame in ms. Default: 2")
+    parser.add_argument('--store', metavar='DIR',
+                        help="Audio store (python3 -m dronebot.audiostore) to measure the WER on its distorted clips")
+    parser.add_argument('-m', '--model',
+                        help="DeepSpeech model for the WER")
+    parser.add_argument('-s', '--scorer',
+                        help="DeepSpeech scorer for the WER")
+    parser.add_argument('--seed', type=int, default=0)
+    ARGS = parser.parse_args()
+    if ARGS.store and not ARGS.model:
+        parser.error("--store needs a --model to transcribe with")
+    main(ARGS)
@@ -0,0 +1,78 @@
+import argparse
+import asyncio
+import logging
+import math
+import sys
+import time
+
+from dronebot import config_logging
+from dronebot.controller import Controller
+from dronebot.fleet import Fleet
+from dronebot.replay import InlineExecutor, ScaledClockLoop, SilentTTS
+from dronebot.sim import SimSystem
+from dronebot.voice import Voice, spoken
+
+
+def vehicle(call_sign):
+    controller = Controller(SimSystem(), call_sign, "sim://", False, standalone=False, journal=None)
+    controller.startup_graph.executor = InlineExecutor()
+    return controller
+
+
+async def fly(args):
+    call_signs = [f"cityairbus{1000 + 111 * i}" for i in range(args.vehicles)]
+    fleet = Fleet([vehicle(call_sign) for call_sign in call_signs], sources=())
+    runs = [asyncio.create_task(controller.run()) for controller in fleet.controllers.values()]
+    await asyncio.sleep(5)
+
+    script = [f"{spoken(call_sign)} cleared to munich airport via flight planned route climb flight level five zero"
+              for call_sign in call_signs]
+    # handling a contact fails, only that vehicle asks to say again
+    script.append(f"{spoken(call_signs[0])} contact munich tower one two three decimal four")
+    script.append("lufthansa one two cleared for takeoff")
+    script += [f"{spoken(call_sign)} cleared for takeoff" for call_sign in call_signs]
+    started = time.perf_counter()
+    for transmission in script:
+        fleet.submit(transmission)
+    await asyncio.gather(*fleet.dispatches)
+    routed = time.perf_counter() - started
+    await asyncio.sleep(args.seconds)
+
+    failed = 0
+    for call_sign, controller in fleet.controllers.items():
+        vehicle_ = controller.drone.vehicle
+        ok = controller.flight_state.state == 'flight' and vehicle_.in_air and not controller.abort_event.is_set()
+        failed += not ok
+        print(f"{call_sign}: {controller.flight_state.state}, {'in air' if vehicle_.in_air else 'on ground'}, "
+              f"flown {vehicle_.distance:.0f}m, {controller.executor.summary()}{'' if ok else '  FAILED'}")
+    say_again = [utterance for _, utterance in Voice.tts.responses if utterance.lower().startswith('say again')]
+    print(f"{len(script)} transmissions to {len(call_signs)} vehicles routed and handled in {routed * 1000:.0f}ms "
+          f"wall time, {len(say_again)} say again: {', '.join(say_again)}")
+    for run in runs:
+        run.cancel()
+    await asyncio.gather(*runs, return_exceptions=True)
+    for controller in fleet.controllers.values():
+        controller.drone.close()
+    return 1 if failed or len(say_again) != 1 else 0
+
+
+def main(args):
+    Voice.tts = SilentTTS()
+    Voice.tp_exec = InlineExecutor()
+    loop = ScaledClockLoop(math.inf)
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(fly(args))
+    finally:
+        loop.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fly a fleet of simulated vehicles from one transcript stream")
+    parser.add_argument('-n', '--vehicles', type=int, default=8,
+                        help="Number of vehicles. Default: 8")
+    parser.add_argument('-t', '--seconds', type=float, default=60.0,
+                        help="Simulated seconds to fly after the last clearance. Default: 60")
+    ARGS = parser.parse_args()
+    config_logging.config_logging_stdout(logging.WARNING)
+    sys.exit(main(ARGS))
@@ -0,0 +1,64 @@
+import argparse
+import asyncio
+import time
+
+from dronebot.replay import InlineExecutor, SilentTTS
+from dronebot.state import FlightState
+from dronebot.voice import Voice
+
+CALL_SIGN = "cityairbus1234"
+
+
+class NullQueue:
+    def put_nowait(self, command):
+        # report commands carry the coroutine to run on their trigger, which never fires here
+        if asyncio.iscoroutine(getattr(command, 'task', None)):
+            command.task.close()
+
+
+def parsed(parser, transmission):
+    return [command for command in parser.handle_command(f"cityairbus one two three four {transmission}") if command]
+
+
+async def bench(n):
+    from dronebot.parser import Parser
+    parser = Parser(CALL_SIGN)
+    plain = parsed(parser, "climb flight level five zero turn heading two seven zero proceed direct miq")
+    cycle = [parsed(parser, transmission) for transmission in (
+        "cleared to munich airport via flight planned route", "cleared for takeoff",
+        "cleared for the standard ils runway two six right",
+        "cleared to land runway two six right")]
+
+    state = FlightState(NullQueue(), False, CALL_SIGN)
+    started = time.perf_counter()
+    for _ in range(n):
+        for command in plain:
+            await state.update(**command)
+        state.voice.phrases.clear()
+    per_command = (time.perf_counter() - started) / (n * len(plain))
+
+    started = time.perf_counter()
+    for _ in range(n):
+        for commands in cycle:
+            for command in commands:
+                await state.update(**command)
+        await state.park()
+        assert state.state == 'parked', state.state
+        state.voice.phrases.clear()
+    per_transition = (time.perf_counter() - started) / (n * (len(cycle) + 1))
+    return per_command, per_transition
+
+
+def main(args):
+    Voice.tts = SilentTTS()
+    Voice.tp_exec = InlineExecutor()
+    per_command, per_transition = asyncio.get_event_loop().run_until_complete(bench(args.number))
+    print(f"update, plain command: {per_command * 1e6:8.1f}us")
+    print(f"update, transition:    {per_transition * 1e6:8.1f}us")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Microbenchmark of FlightState command dispatch")
+    parser.add_argument('-n', '--number', type=int, default=2000,
+                        help="Repetitions of each command set. Default: 2000")
+    main(parser.parse_args())
@@ -0,0 +1,65 @@
+import argparse
+import json
+import subprocess
+import sys
+
+# dependencies that only flying a vehicle needs
+HEAVY = ('mavsdk', 'grpc', 'numpy', 'pyttsx3')
+
+# module: import time budget in ms, a budgeted module must not load any of HEAVY
+BUDGETS = {
+    'dronebot.vocab': 80,
+    'dronebot.parser': 80,
+    # connects through mavsdk and compiles the geofence with numpy at startup, measured for reference only
+    'dronebot.controller': None,
+}
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{'ms': elapsed * 1000, 'loaded': sorted(set(name.split('.')[0] for name in sys.modules))}}))
+"""
+
+
+def measure(module, repeat):
+    """Best of `repeat` cold imports of `module`, each one in a fresh interpreter."""
+    best = None
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, '-c', PROBE.format(module=module)], capture_output=True, text=True)
+        if process.returncode:
+            return {'ms': float('nan'), 'loaded': [], 'error': process.stderr.strip().splitlines()[-1]}
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        if best is None or result['ms'] < best['ms']:
+            best = result
+    return best
+
+
+def main(args):
+    failed = False
+    for module in args.modules or BUDGETS:
+        budget = BUDGETS.get(module)
+        result = measure(module, args.repeat)
+        heavy = [name for name in HEAVY if name in result['loaded']]
+        over = budget is not None and result['ms'] > budget * args.scale
+        failed |= over or (budget is not None and bool(heavy)) or 'error' in result
+        status = "over budget" if over else "ok"
+        if heavy:
+            status = f"loads {', '.join(heavy)}" if budget is not None else f"{status}, loads {', '.join(heavy)}"
+        if 'error' in result:
+            status = result['error']
+        print(f"{module:22s} {result['ms']:7.1f}ms  budget {f'{budget * args.scale:.0f}ms' if budget else '-':>6s}  {status}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold import time of the modules that parse transmissions without "
+                                                 "flying, against their budget")
+    parser.add_argument('modules', nargs='*',
+                        help="Modules to measure. Default: all modules with a budget")
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help="Fresh interpreters per module, the best time counts. Default: 5")
+    parser.add_argument('-s', '--scale', type=float, default=1.0,
+                        help="Scale the budgets for slower machines. Default: 1.0")
+    sys.exit(main(parser.parse_args()))
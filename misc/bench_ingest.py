@@ -0,0 +1,73 @@
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from dronebot.ingest import Ingest, Sender
+
+TRANSCRIPT = "cityairbus one two three four climb flight level five zero"
+
+
+def produce(send, n, interval):
+    for _ in range(n):
+        send(TRANSCRIPT, {'asr_finish': time.time()})
+        time.sleep(interval)
+
+
+async def latencies(ingest, send, n, interval):
+    """Milliseconds from the ASR process sending a transcript to the controller taking it off the queue."""
+    producer = threading.Thread(target=produce, args=(send, n, interval), daemon=True)
+    producer.start()
+    result = list()
+    for _ in range(n):
+        transmission = await ingest.get()
+        result.append((time.time() - transmission.marks['asr_finish']) * 1000)
+    producer.join()
+    return result
+
+
+async def bench(n, interval):
+    results = dict()
+    with tempfile.TemporaryDirectory() as directory:
+        read, write = os.pipe()
+        pipe = os.fdopen(write, 'w')
+        ingest = Ingest(())
+        task = asyncio.create_task(ingest.read_pipe(os.fdopen(read), 'pipe'))
+
+        def send_pipe(text, marks):
+            pipe.write(f'{{"text": "{text}", "marks": {{"asr_finish": {marks["asr_finish"]}}}}}\n')
+            pipe.flush()
+
+        results['pipe'] = await latencies(ingest, send_pipe, n, interval)
+        pipe.close()
+        await task
+
+        for address in (f"unix://{Path(directory) / 'atc.sock'}", "udp://127.0.0.1:47474"):
+            ingest = Ingest([address])
+            await ingest.start()
+            sender = Sender(address)
+            results[address.split(':')[0]] = await latencies(ingest, sender.send, n, interval)
+            sender.close()
+            ingest.close()
+    return results
+
+
+def main(args):
+    results = asyncio.get_event_loop().run_until_complete(bench(args.number, args.interval))
+    for source, samples in results.items():
+        samples.sort()
+        print(f"{source:5s} median {statistics.median(samples):6.3f}ms  "
+              f"p99 {samples[int(0.99 * (len(samples) - 1))]:6.3f}ms  max {samples[-1]:6.3f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency from an ASR process sending a transcript to the controller")
+    parser.add_argument('-n', '--number', type=int, default=500,
+                        help="Transcripts per source. Default: 500")
+    parser.add_argument('-i', '--interval', type=float, default=0.002,
+                        help="Seconds between transcripts. Default: 0.002")
+    main(parser.parse_args())
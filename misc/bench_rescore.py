@@ -0,0 +1,50 @@
+import argparse
+import random
+import time
+
+from dronebot.audiostore import read_csv
+from dronebot.rescore import Rescorer
+
+CALL_SIGN = "cityairbus1234"
+
+# typical DeepSpeech confusions of the phraseology, applied to the best candidate
+CONFUSIONS = [("cityairbus", "city airbus"), ("four", "for"), ("two", "to"), ("cleared", "clear it"),
+              ("climb", "come"), ("contact", "contract"), ("proceed", "precede"), ("land", "lend")]
+
+
+def n_best(transcript, n, rng):
+    """Candidates as the decoder might return them: the first ones garbled, the right reading somewhere below."""
+    candidates = list()
+    for _ in range(n - 1):
+        text = transcript
+        for wrong, heard in rng.sample(CONFUSIONS, 2):
+            text = text.replace(wrong, heard, 1)
+        candidates.append(text)
+    candidates.insert(rng.randrange(n), transcript)
+    return [(text, -10.0 - rank) for rank, text in enumerate(candidates)], transcript
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    transcripts = [transcript for _, _, transcript in read_csv(args.csv)]
+    rescorer = Rescorer(CALL_SIGN)
+    lists = [n_best(transcript, args.candidates, rng) for _ in range(args.repeat) for transcript in transcripts]
+    started = time.perf_counter()
+    chosen = [rescorer.choose(candidates)[0] for candidates, _ in lists]
+    elapsed = time.perf_counter() - started
+    correct = sum(text == transcript for text, (_, transcript) in zip(chosen, lists))
+    print(f"{len(lists)} transmissions with {args.candidates} candidates: "
+          f"{elapsed / len(lists) * 1000:.2f}ms per transmission, right reading chosen {correct} times")
+    print(rescorer.report())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Speed and rescue rate of the N-best grammar rescoring")
+    parser.add_argument('--csv', default='training/all.csv',
+                        help="Transcripts to garble into N-best lists. Default: training/all.csv")
+    parser.add_argument('-n', '--candidates', type=int, default=5,
+                        help="Candidates per transmission. Default: 5")
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help="N-best lists per transcript. Default: 3")
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    main(parser.parse_args())
@@ -1,4 +1,4 @@
-python3 dronebot/mic_vad_streaming.py \
+python3 -m dronebot.mic_vad_streaming \
 -m models/deepspeech-0.9.3-models.pbmm \
 -s models/srs3.scorer \
 -d "$1" -r 44100 -k
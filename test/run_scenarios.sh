@@ -0,0 +1,2 @@
+source venv/bin/activate
+python3 -m dronebot.scenario test/scenarios/*.yaml